@@ -11,7 +11,27 @@ Example instructions / workflow:
 >>> filename = 'opacTiO'
 >>> add_overlap(filename)
 
-And that should work!
+And that should work! The overlap can also be included while chunking, which saves
+a second pass over every chunk:
+
+>>> chunk_wavelengths(file, wav_per_chunk=2598, v_max=11463.5)
+
+Several species on the same wavelength grid can be chunked at once, one per core:
+
+>>> files = ['opacH2O/opacH2O.dat', 'opacTiO/opacTiO.dat', 'opacFe/opacFe.dat']
+>>> chunk_species(files, wav_per_chunk=2598, v_max=11463.5, CIA_file='opacCIA/opacCIA_highres.dat')
+
+Instead of a fixed number of wavelengths per chunk, chunks can be planned to take about
+the same time to run, using how long the chunks of a previous run took:
+
+>>> edges = plan_chunks(get_lams('opacFe.dat'), target_walltime=3000, timings=(old_edges, seconds))
+>>> save_chunk_plan(edges)  # chunk_plan.txt, to chunk with the same plan again later
+>>> chunk_species(files, chunk_edges=edges, v_max=11463.5)
+
+Chunking writes a manifest next to the chunks (e.g. opacFe_manifest.json). The job array
+reads the number of chunks from it, so it must be copied or linked to chunk_manifest.json
+in the job directory (see example_cluster_files/deepthought_script_doppler_on.sh).
+Virtual chunks (plan_chunk_views) get their own manifest, e.g. opacFe_views_manifest.json.
 
 There's some replicated (and likely unnecessary) code, but it hopefully shouldn't 
 be too confusing. Furthermore, these functions have not been subjected to robust
@@ -20,34 +40,64 @@ that's the case, and I'd be happy to debug :)
 
 author: @arjunsavel
 """
+import json
 import os
+import time
+from multiprocessing import Pool
 
 import numpy as np
 
+from interpolate_CIA import chunk_wavelengths_CIA, get_CIA_wavelengths
+
+from opacity_io import (
+    ChunkWriter,
+    RTWriter,
+    detect_text_format,
+    file_checksum,
+    get_size,
+    is_store,
+    iter_opacity_blocks,
+    iter_raw_blocks,
+    load_chunk_manifest,
+    load_index,
+    manifest_path,
+    number_format,
+    read_header,
+    open_store,
+    open_text,
+    read_blocks,
+    read_header_text,
+    read_wavelengths,
+    rescale_store,
+    save_chunk_manifest,
+    tqdm,
+    write_chunk_manifest,
+)
 
-try:
-    from tqdm import tqdm
-except ImportError:
-    print(
-        """The current progress bar implementation uses the tqdm package.
-        If you would like to use this progress bar, please see
-        the tqdm installation instruction:
-        https://github.com/tqdm/tqdm#installation"""
-    )
-
-    def tqdm(iterator, **kwargs):
-        return iterator
 
 ######################## Pt. 1: chunking opacities ########################
 
 
-def chunk_wavelengths(file, nchunks=None, wav_per_chunk=None, adjust_wavelengths=False):
+def chunk_wavelengths(
+    file,
+    nchunks=None,
+    wav_per_chunk=None,
+    adjust_wavelengths=False,
+    v_max=None,
+    overlap_pad=20,
+    overlap_previous=False,
+    chunk_edges=None,
+    progress=True,
+):
     """
-    Performs wavelength-chunking.
+    Performs wavelength-chunking, optionally including the overlap needed by the
+    Doppler-on version of the RT code (what add_overlap adds after the fact).
 
     Inputs
     -------
-        :file: path to file to be chunked. e.g., 'opacFe.dat'.
+        :file: path to file to be chunked. e.g., 'opacFe.dat'. May also be a binary
+                        store made by opacity_io.text_to_store, e.g. 'opacFe.store', or a
+                        quantized one made by opacity_io.quantize_store, e.g. 'opacFe.qstore'.
 
         :nchunks: (int or None) Number of chunks to use, splitting the opacity file
                         into roughly even chunks. If None, wav_per_chunk must be specified.
@@ -58,123 +108,209 @@ def chunk_wavelengths(file, nchunks=None, wav_per_chunk=None, adjust_wavelengths
         :adjust_wavelengths: (bool) whether or not to scale from CGS to MKS. For most situations,
                         can be kept false.
 
+        :v_max: (float or None) maximum velocity that will be Doppler-shifted to in the
+                        RT code [m/s]. If given, each chunk also gets the wavelengths of
+                        the next chunk within 2 * v_max (see add_overlap). e.g. 11463.5.
+
+        :overlap_pad: (int) extra wavelength points of overlap to include, to be safe!
+
+        :overlap_previous: (bool) whether each chunk should also get the overlap from the
+                        end of the previous chunk (see add_previous). Only used with v_max.
+
+        :chunk_edges: (np.array or None) chunk plan to use instead of nchunks or
+                        wav_per_chunk: index of the first wavelength of each chunk, followed
+                        by the number of wavelengths (as returned by get_chunk_edges).
+
+        :progress: (bool) whether or not to include a progress bar (if tqdm is installed).
+
     Outputs
     -------
         None
 
     Side effects
     -------------
-        Creates a number of files in same directory as file, titled file*.dat.
+        Creates a number of files in same directory as file, titled file*.dat, and a
+        manifest of them, titled file_manifest.json. Existing chunk files are overwritten.
     """
-    if nchunks and wav_per_chunk:
-        print(
-            "Both nchunks and wav_per_chunk specified. Will default to specified wav_per_chunk."
-        )
-    if not nchunks and not wav_per_chunk:
-        raise ValueError(
-            "Cannot set nchunks and wav_per_chunk to None! One must be specified."
-        )
-
-    if not wav_per_chunk:
-        num_wavelengths = count_wavelengths(file)
-        wav_per_chunk = round(num_wavelengths / nchunks)
+    wavelengths = get_lams(file)
+    edges, starts, stops = get_chunk_index_ranges(
+        file, wavelengths, nchunks, wav_per_chunk, v_max, overlap_pad, overlap_previous, chunk_edges
+    )
 
     header = get_header(file)
 
-    # now get chunks
+    # now get chunks, streaming through the opacity file once. A wavelength block is
+    # written to every chunk whose range (overlap included) holds it, and a chunk is
+    # finished as soon as its range has been passed.
+    with ChunkWriter(file, header) as writer:
+        first_open = 0
+
+        for ticker, (wavelength, lines) in enumerate(iter_raw_blocks(file, progress=progress)):
+            if adjust_wavelengths:
+                lines = [
+                    adjust_wavelength_unit(x, 1e-4, style="full")
+                    if len(x.split(" ")) == 48  # this is ntemp, I believe
+                    else x
+                    for x in lines
+                ]
+
+            file_suffix = first_open
+            while file_suffix < len(starts) and starts[file_suffix] <= ticker:
+                if ticker < stops[file_suffix]:
+                    writer.write(file_suffix, lines)
+                file_suffix += 1
+
+            while first_open < len(stops) and stops[first_open] <= ticker + 1:
+                writer.close(first_open)
+                first_open += 1
+
+    write_chunk_manifest(file, wavelengths, starts, stops, edges, writer.checksums)
 
-    f = open(file)
-    f1 = f.readlines()
+    return
 
-    ticker = 0
-    file_suffix = 0
 
-    # read through all lines in the opacity file
-    for x in tqdm(f1):
+def get_chunk_index_ranges(
+    file,
+    wavelengths,
+    nchunks=None,
+    wav_per_chunk=None,
+    v_max=None,
+    overlap_pad=20,
+    overlap_previous=False,
+    chunk_edges=None,
+):
+    """
+    Works out the range of wavelengths of every chunk, as chunk_wavelengths lays them out.
+    Inputs are as in chunk_wavelengths, plus the wavelength grid of file.
 
-        if not x:
-            continue
-        commad = x.replace(" ", ",")
-        try:
-            if len(np.array([eval(commad)]).flatten()) == 1:  # if a wavelength line
-                ticker += 1
-            elif (
-                len(x.split(" ")) == 48 and adjust_wavelengths
-            ):  # this is ntemp, I believe
-                x = adjust_wavelength_unit(x, 1e-4, style="full")
-        #                pass # don't need to adust wavelengths anymore!
-        except:
-            pdb.set_trace()
-
-        if ticker == wav_per_chunk:
-            file_suffix += 1  # start writing to different file
-            ticker = 0
-            write_to_file(header, file, file_suffix)
-        write_to_file(x, file, file_suffix)
-
-    f.close()
-    return
+    Outputs
+    -------
+        :edges: (np.array) chunk edges without overlap: chunk i holds wavelengths
+                    edges[i]:edges[i + 1], plus its overlap.
+        :starts: (np.array) index of the first wavelength of each chunk, overlap included.
+        :stops: (np.array) index one past the last wavelength of each chunk, overlap included.
+    """
+    if chunk_edges is None:
+        if nchunks and wav_per_chunk:
+            print(
+                "Both nchunks and wav_per_chunk specified. Will default to specified wav_per_chunk."
+            )
+        if not nchunks and not wav_per_chunk:
+            raise ValueError(
+                "Cannot set nchunks and wav_per_chunk to None! One must be specified."
+            )
+
+    if chunk_edges is not None:
+        edges = np.asarray(chunk_edges)
+        if edges[-1] != len(wavelengths):
+            raise ValueError(
+                f"The chunk plan covers {edges[-1]} wavelengths, but {file} has {len(wavelengths)}."
+            )
+    else:
+        if not wav_per_chunk:
+            wav_per_chunk = round(len(wavelengths) / nchunks)
+        edges = get_chunk_edges(len(wavelengths), wav_per_chunk)
 
+    # the wavelength range written to each chunk, overlap included
+    starts = edges[:-1].copy()
+    stops = edges[1:].copy()
+    if v_max:
+        n_previous, n_next = get_overlap_sizes(wavelengths, edges, v_max, overlap_pad)
+        stops += n_next
+        if overlap_previous:
+            starts -= n_previous
 
-def adjust_wavelength_unit(line, scale, style="chunk"):
+    return edges, starts, stops
+
+
+def get_chunk_edges(num_wavelengths, wav_per_chunk):
     """
-    Takes in a line from a file and scales the *opacities* appropriately by the given value.
+    Splits a wavelength grid into chunks of wav_per_chunk wavelengths. The first chunk
+    holds one wavelength fewer than the rest, as chunks have always been laid out.
 
-    Inputs:
-        :line: (str) line from file
-        :scale: (int) base 10 scale (e.g. 1e10) by which to adjust the opacities
+    Inputs
+    -------
+        :num_wavelengths: (int) number of wavelengths in the grid.
+        :wav_per_chunk: (int) number of wavelengths per chunk.
 
     Outputs
-        :returned_line: (str) the newly adjusted line.
+    -------
+        :edges: (np.array) index of the first wavelength of each chunk, followed by
+                    num_wavelengths. Chunk i holds wavelengths edges[i]:edges[i + 1].
     """
-    if "e" in line:
-        sci_note = "e"
-    elif "E" in line:
-        sci_note = "E"
-    else:
-        raise ValueError("Need scientific notation in this line.")
-    scale_reduced = int(np.log10(scale))
-    if style == "chunk":
-        cross_sections = line.split(" ")[1:]
-        cross_sections[-1] = cross_sections[-1][:-1]  # drop then \n
-    else:
-        cross_sections = line.split(" ")[1:-1]  # first is pressure, last is line end
-    for i, cross_section in enumerate(cross_sections):
-        original_scale_str = cross_section.split(sci_note)[1]
-        try:
-            original_scale = eval(original_scale_str)
-        except SyntaxError as e:
-            if "leading zeros" in str(e):
-                original_scale = eval(cross_section.split(sci_note)[1].replace("0", ""))
-            else:
-                raise SyntaxError(e)
-        new_scale = original_scale + scale_reduced
-        new_cross_section = cross_section.replace(original_scale_str, str(new_scale))
-        cross_sections[i] = new_cross_section
-    separator = " "
-    returned_line = line.split(" ")[0] + " " + separator.join(cross_sections) + "\n"
-    return returned_line
+    return np.array(
+        [0] + list(range(wav_per_chunk - 1, num_wavelengths, wav_per_chunk)) + [num_wavelengths]
+    )
 
 
-def write_to_file(line, file, file_suffix):
+def get_overlap_sizes(wavelengths, edges, v_max, overlap_pad=20):
     """
-    Writes (appends, really) a line to a file.
+    Works out how many wavelength points of overlap each chunk needs from its neighbours
+    so that the RT code can Doppler-shift by up to v_max, following add_overlap.
 
-    Inputs:
-        :line: (str) line to write to file.
-        :file: (str) base path to file to be written to. e.g., 'opacFe'
-        :file_suffix: (int) suffix to add, usually chunk number. e.g. 5
+    Inputs
+    -------
+        :wavelengths: (np.array) wavelength grid being chunked.
+        :edges: (np.array) chunk edges, as returned by get_chunk_edges.
+        :v_max: (float) maximum velocity that will be Doppler-shifted to in the RT code [m/s].
+                    Twice this value is used to calculate how much overlap to include.
+        :overlap_pad: (int) extra wavelength points to include, to be safe!
 
-    Outputs:
-        None
+    Outputs
+    -------
+        :n_previous: (np.array) number of points each chunk needs from the end of the
+                    previous chunk. Zero for the first chunk.
+        :n_next: (np.array) number of points each chunk needs from the start of the
+                    next chunk. Zero for the last chunk.
+    """
+    c = 3e8  # m/s
+    nchunks = len(edges) - 1
+    n_previous = np.zeros(nchunks, dtype=int)
+    n_next = np.zeros(nchunks, dtype=int)
 
-    Side effects:
-        Writes a line to a file!
+    for i in range(nchunks - 1):
+        curr_lams = wavelengths[edges[i] : edges[i + 1]]
+        next_lams = wavelengths[edges[i + 1] : edges[i + 2]]
+
+        # delta_lambda/lambda = v/c, on either side of the chunk
+        max_curr_lam = np.max(curr_lams)
+        delta_lam = 2 * max_curr_lam * v_max / c
+        n_next[i] = np.argmin(np.abs(next_lams - (max_curr_lam + delta_lam))) + overlap_pad
+
+        min_next_lam = np.min(next_lams)
+        delta_lam = 2 * min_next_lam * v_max / c
+        n_previous[i + 1] = (
+            len(curr_lams) - np.argmin(np.abs(curr_lams - (min_next_lam - delta_lam))) + overlap_pad
+        )
+
+    # can't overlap past the neighbouring chunk
+    chunk_sizes = np.diff(edges)
+    n_next[:-1] = np.minimum(n_next[:-1], chunk_sizes[1:])
+    n_previous[1:] = np.minimum(n_previous[1:], chunk_sizes[:-1])
+
+    return n_previous, n_next
+
+
+def adjust_wavelength_unit(line, scale, style="chunk"):
+    """
+    Takes in a line from a file and scales the *opacities* appropriately by the given value.
+    The numbers are written back out in the same format they were read in.
+
+    Inputs:
+        :line: (str) line from file
+        :scale: (float) value (e.g. 1e10) by which to adjust the opacities
+        :style: (str, 'chunk' or 'full') no longer needed, since the line is split on
+                whitespace; kept so that existing calls still work.
+
+    Outputs
+        :returned_line: (str) the newly adjusted line.
     """
-    true_filename = f"{file[:-4] + str(file_suffix) + '.dat'}"
-    f = open(true_filename, "a")
-    f.write(line)
-    f.close()
+    tokens = line.split()
+    values = np.array(tokens, dtype=np.float64)
+    values[1:] *= scale  # first is pressure
+    line_format = number_format(tokens[0]) + (" " + number_format(tokens[-1])) * (len(tokens) - 1)
+    returned_line = line_format % tuple(values) + "\n"
+    return returned_line
 
 
 def get_header(file):
@@ -187,12 +323,7 @@ def get_header(file):
     Outputs:
         header of file (string)
     """
-
-    f = open(file)
-    f1 = f.readlines()
-    f.close()
-
-    return f1[0] + f1[1]
+    return read_header_text(file)
 
 
 def count_wavelengths(file):
@@ -206,35 +337,26 @@ def count_wavelengths(file):
     --------
         :ticker: (int) number of wavelength points in the file.
     """
-    ticker = 0
-    f = open(file)
-    f1 = f.readlines()
-    ticker = 0
-    f.close()
-    for x in tqdm(f1):
-        commad = x.replace(" ", ",")
-        #     print(eval(commad)) # don't actually use this -- floating point error!
-        try:
-            if len(np.array([eval(commad)]).flatten()) == 1:  # aha! here's the marker.
-                ticker += 1
-        except:
-            pdb.set_trace()
-    return ticker
+    return len(read_wavelengths(file, progress=True))
 
 
-def rescale_opacity_file(file, scale, new_file, style="chunk"):
+def rescale_opacity_file(file, scale, new_file=None, style="chunk"):
     """
     Makes a copy of an opacity file on same wavelength grid, but this time scaled by some scale.
     Problem: I'd multiplied everything by 1e-4, thinking that the opacities weren't in MKS.
 
+    The opacities are rescaled numerically a batch of wavelengths at a time, and written
+    back out in the same number format as the original file. A binary store can instead
+    be rescaled in place.
 
     Inputs
     -------
-        :file: (str) file to open
+        :file: (str) file to open. May also be a binary store, e.g. 'opacTiO.store'.
         :scale: (float) value by which to multiple all the opacities!
-        new_file: (str) new file to write to.
-        :style: (str, 'chunk' or 'full') determines what type of opacity files
-                are being rescaled, which informs the number of spaces per line.
+        :new_file: (str or None) new file to write to. If None, file must be a binary
+                store, which is then rescaled in place.
+        :style: (str, 'chunk' or 'full') no longer needed, since the layout of the lines is
+                read from the file; kept so that existing calls still work.
 
     Outputs
     --------
@@ -242,43 +364,22 @@ def rescale_opacity_file(file, scale, new_file, style="chunk"):
 
     Side effects
     ------------
-        Rewrites file
+        Writes new_file (gzip-compressed if its name ends in .gz), or modifies the store in place.
     """
     if style not in ["chunk", "full"]:
         raise ValueError("Invalid style specified.")
 
-    header = get_header(file)
-    if style == "chunk":
-        line_length = 47
-    else:
-        line_length = (
-            48  # the full opacities have an extra space at the end of each line
-        )
-
-    f = open(file)
-    f1 = f.readlines()
-    f.close()
-
-    ticker = 0
-    for x in tqdm(f1[2:]):  # read through all lines in the opacity file past the header
-
-        # skip blank lines
-        if not x:
-            continue
-
-        # check if a wavelength line
-        commad = x.replace(" ", ",")
-        if len(np.array([eval(commad)]).flatten()) == 1:
-            ticker += 1
-        elif len(x.split(" ")) == line_length:
-            x = adjust_wavelength_unit(x, 1e4)
+    if new_file is None:
+        if not is_store(file):
+            raise ValueError("Only binary stores can be rescaled in place; specify new_file.")
+        rescale_store(file, scale)
+        return
 
-        header += x
+    temperatures, pressures = read_header(file)
 
-    # just write everything to a new_file
-    f = open(new_file, "a")
-    f.writelines(header)
-    f.close()
+    with RTWriter(new_file, get_header(file), detect_text_format(file)) as writer:
+        for wavelengths, opacities in iter_opacity_blocks(file, progress=True):
+            writer.write_blocks(wavelengths, pressures, opacities * scale)
     return
 
 
@@ -295,25 +396,7 @@ def get_lams(file):
     Outputs:
         :wavelengths: (numpy.array) individual wavelength points within the opacity file [m]
     """
-    f = open(file)
-    f1 = f.readlines()
-
-    ticker = 0
-    wavelengths = []
-
-    # read through all lines in the opacity file
-    for x in f1:
-
-        # check if blank line
-        if not x:
-            continue
-
-        # check if a wavelength line
-        commad = x.replace(" ", ",")
-        if len(np.array([eval(commad)]).flatten()) == 1:
-            wavelengths += [eval(x[:-1])]
-    f.close()
-    return np.array(wavelengths)
+    return read_wavelengths(file)
 
 
 def add_lams(max_lam_to_add_ind, file, next_file):
@@ -331,41 +414,30 @@ def add_lams(max_lam_to_add_ind, file, next_file):
     Side effects:
         Modifies file.
     """
-    try:
-        f = open(next_file)
-    except FileNotFoundError:
+    if not os.path.exists(next_file):
         print(f"{next_file} not found. Moving on!")
         return
-    f1 = f.readlines()[2:]  # first two files of opacity are header info
-    f.close()
-    if max_lam_to_add_ind >= len(f1):
-        raise IndexError("Try choosing a larger chunk size.")
 
+    # first two lines of opacity are header info, which iter_raw_blocks skips. A short
+    # next_file (e.g. the last chunk) is added in full.
+    lines_to_add = []
     ticker = 0
-
-    # read through all lines in the opacity file
-    for x in f1:
-
-        # skip blank lines
-        if not x:
-            continue
-
-        # check if wavelength line
-        commad = x.replace(" ", ",")
-        if len(np.array([eval(commad)]).flatten()) == 1:
-            ticker += 1
-
-        # append to file
-        f2 = open(file, "a")
-        f2.write(x)
-        f2.close()
+    for wavelength, lines in iter_raw_blocks(next_file):
         if ticker == max_lam_to_add_ind:
-            return
+            break
+        lines_to_add += lines
+        ticker += 1
+
+    # append to file
+    f2 = open(file, "a")
+    f2.writelines(lines_to_add)
+    f2.close()
 
 
 def add_previous(num_to_add, file, previous_file):
     """
-    Adds a certain number of wavelength points to a file from a previous one.
+    Adds a certain number of wavelength points to the start of a file from the end of a
+    previous one.
 
     Inputs:
         :num_to_add: (int) number of wavelength points to add from one file to the other.
@@ -378,32 +450,22 @@ def add_previous(num_to_add, file, previous_file):
     Side effects:
         Modifies file.
     """
-    try:
-        f = open(previous_file)
-    except FileNotFoundError:
-        print(f"{next_file} not found. Moving on!")
+    if not os.path.exists(previous_file):
+        print(f"{previous_file} not found. Moving on!")
         return
 
-    f1 = f.readlines()[2:]  # first two files of opacity are header info
-    f.close()
-
-    ticker = 0
-
-    # read through all lines in the opacity file
-    for x in f1[::-1]:
-        if not x:
-            continue
-
-        commad = x.replace(" ", ",")
-        if len(np.array([eval(commad)]).flatten()) == 1:  # if a wavelength line
-            ticker += 1
+    num_previous = count_wavelengths(previous_file)
 
-        # append line to file
-        f2 = open(file, "a")
-        f2.write(x)
-        f2.close()
-        if ticker == num_to_add:
-            return
+    # write to a temporary file first, since file is being read from
+    tmp_file = file + ".tmp"
+    with open(tmp_file, "w") as f:
+        f.write(get_header(file))
+        for ticker, (wavelength, lines) in enumerate(iter_raw_blocks(previous_file)):
+            if ticker >= num_previous - num_to_add:
+                f.writelines(lines)
+        for wavelength, lines in iter_raw_blocks(file):
+            f.writelines(lines)
+    os.replace(tmp_file, file)
 
 
 def add_overlap(filename, v_max=11463.5):
@@ -411,8 +473,6 @@ def add_overlap(filename, v_max=11463.5):
     Adds overlap from file n+1 to file n. The last file has nothing added to it. This
     step is necessary for the Doppler-on version of the RT code.
 
-    ***Assumes that the current directory only has files labeled 'filename*.dat'***
-
     Inputs:
         :filename: (str) "base name" of the opacity chunks. e.g., 'opacFe', corresponding to
                         'opacFe*.dat'.
@@ -427,11 +487,16 @@ def add_overlap(filename, v_max=11463.5):
         None
 
     Side effects:
-        Modifies every 'filename*.dat' file.
+        Modifies every 'filename*.dat' file, and 'filename_manifest.json' if there is one.
     """
-    for i in tqdm(
-        range(len(os.listdir()[:-1])), position=0, leave=True
-    ):  # don't include the last file
+    # count the chunks by name rather than with os.listdir(), which also sees the
+    # original file and any .idx files that reading the chunks leaves behind
+    nchunks = 0
+    while os.path.exists(filename + str(nchunks) + ".dat"):
+        nchunks += 1
+
+    added = {}
+    for i in tqdm(range(nchunks - 1), position=0, leave=True):  # don't include the last file
         file = filename + str(i) + ".dat"
 
         next_file = filename + str(i + 1) + ".dat"
@@ -456,3 +521,404 @@ def add_overlap(filename, v_max=11463.5):
         )
 
         add_lams(max_lam_to_add_ind, file, next_file)
+        added[i] = min(max_lam_to_add_ind, len(next_lams))
+
+    # keep the manifest (if chunk_wavelengths wrote one) in step with the chunks
+    if os.path.exists(manifest_path(filename)):
+        manifest = load_chunk_manifest(filename)
+        for i, num_added in added.items():
+            chunk = manifest["chunks"][i]
+            chunk["overlap_next"] += int(num_added)
+            chunk["checksum"] = file_checksum(filename + str(i) + ".dat")
+        save_chunk_manifest(manifest, filename)
+
+
+######################## Pt. 3: planning chunks ##################
+
+
+def plan_chunks(
+    wavelengths,
+    target_walltime=None,
+    nchunks=None,
+    timings=None,
+    seconds_per_wavelength=None,
+    point_costs=None,
+):
+    """
+    Plans chunk edges so that every chunk is expected to take about as long to run in the
+    RT code, rather than holding the same number of wavelengths. That keeps one slow chunk
+    from setting the time limit of the whole job array.
+
+    The expected runtime of each wavelength point comes from timings of a previous run
+    (spread evenly over the points of each old chunk), or else from seconds_per_wavelength.
+    It can be weighted further by point_costs, e.g. the number of species with significant
+    opacity at each wavelength.
+
+    Inputs
+    -------
+        :wavelengths: (np.array) wavelength grid to be chunked. e.g., get_lams('opacFe.dat')
+        :target_walltime: (float or None) longest a chunk should take to run [s]. Sets the
+                        number of chunks. If None, nchunks must be specified.
+        :nchunks: (int or None) number of chunks, if target_walltime isn't given.
+        :timings: (tuple or None) (old_edges, seconds): the chunk edges of a previous run on
+                        this wavelength grid, and how long each of those chunks took [s].
+        :seconds_per_wavelength: (float or None) runtime per wavelength point, used when
+                        there are no timings [s]. Needed with target_walltime if timings is None.
+        :point_costs: (np.array or None) relative cost of each wavelength point.
+
+    Outputs
+    -------
+        :edges: (np.array) index of the first wavelength of each chunk, followed by the
+                        number of wavelengths, as taken by chunk_wavelengths(chunk_edges=...).
+    """
+    num_wavelengths = len(wavelengths)
+
+    if timings is not None:
+        old_edges, seconds = timings
+        old_edges = np.asarray(old_edges)
+        if old_edges[-1] != num_wavelengths:
+            raise ValueError("timings must come from a run on the same wavelength grid.")
+        costs = np.repeat(np.asarray(seconds, dtype=float) / np.diff(old_edges), np.diff(old_edges))
+    elif seconds_per_wavelength is not None:
+        costs = np.full(num_wavelengths, float(seconds_per_wavelength))
+    elif target_walltime is None:
+        costs = np.ones(num_wavelengths)
+    else:
+        raise ValueError("A target_walltime needs either timings or seconds_per_wavelength.")
+
+    if point_costs is not None:
+        costs = costs * point_costs
+
+    cumulative_cost = np.cumsum(costs)
+    total_cost = cumulative_cost[-1]
+
+    if target_walltime is not None:
+        # the summed costs carry rounding error, which mustn't cost a whole extra chunk
+        max_cost = target_walltime * (1 + 1e-9)
+        if np.max(costs) > max_cost:
+            raise ValueError("A single wavelength is expected to take longer than target_walltime.")
+        nchunks = int(np.ceil(total_cost / max_cost))
+    elif not nchunks:
+        raise ValueError("Cannot set target_walltime and nchunks to None! One must be specified.")
+
+    # close each chunk where the running cost reaches its share of the total. Rounding to
+    # whole wavelengths can push a chunk over the target, in which case use one more chunk.
+    cost_at_edges = np.concatenate([[0], cumulative_cost])
+    while True:
+        targets = total_cost * np.arange(1, nchunks) / nchunks
+        inner_edges = np.searchsorted(cumulative_cost, targets, side="right")
+        edges = np.unique(np.concatenate([[0], inner_edges, [num_wavelengths]]))
+
+        if target_walltime is None or np.all(np.diff(cost_at_edges[edges]) <= max_cost):
+            return edges
+        nchunks += 1
+
+
+def save_chunk_plan(edges, file="chunk_plan.txt"):
+    """
+    Saves chunk edges, e.g. from plan_chunks, so that chunking and the job array use the
+    same plan.
+    """
+    np.savetxt(file, edges, fmt="%d")
+
+
+def load_chunk_plan(file="chunk_plan.txt"):
+    """
+    Loads chunk edges saved by save_chunk_plan.
+    """
+    return np.loadtxt(file, dtype=int, ndmin=1)
+
+
+def stitch_chunks(spectra, manifest):
+    """
+    Stitches the spectra computed on each chunk back together, keeping each wavelength only
+    from the chunk it belongs to, so the overlap between chunks is dropped.
+
+    Inputs
+    -------
+        :spectra: (dict) maps chunk index to (wavelengths, values) computed on that chunk.
+                        Missing chunks are skipped.
+        :manifest: (str or dict) chunk manifest, or path to it. e.g., 'opacFe_manifest.json'
+
+    Outputs
+    -------
+        :wavelengths: (np.array) wavelengths of the stitched spectrum
+        :values: (np.array) values of the stitched spectrum
+    """
+    if isinstance(manifest, str):
+        manifest = load_chunk_manifest(manifest)
+
+    wavelengths = []
+    values = []
+    for chunk in manifest["chunks"]:
+        if chunk["index"] not in spectra:
+            continue
+        chunk_wavelengths, chunk_values = (np.asarray(x) for x in spectra[chunk["index"]])
+        in_chunk = (chunk_wavelengths >= chunk["first_wavelength"]) & (
+            chunk_wavelengths <= chunk["last_wavelength"]
+        )
+        wavelengths.append(chunk_wavelengths[in_chunk])
+        values.append(chunk_values[in_chunk])
+
+    return np.concatenate(wavelengths), np.concatenate(values)
+
+######################## Pt. 4: chunking many species ##################
+
+
+def chunk_species(
+    files,
+    nchunks=None,
+    wav_per_chunk=None,
+    chunk_edges=None,
+    processes=None,
+    CIA_file=None,
+    **chunk_kwargs,
+):
+    """
+    Chunks a number of opacity files that share a wavelength grid, with the same chunk plan,
+    running the species concurrently on a pool of processes. The wavelength grids are
+    checked against each other before anything is written.
+
+    Inputs
+    -------
+        :files: (list of str) paths to the opacity files (or binary stores) to be chunked.
+                        e.g., ['opacH2O/opacH2O.dat', 'opacTiO/opacTiO.dat']
+        :nchunks: (int or None) number of chunks, as in chunk_wavelengths.
+        :wav_per_chunk: (int or None) number of wavelengths per chunk, as in chunk_wavelengths.
+        :chunk_edges: (np.array or None) chunk plan to use instead of nchunks or wav_per_chunk,
+                        as in chunk_wavelengths.
+        :processes: (int or None) maximum number of species to chunk at once. Defaults to
+                        the number of cores.
+        :CIA_file: (str or None) path to an interpolated CIA file (e.g. opacCIA_highres.dat)
+                        to chunk with the same plan, overlap included, alongside the species.
+                        It has to be on the same wavelength grid as the species.
+        :chunk_kwargs: passed on to chunk_wavelengths. e.g., v_max=11463.5.
+
+    Outputs
+    -------
+        :chunk_edges: (np.array) the chunk plan that was used.
+
+    Side effects
+    -------------
+        Creates the chunk files of every species next to its opacity file.
+    """
+    if processes is None:
+        processes = os.cpu_count()
+    processes = max(1, min(processes, len(files) + bool(CIA_file)))
+
+    with Pool(processes) as pool:
+        # fail fast: every species has to be on the same wavelength grid
+        grids = pool.map(get_lams, files)
+        mismatched = [
+            file for file, grid in zip(files, grids) if not np.array_equal(grid, grids[0])
+        ]
+        if CIA_file and not np.array_equal(get_CIA_wavelengths(CIA_file), grids[0]):
+            mismatched.append(CIA_file)
+        if mismatched:
+            raise ValueError(
+                f"{', '.join(mismatched)} not on the same wavelength grid as {files[0]}."
+            )
+
+        if chunk_edges is None and not wav_per_chunk and not nchunks:
+            raise ValueError(
+                "Cannot set nchunks, wav_per_chunk and chunk_edges to None! One must be specified."
+            )
+        # the species and the CIA get the same chunk ranges, overlap included
+        chunk_edges, starts, stops = get_chunk_index_ranges(
+            files[0],
+            grids[0],
+            nchunks,
+            wav_per_chunk,
+            chunk_kwargs.get("v_max"),
+            chunk_kwargs.get("overlap_pad", 20),
+            chunk_kwargs.get("overlap_previous", False),
+            chunk_edges,
+        )
+
+        tasks = [(file, chunk_edges, chunk_kwargs) for file in files]
+        if CIA_file:
+            tasks += [(CIA_file, chunk_edges, None, (starts, stops))]
+
+        start = time.time()
+        for i, (file, num_wavelengths, seconds) in enumerate(
+            pool.imap_unordered(_chunk_one_species, tasks)
+        ):
+            megabytes = get_size(file) / 1e6
+            print(
+                f"[{i + 1}/{len(tasks)}] chunked {file} into {len(chunk_edges) - 1} chunks: "
+                f"{num_wavelengths / seconds:.0f} wavelengths/s, {megabytes / seconds:.1f} MB/s"
+            )
+        print(f"Chunked {len(tasks)} files in {time.time() - start:.1f} s.")
+
+    return chunk_edges
+
+
+def _chunk_one_species(task):
+    """
+    Chunks a single file for chunk_species. kwargs of None marks the CIA file, which
+    comes with the (starts, stops) of its chunks.
+    """
+    file, chunk_edges, kwargs = task[:3]
+    start = time.time()
+    if kwargs is None:
+        chunk_wavelengths_CIA(file, chunk_edges=chunk_edges, chunk_ranges=task[3], progress=False)
+    else:
+        chunk_wavelengths(file, chunk_edges=chunk_edges, progress=False, **kwargs)
+    return file, chunk_edges[-1], time.time() - start
+
+
+######################## Pt. 5: virtual chunks ##################
+def plan_chunk_views(
+    file,
+    nchunks=None,
+    wav_per_chunk=None,
+    v_max=None,
+    overlap_pad=20,
+    overlap_previous=False,
+    chunk_edges=None,
+    progress=True,
+):
+    """
+    Chunks an opacity file (or binary store) virtually: writes the chunk manifest that
+    chunk_wavelengths would, under its own name (e.g. opacFe_views_manifest.json), but no
+    chunk files. The chunks are then read straight from
+    file with ChunkViews, and only written out where and when a job needs them. Since
+    only the wavelengths are read (from the index, once it exists), re-chunking takes seconds.
+
+    Inputs are as in chunk_wavelengths.
+
+    Outputs
+    -------
+        :manifest_file: (str) path to the manifest. e.g., 'opacFe_views_manifest.json'
+    """
+    wavelengths = read_wavelengths(file, progress=progress)
+    edges, starts, stops = get_chunk_index_ranges(
+        file, wavelengths, nchunks, wav_per_chunk, v_max, overlap_pad, overlap_previous, chunk_edges
+    )
+    return write_chunk_manifest(file, wavelengths, starts, stops, edges, {}, virtual=True)
+
+
+class ChunkViews:
+    """
+    The chunks of a master opacity file or store, as laid out by its chunk manifest, read
+    without any chunk file having to exist.
+
+    Indexing gives a chunk's wavelengths and opacities, overlap included. From a binary store
+    these are slices of its memmap, so nothing is copied or read until used; from a text file
+    only the chunk's blocks are read, by seeking to them through the file's index.
+    materialize writes a chunk out as the chunk file chunk_wavelengths would have written,
+    e.g. into node-local scratch just before a job runs.
+
+    Example:
+
+    >>> views = ChunkViews('opacFe_views_manifest.json')
+    >>> wavelengths, opacities = views[5]
+    >>> views.materialize(5, '/tmp/opacFe')  # writes /tmp/opacFe/opacFe5.dat
+    """
+
+    def __init__(self, manifest, master=None):
+        """
+        Inputs
+        -------
+            :manifest: (str) path to the chunk manifest, or to the master file (or its base name).
+                        e.g., 'opacFe_views_manifest.json' or 'opacFe.store'. A file
+                        name is taken to mean its virtual chunks' manifest.
+            :master: (str or None) path to the master opacity file or store. Defaults to the
+                        source of the manifest, next to the manifest.
+        """
+        manifest_file = manifest if manifest.endswith(".json") else manifest_path(manifest, True)
+        self.manifest = load_chunk_manifest(manifest_file)
+        if master is None:
+            master = os.path.join(os.path.dirname(manifest_file), self.manifest["source"])
+        self.master = master
+
+    def __len__(self):
+        return self.manifest["nchunks"]
+
+    def range(self, index):
+        """
+        Returns the range of wavelengths of a chunk, overlap included, as (start, stop).
+        """
+        chunk = self.manifest["chunks"][index]
+        return chunk["start"] - chunk["overlap_previous"], chunk["stop"] + chunk["overlap_next"]
+
+    def __getitem__(self, index):
+        """
+        Returns (wavelengths, opacities) of a chunk, overlap included, with opacities shaped
+        (wavelength, pressure, temperature).
+        """
+        start, stop = self.range(index)
+        return read_blocks(self.master, start, stop)
+
+    def path(self, index, directory=None):
+        """
+        Returns where a chunk is materialized: its file in the manifest, in directory (default
+        next to the master).
+        """
+        if directory is None:
+            directory = os.path.dirname(self.master)
+        return os.path.join(directory, self.manifest["chunks"][index]["file"])
+
+    def materialize(self, index, directory=None):
+        """
+        Writes a chunk out as an RT-format chunk file, unless it's already there. Next to the
+        chunk file goes a record of what it holds (e.g. opacFe5.dat.view.json): its master,
+        wavelength range and checksum. An existing chunk file is only reused if its record
+        matches this chunk and its checksum still holds; otherwise it is rewritten.
+
+        Inputs
+        -------
+            :index: (int) index of the chunk.
+            :directory: (str or None) where to write the chunk file. Defaults to next to the master.
+
+        Outputs
+        -------
+            :file: (str) path to the chunk file. e.g., '/tmp/opacFe/opacFe5.dat'
+        """
+        file = self.path(index, directory)
+        start, stop = self.range(index)
+        record = {"master": os.path.abspath(self.master), "start": int(start), "stop": int(stop)}
+        if self._is_materialized(file, record):
+            return file
+        if os.path.dirname(file):
+            os.makedirs(os.path.dirname(file), exist_ok=True)
+        if os.path.exists(file + ".view.json"):
+            os.remove(file + ".view.json")
+
+        with RTWriter(file, read_header_text(self.master)) as writer:
+            if is_store(self.master):
+                store = open_store(self.master)
+                writer.text_format = store.text_format
+                for batch in range(start, stop, 4096):
+                    batch_stop = min(batch + 4096, stop)
+                    writer.write_blocks(
+                        store.wavelengths[batch:batch_stop],
+                        store.pressures,
+                        store.opacities[batch:batch_stop],
+                    )
+            else:
+                # copy the chunk's blocks as they are, exactly as chunk_wavelengths does
+                offsets = load_index(self.master).offsets
+                with open_text(self.master, "rb") as f:
+                    f.seek(offsets[start])
+                    writer.write(f.read(offsets[stop] - offsets[start]).decode())
+
+        record["checksum"] = file_checksum(file)
+        with open(file + ".view.json", "w") as f:
+            json.dump(record, f, indent=1)
+        return file
+
+    @staticmethod
+    def _is_materialized(file, record):
+        """
+        Checks whether file is a chunk written by materialize for record, and unchanged since.
+        """
+        if not (os.path.exists(file) and os.path.exists(file + ".view.json")):
+            return False
+        try:
+            with open(file + ".view.json") as f:
+                written = json.load(f)
+        except ValueError:
+            return False
+        checksum = written.pop("checksum", None)
+        return written == record and checksum == file_checksum(file)
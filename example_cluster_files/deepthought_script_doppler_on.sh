@@ -8,7 +8,13 @@
 # The -t flag is the time specifier. I usually give it ~15% longer than I expect it to
 # take on the given CPU, just in case. The only penalty for making your time too long is
 # that it takes longer to get off the queue, whereas the penalty for making your time
-# too short is that you lose all your output!
+# too short is that you lose all your output! If the chunks were planned with
+# chunking_utils.plan_chunks, every chunk should take about target_walltime, so that
+# (+15%) is what goes here.
+# If the chunks were only planned (chunking_utils.plan_chunk_views), no chunk files exist;
+# chunking_utils.ChunkViews(manifest).materialize(chunk, directory) writes a job's chunk
+# into node-local scratch just before it runs. Their manifest is <species>_views_manifest.json
+# (e.g. opacFe/opacFe_views_manifest.json), so link that to chunk_manifest.json instead.
 
 # The --mem-per-cpu flag species how much memory (in megabytes) you want assigned
 # to your job. I arrived at this number by trial and error!
@@ -41,6 +47,11 @@ cd /lustre/asavel/wasp_76
 # activate my environment
 source wasp_76_env/bin/activate
 
+# run_RT_deepthought.py reads the number of chunks from chunk_manifest.json, next to it.
+# Point that at the manifest written when the opacities were chunked (<species>_manifest.json,
+# e.g. opacFe/opacFe_manifest.json), every species having been chunked with the same plan.
+ln -sf opacFe/opacFe_manifest.json chunk_manifest.json
+
 # run my script! the args are the job array, doppler on/off, and the number of 
 # jobs that have already been run.
 python3 run_RT_deepthought.py $SLURM_ARRAY_TASK_ID 1 56000
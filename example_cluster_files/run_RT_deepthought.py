@@ -10,6 +10,8 @@ from RT import *
 import march
 from tqdm import tqdm
 import os
+import json
+import numpy as np
 import pdb
 import sys
 from sklearn.model_selection import ParameterGrid
@@ -67,6 +69,12 @@ def run_RT_deepthought():
     and the third is how many spectra have already been computed.
     """
 
+    # the manifest written when chunking the opacities sets how many chunks there
+    # are. <species>_manifest.json (e.g. opacFe_manifest.json) must be copied or
+    # linked to chunk_manifest.json in the job directory, as the sbatch script does
+    with open('chunk_manifest.json') as f:
+        nchunks = json.load(f)['nchunks']
+
     os.chdir('RT_3D_Transmission_Code')
 
 
@@ -75,8 +83,8 @@ def run_RT_deepthought():
 
     # the "already done" parameter must be updated on each job array submission
     already_done = eval(sys.argv[3]) 
-    spectrum_number = (eval(input_val) + already_done) // 113 # wrap at 113 because I have 113 chunks.
-    wave_chunk = (eval(input_val) + already_done) % 113
+    spectrum_number = (eval(input_val) + already_done) // nchunks # wrap at the number of chunks.
+    wave_chunk = (eval(input_val) + already_done) % nchunks
 
 
     ######################################### Set up parameter grid ###################################
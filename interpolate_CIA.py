@@ -9,44 +9,63 @@ Example instructions / workflow:
 >>> interpolate_CIA(CIA_file, reference_file)
 >>> CIA_file = 'opacCIA_highres.dat'
 >>> ref_file_base = '../opacFe/opacFe'
->>> chunk_wavelengths_CIA(CIA_file, ref_file_base)
+>>> chunk_wavelengths_CIA(CIA_file, ref_file_base)  # uses ../opacFe/opacFe_manifest.json
 
-And that should work!
+And that should work! Or, skipping the full opacCIA_highres.dat altogether:
+
+>>> interpolate_and_chunk_CIA('opacCIA.dat', '../opacFe/opacFe')
+
+Anything that runs in the same process as the RT code can skip the files entirely:
+
+>>> evaluator = CIAEvaluator('opacCIA.dat')
+>>> cia = evaluator(wavelengths)  # (temperature, wavelength, pair)
 
 
 author: @arjunsavel
 """
+import hashlib
 import os
+from collections import OrderedDict
+from multiprocessing import Pool
 
 import numpy as np
 
-import pandas as pd
+from opacity_io import (
+    ChunkWriter,
+    RTWriter,
+    format_rows,
+    is_wavelength_line,
+    load_chunk_manifest,
+    manifest_path,
+    read_wavelengths,
+    tqdm,
+    write_chunk_manifest,
+)
 
-from glob import glob
 
+# the collision pairs held by a CIA file, in the order of its columns (after the
+# wavelength column). Hel is H- (bound-free and free-free), HeH is He-, and the rest are
+# the named pairs, e.g. H2He is H2-He.
+CIA_PAIRS = ("Hel", "HeH", "CH4CH4", "H2He", "H2CH4", "H2H", "H2H2", "CO2CO2")
 
-try:
-    from tqdm import tqdm
-except ImportError:
-    print(
-        """The current progress bar implementation uses the tqdm package.
-        If you would like to use this progress bar, please see
-        the tqdm installation instruction:
-        https://github.com/tqdm/tqdm#installation"""
-    )
-
-    def tqdm(iterator, **kwargs):
-        return iterator
+# every CIA chunk file is open at once while chunking, so each gets a modest buffer
+CHUNK_BUFFER_SIZE = 1024 * 1024
 
 
 ######################### Pt. 1: Interpolation ####################################
 
 
-def interpolate_CIA(CIA_file, reference_file):
+def interpolate_CIA(
+    CIA_file, reference_file, new_file=None, temperatures_per_batch=4, progress=True
+):
     """
     Interpolates a CIA file to a higher resolution, using the wavelength grid
-    of a reference file. Note: This function assumes that the CIA file has
-    Hels, HeHs, CH4CH4s, H2Hes, H2CH4s, H2Hs, H2H2s, and CO2CO2s.
+    of a reference file. Note: This function assumes that the CIA file holds
+    the pairs in CIA_PAIRS, in that order.
+
+    Every pair is interpolated at once, a few temperatures at a time, into
+    preallocated arrays, and each batch is written out before the next one is
+    computed, so memory stays at a few batches' worth of the new grid.
 
     Inputs
     ------
@@ -54,6 +73,11 @@ def interpolate_CIA(CIA_file, reference_file):
                     'opacCIA/opacCIA.dat'
         :reference_file: (str) path to opacity file with the wavelength grid of interest. e.g.,
                     'opacFe/opacFe.dat'
+        :new_file: (str or None) where to write the interpolated file. Defaults to
+                    CIA_file with "_highres" attached.
+        :temperatures_per_batch: (int) number of temperatures to interpolate at once. Sets
+                    the memory footprint.
+        :progress: (bool) whether or not to include a progress bar (if tqdm is installed).
 
     Outputs
     -------
@@ -61,154 +85,194 @@ def interpolate_CIA(CIA_file, reference_file):
 
     Side effects
     -------------
-        Creates a file with "hires" attached to the end of CIA_file that has been interpolated
-        to higher resolution.
+        Creates a file with "_highres" attached to the end of CIA_file that has been
+        interpolated to higher resolution.
     """
 
-    real_wavelength_grid = get_wav_grid(reference_file, progress=True)
+    real_wavelength_grid = get_wav_grid(reference_file, progress=progress)
 
-    f = open(CIA_file)
-    f1 = f.readlines()
-    f.close()
+    header = get_header(CIA_file)
+    temperatures, wavelengths, cia = read_CIA_file(CIA_file, progress=progress)
 
-    temperatures = []
-    wavelengths = []
-    Hels = []
-    HeHs = []
-    CH4CH4s = []
-    H2Hes = []
-    H2CH4s = []
-    H2Hs = []
-    H2H2s = []
-    CO2CO2s = []
-
-    # read through all lines in the CIA file
-    for line in tqdm(f1[1:], desc="Reading CIA file"):
-        if not line or line == "\n":
-            continue  # don't want it to break!
-        if len(line.split(" ")) == 1 and line != "\n":  # this is a new temperature
-            temperature = eval(line[:-1])
-            continue  # nothing else on this line
-        values = [eval(value) for value in line.split(" ")[::3][:-1]]
-        temperatures += [temperature]
-        wavelengths += [values[0]]
-        Hels += [values[1]]
-        HeHs += [values[2]]
-        CH4CH4s += [values[3]]
-        H2Hes += [values[4]]
-        H2CH4s += [values[5]]
-        H2Hs += [values[6]]
-        H2H2s += [values[7]]
-        CO2CO2s += [values[8]]
-
-    # easier to slice with a dataframe later on
-    df = pd.DataFrame(
-        {
-            "temp": temperatures,
-            "wav": wavelengths,
-            "Hel": Hels,
-            "HeH": HeHs,
-            "CH4CH4": CH4CH4s,
-            "H2He": H2Hes,
-            "H2CH4": H2CH4s,
-            "H2H": H2Hs,
-            "H2H2": H2H2s,
-            "CO2CO2": CO2CO2s,
-        }
-    )
-
-    # perform interpolation
-
-    interped_Hels = []
-    interped_HeHs = []
-    interped_CH4CH4s = []
-    interped_H2Hes = []
-    interped_H2CH4s = []
-    interped_H2Hs = []
-    interped_H2H2s = []
-    interped_CO2CO2s = []
-    interped_wavelengths = []
-    interped_temps = []
-
-    for unique_temp in tqdm(df.temp.unique()):
-        sub_df = df[df.temp == unique_temp]
-
-        # convert to lists so that they're neatly nested lists
-        interped_Hels += list(np.interp(real_wavelength_grid, sub_df.wav, sub_df.Hel))
-        interped_HeHs += list(np.interp(real_wavelength_grid, sub_df.wav, sub_df.HeH))
-        interped_CH4CH4s += list(
-            np.interp(real_wavelength_grid, sub_df.wav, sub_df.CH4CH4)
-        )
-        interped_H2Hes += list(np.interp(real_wavelength_grid, sub_df.wav, sub_df.H2He))
-        interped_H2CH4s += list(
-            np.interp(real_wavelength_grid, sub_df.wav, sub_df.H2CH4)
-        )
-        interped_H2Hs += list(np.interp(real_wavelength_grid, sub_df.wav, sub_df.H2H))
-        interped_H2H2s += list(np.interp(real_wavelength_grid, sub_df.wav, sub_df.H2H2))
-        interped_CO2CO2s += list(
-            np.interp(real_wavelength_grid, sub_df.wav, sub_df.CO2CO2)
-        )
+    if new_file is None:
+        new_file = CIA_file.split(".dat")[0] + "_highres.dat"
+
+    with RTWriter(new_file, header) as writer:
+        for temperature, values in iter_interpolated_CIA(
+            temperatures, wavelengths, cia, real_wavelength_grid, temperatures_per_batch, progress
+        ):
+            writer.write("{:.9e}".format(temperature) + "\n")
+            writer.write(format_CIA_text(real_wavelength_grid, values))
+
+    return
+
+
+def iter_interpolated_CIA(
+    temperatures, wavelengths, cia, new_wavelengths, temperatures_per_batch=4, progress=False
+):
+    """
+    Interpolates CIA onto a new wavelength grid a batch of temperatures at a time, reusing
+    the same preallocated arrays for every batch.
+
+    Inputs
+    -------
+        :temperatures: (np.array) temperature of each block of cia [K]
+        :wavelengths: (np.array) wavelength grid of cia
+        :cia: (np.array) CIA shaped (temperature, wavelength, pair), as from read_CIA_file
+        :new_wavelengths: (np.array) wavelength grid to interpolate to
+        :temperatures_per_batch: (int) number of temperatures to interpolate at once. Sets
+                    the memory footprint.
+        :progress: (bool) whether or not to include a progress bar (if tqdm is installed).
+
+    Outputs
+    -------
+        Yields (temperature, values) for each temperature, with values shaped
+        (new wavelength, pair). values is overwritten by the next batch, so copy it to
+        keep it.
+    """
+    lower, upper, weights = get_interpolation_weights(wavelengths, new_wavelengths)
+
+    batch_shape = (temperatures_per_batch, len(weights), cia.shape[2])
+    interped = np.empty(batch_shape)
+    scratch = np.empty(batch_shape)
+
+    starts = range(0, len(temperatures), temperatures_per_batch)
+    for start in tqdm(starts, desc="Interpolating CIA") if progress else starts:
+        batch = cia[start : start + temperatures_per_batch]
+        n = len(batch)
+        interpolate_CIA_batch(batch, lower, upper, weights, interped[:n], scratch[:n])
+        yield from zip(temperatures[start : start + n], interped[:n])
+
+
+def get_interpolation_weights(wavelengths, new_wavelengths):
+    """
+    Computes the weights to linearly interpolate from one wavelength grid to another.
+    As with np.interp, values past either end of the grid are held constant.
+
+    Inputs
+    -------
+        :wavelengths: (np.array) increasing wavelength grid to interpolate from
+        :new_wavelengths: (np.array) wavelength grid to interpolate to
+
+    Outputs
+    -------
+        :lower: (np.array) index of the grid point below each new wavelength
+        :upper: (np.array) index of the grid point above each new wavelength
+        :weights: (np.array) weight of the upper grid point for each new wavelength
+    """
+    new_wavelengths = np.asarray(new_wavelengths)
+    upper = np.searchsorted(wavelengths, new_wavelengths, side="right")
+    upper = np.clip(upper, 1, len(wavelengths) - 1)
+    lower = upper - 1
+
+    weights = (new_wavelengths - wavelengths[lower]) / (wavelengths[upper] - wavelengths[lower])
+    return lower, upper, np.clip(weights, 0, 1)
+
+
+def interpolate_CIA_batch(cia, lower, upper, weights, out=None, scratch=None):
+    """
+    Linearly interpolates a batch of CIA onto a new wavelength grid, for every
+    temperature and pair at once.
+
+    Inputs
+    -------
+        :cia: (np.array) CIA shaped (temperature, wavelength, pair)
+        :lower, upper, weights: (np.array) interpolation weights from
+                    get_interpolation_weights
+        :out: (np.array or None) array to write the result to, shaped
+                    (temperature, new wavelength, pair)
+        :scratch: (np.array or None) work array of the same shape as out
 
-        interped_wavelengths += real_wavelength_grid
-        interped_temps += list(np.ones_like(interped_wavelengths) * unique_temp)
+    Outputs
+    -------
+        :out: (np.array) interpolated CIA, shaped (temperature, new wavelength, pair)
+    """
+    shape = (cia.shape[0], len(weights), cia.shape[2])
+    if out is None:
+        out = np.empty(shape)
+    if scratch is None:
+        scratch = np.empty(shape)
 
-    # write to a new file
+    np.take(cia, lower, axis=1, out=out)
+    np.take(cia, upper, axis=1, out=scratch)
+    scratch -= out
+    scratch *= weights[:, np.newaxis]
+    out += scratch
+    return out
 
-    new_string = []
 
+def format_CIA_text(wavelengths, values):
+    """
+    Formats CIA at a single temperature as the lines of a CIA file, a batch of lines at a time.
+
+    Inputs
+    -------
+        :wavelengths: (np.array) wavelength grid
+        :values: (np.array) CIA shaped (wavelength, pair)
+
+    Outputs
+    -------
+        Yields the text of each batch of lines.
+    """
     buffer = "   "  # there's a set of spaces between each string!
-    for i in tqdm(range(len(interped_Hels))):
-
-        # the first line gets different treatment!
-        if i == 0:
-            temp = 500
-            new_string += ["{:.9e}".format(temp) + "\n"]
-        if interped_temps[i] != temp:
-            temp = interped_temps[i]
-            new_string += ["{:.9e}".format(temp) + "\n"]
-        else:
-            wavelength = "{:.9e}".format(interped_wavelengths[i])
-            Hel_string = "{:.9e}".format(interped_Hels[i])
-            HeH_string = "{:.9e}".format(interped_HeHs[i])
-            CH4CH4_string = "{:.9e}".format(interped_CH4CH4s[i])
-            H2He_string = "{:.9e}".format(interped_H2Hes[i])
-            H2CH4_string = "{:.9e}".format(interped_H2CH4s[i])
-            H2H_string = "{:.9e}".format(interped_H2Hs[i])
-            H2H2_string = "{:.9e}".format(interped_H2H2s[i])
-            CO2CO2_string = "{:.9e}".format(interped_CO2CO2s[i])
-            new_string += [
-                wavelength
-                + buffer
-                + Hel_string
-                + buffer
-                + HeH_string
-                + buffer
-                + CH4CH4_string
-                + buffer
-                + H2He_string
-                + buffer
-                + H2CH4_string
-                + buffer
-                + H2H_string
-                + buffer
-                + H2H2_string
-                + buffer
-                + CO2CO2_string
-                + buffer
-                + "\n"
-            ]
-
-    new_string.insert(
-        0,
-        "500.000 600.000 700.000 800.000 900.000 1000.000 1100.000 1200.000 1300.000 1400.000 1500.000 1600.000 1700.000 1800.000 1900.000 2000.000 2100.000 2200.000 2300.000 2400.000 2500.000 2600.000 2700.000 2800.000 2900.000 3000.000 3100.000 3200.000 3300.000 3400.000 3500.000 3600.000 3700.000 3800.000 3900.000 4000.000 4100.000 4200.000 4300.000 4400.000 4500.000 4600.000 4700.000 4800.000 4900.000 5000.000 \n",
-    )
-    new_file = CIA_file.split(".dat")[0]
-    new_file += "_highres.dat"
-    f2 = open(new_file, "w")
-    f2.writelines(new_string)
-    f2.close()
+    row_format = buffer.join(["%.9e"] * (values.shape[1] + 1)) + buffer + "\n"
+    rows = np.column_stack([wavelengths, values])
+    yield from format_rows(rows, row_format)
 
-    return
+
+def read_CIA_file(file, pairs=CIA_PAIRS, progress=False):
+    """
+    Reads a whole CIA file in a single pass.
+
+    A CIA file has a header line (the temperature grid), followed by one block per
+    temperature: a line holding only the temperature, then one line per wavelength
+    holding that wavelength and the CIA of each pair.
+
+    Inputs
+    -------
+        :file: (str) path to CIA file. e.g., 'opacCIA/opacCIA.dat'
+        :pairs: (tuple of str) the collision pairs held by the file, in the order of its
+                    columns.
+        :progress: (bool) whether or not to include a progress bar (if tqdm is installed).
+
+    Outputs
+    -------
+        :temperatures: (np.array) temperature of each block [K]
+        :wavelengths: (np.array) wavelength grid of the file
+        :cia: (np.array) CIA, shaped (temperature, wavelength, pair)
+    """
+    temperatures = []
+    rows_per_temperature = []
+    data_lines = []
+
+    with open(file) as f:
+        f.readline()  # header line
+        for line in tqdm(f, desc=f"Reading {file}") if progress else f:
+            if not line.strip():
+                continue  # don't want it to break!
+            if is_wavelength_line(line):  # this is a new temperature
+                temperatures.append(float(line))
+                rows_per_temperature.append(0)
+                continue  # nothing else on this line
+            if not temperatures:
+                raise ValueError(f"{file} has CIA values before its first temperature line.")
+            data_lines.append(line)
+            rows_per_temperature[-1] += 1
+
+    if len(set(rows_per_temperature)) > 1:
+        raise ValueError(f"{file} does not have the same wavelengths at every temperature.")
+
+    n_columns = len(pairs) + 1  # first column is wavelength
+    values = np.fromstring("".join(data_lines), dtype=np.float64, sep=" ")
+    if values.size != len(data_lines) * n_columns:
+        raise ValueError(f"{file} does not hold a wavelength and {len(pairs)} pairs {pairs} per line.")
+    values = values.reshape(len(temperatures), -1, n_columns)
+
+    wavelengths = values[0, :, 0]
+    if np.any(values[:, :, 0] != wavelengths):
+        raise ValueError(f"{file} does not have the same wavelengths at every temperature.")
+
+    return np.array(temperatures), wavelengths.copy(), values[:, :, 1:]
 
 
 def get_wav_grid(file, progress=False):
@@ -228,101 +292,199 @@ def get_wav_grid(file, progress=False):
                     computed.
     """
 
-    wav_grid = []
-
-    f = open(file)
-    f1 = f.readlines()
-    f.close()
-
-    if progress:
-        iterator = tqdm(f1[2:], desc='Grabbing wavelength grid')
-    else:
-        iterator = f1[2:]
-
-    # read through all lines in the opacity file; first few lines are header!
-    for x in iterator:
-
-        # skip blank lines
-        if not x:
-            continue
-        commad = x.replace(" ", ",")
-
-        # check if a wavelength line
-        if len(np.array([eval(commad)]).flatten()) == 1:
-            wav_grid += [np.array([eval(commad)]).flatten()[0]]
-
-    return wav_grid
+    return read_wavelengths(file, progress=progress)
 
 
 ######################### Pt. 2: Chunking ####################################
 
 
-def chunk_wavelengths_CIA(file, ref_file_base):
+def chunk_wavelengths_CIA(
+    file, ref_file_base=None, chunk_edges=None, manifest=None, chunk_ranges=None, progress=True
+):
     """
     Performs chunking based on the reference file's wavelength chunking.
 
+    The chunk boundaries (and any overlap) are taken from the reference chunks' manifest
+    when there is one, so no reference chunk has to be read. Older reference chunks
+    without a manifest are counted one by one instead.
+
     Inputs
     -------
         :file: (str) path to CIA file that should be chunked. e.g., opacCIA_highres.dat.
         :ref_file_base: (str) path base to a set of reference files that are already chunked
                         on the desired wavelength grid. e.g., ../opacFe/opacFe
-    """
-
-    header = get_header(file)
-
-    # now get chunks
+        :chunk_edges: (np.array or None) chunk plan to use instead of the reference files:
+                        index of the first wavelength of each chunk, followed by the number
+                        of wavelengths (see chunking_utils.get_chunk_edges).
+        :manifest: (str or None) path to the chunk manifest of the reference files, if it
+                        isn't at ref_file_base + '_manifest.json'.
+        :chunk_ranges: (tuple or None) (starts, stops) of each chunk of chunk_edges, overlap
+                        included (see chunking_utils.get_chunk_index_ranges). Without it,
+                        chunks made from chunk_edges get no overlap.
+        :progress: (bool) whether or not to include a progress bar (if tqdm is installed).
 
-    f = open(file)
-    f1 = f.readlines()
-    f.close()
+    Outputs
+    -------
+        None
 
-    ticker = 0
-    file_suffix = 0
+    Side effects
+    -------------
+        Creates a chunk file for each reference chunk, titled file*.dat, each holding the
+        header and that chunk's wavelengths at every temperature, and a manifest of them,
+        titled file_manifest.json.
+    """
 
-    # determine how many wavelengths are in a given chunk
-    if "chunk_list.txt" not in os.listdir():
-        chunk_list = []
-        for i in tqdm(range(113), desc="Putting together chunk list"):
-            chunk_list += [get_wav_per_chunk(i, ref_file_base)]
+    header = get_header(file)
+    chunk_edges, starts, stops, _ = get_chunk_ranges(ref_file_base, chunk_edges, manifest, chunk_ranges)
+    check_CIA_layout(file, stops[-1])
 
-        np.savetxt("chunk_list.txt", chunk_list)
+    nchunks = len(starts)
+    wavelengths = []
 
-    else:
-        chunk_list = np.loadtxt("chunk_list.txt")
+    # now get chunks. The CIA file is ordered by temperature, so every chunk stays open
+    # (with a smaller buffer each) and gets its slice of every temperature in turn.
+    with open(file) as f, ChunkWriter(file, header, buffer_size=CHUNK_BUFFER_SIZE) as writer:
+        f.readline()  # header line
+
+        ntemps = 0
+        for line in tqdm(f, desc="Writing lines to chunk files") if progress else f:
+            if not line.strip():
+                continue  # don't want it to break
+
+            if is_wavelength_line(line):  # this is a new temperature
+                temperature = line
+                ntemps += 1
+                ticker = 0
+                first_open = 0
+                continue  # nothing else on this line
+
+            if ntemps == 1:
+                wavelengths.append(float(line.split()[0]))
+
+            # a line goes to every chunk whose range (overlap included) holds it
+            file_suffix = first_open
+            while file_suffix < nchunks and starts[file_suffix] <= ticker:
+                if ticker < stops[file_suffix]:
+                    if ticker == starts[file_suffix]:
+                        writer.write(file_suffix, temperature)
+                    writer.write(file_suffix, line)
+                file_suffix += 1
+
+            while first_open < nchunks and stops[first_open] <= ticker + 1:
+                first_open += 1
+            ticker += 1
+
+    write_chunk_manifest(file, np.array(wavelengths), starts, stops, chunk_edges, writer.checksums)
 
-    wav_per_chunk = chunk_list[0]  # to start
+    return
 
-    ntemps = 0
 
-    for line in tqdm(f1, desc='Writing lines to chunk files'):  # read through all lines in the opacity file
-        if not line or line == "\n":
-            continue  # don't want it to break
+def get_CIA_wavelengths(file):
+    """
+    Returns the wavelength grid of a CIA file, read from its first temperature alone.
+    """
+    wavelengths = []
+    with open(file) as f:
+        f.readline()  # header line
+        for line in f:
+            if not line.strip():
+                continue
+            if is_wavelength_line(line):
+                if wavelengths:
+                    break
+                continue
+            wavelengths.append(float(line.split()[0]))
+    return np.array(wavelengths)
+
+
+def check_CIA_layout(file, num_wavelengths):
+    """
+    Checks that a CIA file is laid out as chunk_wavelengths_CIA expects: a header line, then
+    blocks that each start with a temperature line and hold num_wavelengths lines. Raises a
+    ValueError saying what is wrong otherwise.
+    """
+    with open(file) as f:
+        if is_wavelength_line(f.readline()):
+            raise ValueError(f"{file} has no header line before its first temperature.")
+
+        temperature = None
+        count = 0
+        for number, line in enumerate(f, start=2):
+            if not line.strip():
+                continue
+            if is_wavelength_line(line):
+                if temperature is not None and count != num_wavelengths:
+                    break
+                temperature = line.strip()
+                count = 0
+            elif temperature is None:
+                raise ValueError(f"{file} has data on line {number}, before its first temperature line.")
+            else:
+                count += 1
+
+    if temperature is None:
+        raise ValueError(f"{file} has no temperature lines.")
+    if count != num_wavelengths:
+        raise ValueError(
+            f"{file} has {count} wavelengths at temperature {temperature}, but the chunks cover {num_wavelengths}."
+        )
 
-        if len(line.split(" ")) == 1:  # this is a new temperature
-            temperature = line
-            ntemps += 1
-            continue  # nothing else on this line
-        ticker += 1
-        if ticker == wav_per_chunk:
-            file_suffix += 1  # start writing to different file
-            ticker = 0
-            true_file_suffix = (file_suffix) % 113
-            wav_per_chunk = chunk_list[true_file_suffix]
 
-            write_to_file(temperature, file, file_suffix, ntemps)
-        write_to_file(line, file, file_suffix, ntemps)  # just writes line
+def get_chunk_ranges(ref_file_base=None, chunk_edges=None, manifest=None, chunk_ranges=None):
+    """
+    Works out which wavelengths of the reference grid go in each CIA chunk: from the
+    reference chunks' manifest (at ref_file_base + '_manifest.json' unless given), from
+    a chunk plan, or else by counting the reference chunks one by one.
 
-    true_header = header[0]
+    Inputs
+    -------
+        :ref_file_base: (str or None) path base to a set of reference files that are already
+                        chunked on the desired wavelength grid. e.g., ../opacFe/opacFe
+        :chunk_edges: (np.array or None) chunk plan to use instead of the reference files.
+        :manifest: (str or None) path to the chunk manifest of the reference files.
+        :chunk_ranges: (tuple or None) (starts, stops) of each chunk of chunk_edges, overlap
+                        included. Defaults to chunk_edges without overlap.
 
-    for chunk_file in glob(file[:-4] + "*"):
-        if chunk_file != file:
-            prepend_line(chunk_file, true_header)
-    return
+    Outputs
+    -------
+        :chunk_edges: (np.array) chunk edges without overlap.
+        :starts: (np.array) index of the first wavelength of each chunk, overlap included.
+        :stops: (np.array) index one past the last wavelength of each chunk, overlap included.
+        :source: (str or None) path to the file the reference chunks were made from, if
+                        a manifest was used.
+    """
+    if manifest is None and chunk_edges is None and ref_file_base is not None:
+        if os.path.exists(manifest_path(ref_file_base)):
+            manifest = manifest_path(ref_file_base)
+
+    if manifest is not None:
+        manifest_data = load_chunk_manifest(manifest)
+        chunks = manifest_data["chunks"]
+        chunk_edges = np.array([chunk["start"] for chunk in chunks] + [chunks[-1]["stop"]])
+        starts = np.array([chunk["start"] - chunk["overlap_previous"] for chunk in chunks])
+        stops = np.array([chunk["stop"] + chunk["overlap_next"] for chunk in chunks])
+        source = os.path.join(os.path.dirname(manifest), manifest_data["source"])
+        return chunk_edges, starts, stops, source
+
+    if chunk_edges is None:
+        if ref_file_base is None:
+            raise ValueError("Cannot set ref_file_base, chunk_edges and manifest to None! One must be specified.")
+        chunk_list = []
+        while os.path.exists(ref_file_base + str(len(chunk_list)) + ".dat"):
+            chunk_list += [get_wav_per_chunk(len(chunk_list), ref_file_base)]
+        if not chunk_list:
+            raise FileNotFoundError(f"No reference chunks {ref_file_base}*.dat found.")
+        chunk_edges = np.concatenate([[0], np.cumsum(chunk_list)])
+    chunk_edges = np.asarray(chunk_edges, dtype=int)
+    if chunk_ranges is not None:
+        starts, stops = (np.asarray(ranges, dtype=int) for ranges in chunk_ranges)
+        return chunk_edges, starts, stops, None
+    return chunk_edges, chunk_edges[:-1], chunk_edges[1:], None
 
 
 def get_wav_per_chunk(file_suffix, ref_file_base):
     """
-    Grabs the number of wavelengthz of a given chunk.
+    Grabs the number of wavelengths of a given chunk.
 
     Inputs
     ------
@@ -344,58 +506,234 @@ def get_wav_per_chunk(file_suffix, ref_file_base):
     return len_grid
 
 
-def prepend_line(file_name, line):
+def get_header(file):
     """
-    Insert given string as a new line at the beginning of a file. Used to fix the header within
-    the chunked CIA files.
+    Gets the header of a CIA file: its first line, holding the temperature grid.
     """
+    with open(file) as f:
+        return f.readline()
 
-    # define name of temporary dummy file
-    dummy_file = file_name + ".bak"
-    # open original file in read mode and dummy file in write mode
-    with open(file_name, "r") as read_obj, open(dummy_file, "w") as write_obj:
 
-        # Write given line to the dummy file
-        write_obj.write(line + "\n")
-        # Read lines from original file one by one and append them to the dummy file
-        for line in read_obj:
-            write_obj.write(line)
+######################### Pt. 3: Interpolating straight into chunks ####################################
 
-    # remove original file
-    os.remove(file_name)
-    # Rename dummy file as the original file
-    os.rename(dummy_file, file_name)
 
-
-def write_to_file(line, file, file_suffix, ntemps):
+def interpolate_and_chunk_CIA(
+    CIA_file,
+    ref_file_base=None,
+    reference_file=None,
+    chunk_edges=None,
+    manifest=None,
+    processes=None,
+    progress=True,
+):
     """
-    Writes a line to a file.
+    Interpolates a low-resolution CIA file straight into chunks on the wavelength grid
+    of a reference file, without writing the full high-resolution file in between. Each
+    chunk is interpolated over its own wavelengths (overlap included) and written by its
+    own worker process.
+
+    The chunk files are named as chunk_wavelengths_CIA would name the chunks of the
+    interpolated file, e.g. opacCIA_highres0.dat, and come with a manifest.
 
     Inputs
-    ------
-        :line: (str) line to be written.
-        :file: (str) path to file being chunked. e.g., opacCIA_highres.dat
-        :file_suffix: (int) number of chunk.
-        :ntemps: (int) number of temperatures in grid.
+    -------
+        :CIA_file: (str) path to CIA file to be interpolated. e.g., 'opacCIA/opacCIA.dat'
+        :ref_file_base: (str or None) path base to a set of reference files that are already
+                        chunked on the desired wavelength grid. e.g., ../opacFe/opacFe
+        :reference_file: (str or None) path to opacity file with the wavelength grid of
+                        interest. Defaults to the file the reference manifest was made from.
+        :chunk_edges: (np.array or None) chunk plan to use instead of the reference chunks.
+        :manifest: (str or None) path to the chunk manifest of the reference files, if it
+                        isn't at ref_file_base + '_manifest.json'.
+        :processes: (int or None) maximum number of chunks to write at once. Defaults to
+                        the number of cores.
+        :progress: (bool) whether or not to include a progress bar (if tqdm is installed).
 
     Outputs
-    --------
+    -------
         None
 
     Side effects
     -------------
-        Writes a line to a file!
+        Creates a chunk file for each reference chunk, e.g. opacCIA_highres0.dat, each
+        holding the header and that chunk's wavelengths at every temperature, and a
+        manifest of them.
     """
-    true_file_suffix = (file_suffix) % 113
-    true_filename = f"{file[:-4] + str(true_file_suffix) + '.dat'}"
-    f = open(true_filename, "a")
-    f.write(line)
-    f.close()
+    chunk_edges, starts, stops, source = get_chunk_ranges(ref_file_base, chunk_edges, manifest)
 
+    if reference_file is None:
+        if source is None:
+            raise ValueError("Without a reference manifest, reference_file must be specified.")
+        reference_file = source
+    real_wavelength_grid = get_wav_grid(reference_file, progress=progress)
 
-def get_header(file):
-    f = open(file)
-    f1 = f.readlines()
-    f.close()
+    if stops[-1] > len(real_wavelength_grid):
+        raise ValueError(
+            f"{reference_file} has fewer wavelengths than its chunks cover ({stops[-1]})."
+        )
 
-    return f1[0] + f1[1]
+    new_file = CIA_file.split(".dat")[0] + "_highres.dat"
+    header = get_header(CIA_file)
+    table = read_CIA_file(CIA_file)
+
+    tasks = [
+        (new_file, i, real_wavelength_grid[start:stop])
+        for i, (start, stop) in enumerate(zip(starts, stops))
+    ]
+
+    if processes is None:
+        processes = os.cpu_count()
+    processes = max(1, min(processes, len(tasks)))
+
+    checksums = {}
+    with Pool(processes, initializer=_init_CIA_worker, initargs=(header, table)) as pool:
+        results = pool.imap_unordered(_interpolate_CIA_chunk, tasks)
+        if progress:
+            results = tqdm(results, total=len(tasks), desc="Writing CIA chunks")
+        for i, checksum in results:
+            checksums[i] = checksum
+
+    write_chunk_manifest(new_file, real_wavelength_grid, starts, stops, chunk_edges, checksums)
+
+    return
+
+
+def _init_CIA_worker(header, table):
+    """
+    Hands the CIA table to a worker process once, rather than with every chunk.
+    """
+    global _CIA_HEADER, _CIA_TABLE
+    _CIA_HEADER = header
+    _CIA_TABLE = table
+
+
+def _interpolate_CIA_chunk(task):
+    """
+    Interpolates the CIA table onto the wavelengths of a single chunk and writes the
+    chunk, for interpolate_and_chunk_CIA.
+    """
+    new_file, index, chunk_wavelengths = task
+    temperatures, wavelengths, cia = _CIA_TABLE
+
+    with ChunkWriter(new_file, _CIA_HEADER, buffer_size=CHUNK_BUFFER_SIZE) as writer:
+        for temperature, values in iter_interpolated_CIA(
+            temperatures, wavelengths, cia, chunk_wavelengths
+        ):
+            writer.write(index, "{:.9e}".format(temperature) + "\n")
+            writer.write(index, "".join(format_CIA_text(chunk_wavelengths, values)))
+
+    return index, writer.checksums[index]
+
+
+######################### Pt. 4: Evaluating CIA on the fly ####################################
+
+
+# default memory cap of a CIAEvaluator's cache [bytes]
+CIA_CACHE_SIZE = 256 * 1024 * 1024
+
+
+class CIAEvaluator:
+    """
+    Evaluates the CIA of a low-resolution CIA file on any wavelength grid, on demand,
+    rather than reading it from a pre-interpolated file.
+
+    Interpolating onto a wavelength grid is the expensive part, so the result for each
+    grid (at every temperature of the table) is kept in a least-recently-used cache,
+    keyed by a hash of the grid. Once the cache holds more than max_cache_bytes, the
+    grids used longest ago are dropped.
+
+    Example:
+
+    >>> evaluator = CIAEvaluator('opacCIA.dat')
+    >>> cia = evaluator(chunk_wavelengths, temperatures=[1000, 2500], pairs=['H2H2', 'H2He'])
+    >>> cia.shape  # (temperature, wavelength, pair)
+    (2, 1565, 2)
+
+    Attributes
+    ----------
+        :temperatures: (np.array) temperature grid of the table [K]
+        :wavelengths: (np.array) wavelength grid of the table
+        :cia: (np.array) CIA of the table, shaped (temperature, wavelength, pair)
+        :pairs: (tuple of str) the collision pairs of the table, in order
+        :max_cache_bytes: (int) memory cap of the cache [bytes]
+        :hits, misses: (int) number of grids found and not found in the cache
+    """
+
+    def __init__(self, CIA_file, pairs=CIA_PAIRS, max_cache_bytes=CIA_CACHE_SIZE):
+        self.temperatures, self.wavelengths, self.cia = read_CIA_file(CIA_file, pairs=pairs)
+        self.pairs = tuple(pairs)
+        self.max_cache_bytes = max_cache_bytes
+        self.hits = 0
+        self.misses = 0
+        self._cache = OrderedDict()
+        self._cache_bytes = 0
+
+    def __call__(self, wavelengths, temperatures=None, pairs=None):
+        """
+        Returns the CIA on a wavelength grid.
+
+        Inputs
+        -------
+            :wavelengths: (np.array) wavelength grid to evaluate on
+            :temperatures: (np.array or None) temperatures to evaluate at [K]. Temperatures
+                        between those of the table are linearly interpolated, and those past
+                        either end are held constant. Defaults to the table's temperatures.
+            :pairs: (list of str or None) collision pairs to return. Defaults to all of them.
+
+        Outputs
+        -------
+            :cia: (np.array) CIA shaped (temperature, wavelength, pair)
+        """
+        cia = self.interpolate(wavelengths)
+
+        if pairs is not None:
+            cia = cia[:, :, [self.pairs.index(pair) for pair in pairs]]
+
+        if temperatures is None:
+            return cia.copy()
+
+        lower, upper, weights = get_interpolation_weights(
+            self.temperatures, np.atleast_1d(temperatures).astype(np.float64)
+        )
+        weights = weights[:, np.newaxis, np.newaxis]
+        return cia[lower] * (1 - weights) + cia[upper] * weights
+
+    def interpolate(self, wavelengths):
+        """
+        Returns the CIA on a wavelength grid at every temperature of the table, from the
+        cache if that grid has been asked for before. The array returned is the cached one,
+        so it should not be modified.
+        """
+        wavelengths = np.ascontiguousarray(wavelengths, dtype=np.float64)
+        key = hashlib.md5(wavelengths.tobytes()).hexdigest()
+
+        if key in self._cache:
+            self.hits += 1
+            self._cache.move_to_end(key)
+            return self._cache[key]
+
+        self.misses += 1
+        lower, upper, weights = get_interpolation_weights(self.wavelengths, wavelengths)
+        cia = interpolate_CIA_batch(self.cia, lower, upper, weights)
+
+        if cia.nbytes <= self.max_cache_bytes:
+            self._cache[key] = cia
+            self._cache_bytes += cia.nbytes
+            while self._cache_bytes > self.max_cache_bytes:
+                _, evicted = self._cache.popitem(last=False)
+                self._cache_bytes -= evicted.nbytes
+        return cia
+
+    @property
+    def cache_bytes(self):
+        """
+        Memory currently held by the cache [bytes].
+        """
+        return self._cache_bytes
+
+    def clear_cache(self):
+        """
+        Empties the cache.
+        """
+        self._cache.clear()
+        self._cache_bytes = 0
@@ -1,288 +1,313 @@
+import hashlib
 import numpy as np
-import sys
+from collections import OrderedDict
 import astropy.constants as ac
 
+from rebinning_utils import build_rebinning_operator, get_interfaces, get_resolution_grid
+
 
 K_B = ac.k_B.cgs.value
 H = ac.h.cgs.value
 C = ac.c.cgs.value
 
 
-def percent_counter(z, nz, y=0, ny=1, x=0, nx=1):
-    """ displays percentage completed of a long operation (usually a for loop) for up to three indices """
-
-    percentage = float((x + nx * y + nx * ny * z) / (nx * ny * nz) * 100.0)
-    sys.stdout.write("calculating: {:.1f}%\r".format(percentage))
-    sys.stdout.flush()
-
-
-def calc_analyt_planck_in_interval(temp, lower_lambda, higher_lambda):
+def calc_analyt_planck_in_interval(temp, lower_lambda, higher_lambda, max_terms=200, rtol=1e-16):
     """ calculates the planck function over a wavelength integral
 
-    :param temp: float
+    :param temp: float or numpy array
                  the blackbody temperature
 
-    :param lower_lambda: float
+    :param lower_lambda: float or numpy array
                          lower wavelength boundary (cm units!)
 
-    :param higher_lambda: float
+    :param higher_lambda: float or numpy array
                           upper wavelength boundary (cm units!)
 
-    :return: float
-             the Planckian blackbody function integrated over a wavelength interval and averaged
+    :param max_terms: (optional) int
+                      the most terms of the series to sum. 200 found to be accurate enough.
+
+    :param rtol: (optional) float
+                 the series stops early once the next terms change no result by more than this (relative)
+
+    :return: float or numpy array
+             the Planckian blackbody function integrated over a wavelength interval and averaged.
+             temp, lower_lambda and higher_lambda are broadcast against each other, so e.g. temp[:, np.newaxis]
+             with arrays of bin edges gives every bin at every temperature.
     """
 
+    temp = np.asarray(temp, dtype=np.float64)
+    lower_lambda = np.asarray(lower_lambda, dtype=np.float64)
+    higher_lambda = np.asarray(higher_lambda, dtype=np.float64)
+
     d = 2.0 * (K_B / H)**3 * K_B * temp**4 / C**2
     y_top = H * C / (higher_lambda * K_B * temp)
     y_bot = H * C / (lower_lambda * K_B * temp)
 
-    result = 0
-
-    for n in range(1, 200):  # 200 found to be accurate enough.
-        result += np.exp(-n*y_top) * (y_top**3/n + 3.0*y_top**2/n**2 + 6.0*y_top/n**3 + 6.0/n**4) \
-                - np.exp(-n*y_bot) * (y_bot**3/n + 3.0*y_bot**2/n**2 + 6.0*y_bot/n**3 + 6.0/n**4)
+    result = np.zeros(np.broadcast(y_top, y_bot).shape)
 
-    result *= d / (higher_lambda - lower_lambda)
-
-    return result
+    for n in range(1, max_terms):
+        term_top = np.exp(-n*y_top) * (y_top**3/n + 3.0*y_top**2/n**2 + 6.0*y_top/n**3 + 6.0/n**4)
+        term_bot = np.exp(-n*y_bot) * (y_bot**3/n + 3.0*y_bot**2/n**2 + 6.0*y_bot/n**3 + 6.0/n**4)
 
+        result += term_top - term_bot
 
-def gauss_pdf(x, x_0, hwhm):
+        # every later term is smaller still, so stop once none of them matters any more
+        if np.all(np.maximum(term_top, term_bot) <= rtol * np.abs(result)):
+            break
 
-    pdf = (np.log(2)/np.pi)**0.5 / hwhm * np.exp(-np.log(2) * ((x - x_0) / hwhm)**2)
-
-    return pdf
-
-
-def convolve_with_gaussian(old_lamda, old_flux, resolution, new_lamda=None):
-
-    if new_lamda is None:
+    result *= d / (higher_lambda - lower_lambda)
 
-        new_lamda = [old_lamda[0]]
+    return result if result.ndim else float(result)
 
-        while new_lamda[-1] < old_lamda[-1]:
 
-            new_lamda.append(new_lamda[-1] + new_lamda[-1] / resolution)
+# blackbody extrapolation values already tabulated, keyed by (temperature, hash of the bin interfaces)
+_BB_EXTRAPOLATION_CACHE = OrderedDict()
+BB_EXTRAPOLATION_CACHE_SIZE = 16
 
-    # need wavelength widths of old lambda grid
-    delta_lamda = np.zeros(len(old_lamda))
 
-    for ll in range(len(old_lamda)):
+def tabulate_BB_extrapolation(temp, int_lambda):
+    """ tabulates the blackbody flux (pi times the band-averaged planck function) of every bin, for extrapolating
+        spectra past their wavelength range. repeated calls with the same temperature and bins are looked up.
 
-        if ll == 0:
-
-            delta_lamda[ll] = (old_lamda[ll + 1] - old_lamda[ll])
+    :param temp: float
+                 the blackbody temperature
 
-        elif ll == len(old_lamda) - 1:
+    :param int_lambda: numpy array
+                       wavelength values of the interfaces of the bins (cm units!)
 
-            delta_lamda[ll] = (old_lamda[ll] - old_lamda[ll - 1])
+    :return: numpy array (read-only)
+             blackbody flux in each bin
+    """
 
-        else:
-            delta_lamda[ll] = (old_lamda[ll + 1] - old_lamda[ll - 1]) / 2
+    int_lambda = np.ascontiguousarray(int_lambda, dtype=np.float64)
+    key = (float(temp), hashlib.md5(int_lambda.tobytes()).hexdigest())
 
-    # calculation of new flux values due to convolution with older ones
-    flux_conv = np.zeros(len(new_lamda))
+    if key in _BB_EXTRAPOLATION_CACHE:
+        _BB_EXTRAPOLATION_CACHE.move_to_end(key)
+        return _BB_EXTRAPOLATION_CACHE[key]
 
-    for l in range(len(new_lamda)):
+    values = np.pi * calc_analyt_planck_in_interval(temp, int_lambda[:-1], int_lambda[1:])
+    values = np.atleast_1d(values)
+    values.setflags(write=False)
 
-        percent_counter(l, len(new_lamda))
+    _BB_EXTRAPOLATION_CACHE[key] = values
+    while len(_BB_EXTRAPOLATION_CACHE) > BB_EXTRAPOLATION_CACHE_SIZE:
+        _BB_EXTRAPOLATION_CACHE.popitem(last=False)
 
-        # FWHM of Gaussian pdf equals the resolving power R (and thus HWHM = R/2)
-        hwhm = new_lamda[l] / (2 * resolution)
+    return values
 
-        for ll in range(len(old_lamda)):
 
-            if old_lamda[ll] - new_lamda[l] < -5 * hwhm:
-                continue
+def gauss_pdf(x, x_0, hwhm):
 
-            elif old_lamda[ll] - new_lamda[l] > 5 * hwhm:
-                break
+    pdf = (np.log(2)/np.pi)**0.5 / hwhm * np.exp(-np.log(2) * ((x - x_0) / hwhm)**2)
 
-            else:
-                flux_conv[l] += old_flux[ll] * gauss_pdf(new_lamda[l], old_lamda[ll], hwhm) * delta_lamda[ll]
+    return pdf
 
-    return new_lamda, flux_conv
 
+def convolve_with_gaussian(old_lamda, old_flux, resolution, new_lamda=None, method='exact', max_batch_size=2**24):
+    """ convolves a spectrum with a Gaussian instrument profile with FWHM = lamda / R
 
-def convert_spectrum(old_lambda, old_flux, new_lambda, int_lambda=None, type='log', extrapolate_with_BB_T=0):
-    """ converts a spectrum from one to another resolution. This method conserves energy. It is the real deal.
+    :param old_lamda:  list of float or numpy array
+                       wavelength values of the spectrum. must be in ascending order!
 
-        :param old_lambda: list of float or numpy array
-                           wavelength values of the old grid to be discarded. must be in ascending order!
+    :param old_flux:   list of float or numpy array
+                       flux values of the spectrum. a 2-D array (wavelength x columns) convolves every column at once.
 
-        :param old_flux: list of float or numpy array
-                         flux values of the old grid to be discarded.
+    :param resolution: float
+                       resolution (R=lamda/delta_lamda) of the instrument
 
-        :param new_lambda: list of float or numpy array
-                           wavelength values of the new output grid. must be in ascending order!
+    :param new_lamda:  (optional) list of float or numpy array
+                       wavelength values to evaluate the convolved spectrum at. if not provided, a grid of constant
+                       resolution R spanning old_lamda is used.
 
-        :param int_lambda: (optional) list of float or numpy array
-                           wavelength values of the interfaces of the new grid bins. must be in ascending order!
-                           if not provided they are calculated by taking the middle points between the new_lambda values.
+    :param method:     (optional) 'exact' or 'fft'
+                       - exact sums every old point within 5 HWHM of each new point, weighted by its width, for any
+                         grid. it matches the original point-by-point loop to floating-point precision.
+                       - fft resamples onto a uniform grid in log-lamda, where the profile has the same width
+                         everywhere, and convolves with an FFT. it is meant for long spectra at a constant
+                         resolution. new points whose profile reaches past either end of old_lamda are summed as
+                         in exact. on spectra/pt1/wasp76fulltest.dat (R~125k) it agrees with exact to 1.7e-4
+                         relative at most at R = 1e3 and 1.1e-3 at R = 1e4 (medians 1e-6 and 1e-5), i.e. with at
+                         least ~10 old points per FWHM of the profile. when the profile is barely sampled the two
+                         quadratures differ by more (6e-3 at R = 2e4, 3e-2 at R = 5e4), and exact is the one that
+                         matches the original loop.
 
-        :param type: (optional) 'linear' or 'log'
-                     either linear interpolation or logarithmtic interpolation possible
+    :param max_batch_size: (optional) int
+                           upper limit on (new points x window x columns) handled at once by the exact method.
+                           sets its memory footprint.
 
-        :param extrapolate_with_BB_T: (optional) float
-                                      the out-of-boundary flux values will be extrapolated with a blackbody spectrum.
-                                      set here the temperature. if not provided the out-of-boundary flux values are set to zero.
-
-        :return: list of floats
-                 flux values at the new wavelength grid points
-
-        """
-
-    if int_lambda is None:
-
-        int_lambda = []
-
-        int_lambda.append(new_lambda[0] - (new_lambda[1] - new_lambda[0]) / 2)
+    :return 1:         wavelength values of the convolved spectrum
+    :return 2:         flux values of the convolved spectrum (wavelength x columns for a 2-D old_flux)
+    """
 
-        for x in range(len(new_lambda) - 1):
-            int_lambda.append((new_lambda[x + 1] + new_lambda[x]) / 2)
+    if new_lamda is None:
 
-        int_lambda.append(new_lambda[-1] + (new_lambda[-1] - new_lambda[-2]) / 2)
+        new_lamda = [old_lamda[0]]
 
-    if extrapolate_with_BB_T > 0:
+        while new_lamda[-1] < old_lamda[-1]:
 
-        extrapol_values = []
+            new_lamda.append(new_lamda[-1] + new_lamda[-1] / resolution)
 
-        #print("\n\nPre-tabulating blackbody values with a temperature of " + str(extrapolate_with_BB_T) + " K ...\n")
+    old_lamda = np.asarray(old_lamda, dtype=np.float64)
+    old_flux = np.asarray(old_flux, dtype=np.float64)
+
+    if method == 'exact':
+        flux_conv = _convolve_exact(old_lamda, old_flux, resolution, np.asarray(new_lamda, dtype=np.float64),
+                                    max_batch_size)
+    elif method == 'fft':
+        new_lamda_array = np.asarray(new_lamda, dtype=np.float64)
+        flux_conv = _convolve_fft(old_lamda, old_flux, resolution, new_lamda_array)
+
+        # where the profile reaches past either end of old_lamda, the exact sum is used instead, since the
+        # two methods treat the end of the grid differently (exact gives each end point a full width)
+        edge = ((new_lamda_array * (1 - 5 / (2 * resolution)) <= old_lamda[0]) |
+                (new_lamda_array * (1 + 5 / (2 * resolution)) >= old_lamda[-1]))
+        if np.any(edge):
+            flux_conv[edge] = _convolve_exact(old_lamda, old_flux, resolution, new_lamda_array[edge], max_batch_size)
+    else:
+        raise ValueError("Error: method must be 'exact' or 'fft'.")
 
-        for i in range(len(new_lambda)):
+    return new_lamda, flux_conv
 
-            percent_counter(i, len(new_lambda))
 
-            extrapol_values.append(np.pi * calc_analyt_planck_in_interval(extrapolate_with_BB_T, int_lambda[i], int_lambda[i+1]))
+def _get_lamda_widths(old_lamda):
+    """ wavelength widths of the old grid: the distance between each point's neighbours, halved
+        (one-sided at either end) """
 
-        #print("Pre-tabulation done! \n")
+    delta_lamda = np.empty(len(old_lamda))
 
-    elif extrapolate_with_BB_T == 0:
+    delta_lamda[0] = old_lamda[1] - old_lamda[0]
+    delta_lamda[-1] = old_lamda[-1] - old_lamda[-2]
+    delta_lamda[1:-1] = (old_lamda[2:] - old_lamda[:-2]) / 2
 
-        extrapol_values = np.zeros(len(new_lambda))
+    return delta_lamda
 
-    else:
-        raise ValueError("Error: extrapolation blackbody temperature cannot be negative.")
 
-    #print("Starting pre-conversion...\n")
+def _convolve_exact(old_lamda, old_flux, resolution, new_lamda, max_batch_size):
+    """ convolves with a Gaussian by summing over the old points within 5 HWHM of each new point, as a banded
+        matrix applied to a batch of new points at a time """
 
-    int_flux = [0] * len(int_lambda)
-    new_flux = []
-    old_lambda = np.array(old_lambda)  # conversion required by np.where
+    weighted_flux = old_flux * _get_lamda_widths(old_lamda)[(slice(None),) + (np.newaxis,) * (old_flux.ndim - 1)]
 
-    if type == 'linear':
+    # FWHM of Gaussian pdf equals the resolving power R (and thus HWHM = R/2)
+    hwhm = new_lamda / (2 * resolution)
 
-        for i in range(len(int_lambda)):
+    # window of old points around each new point
+    window_start = np.searchsorted(old_lamda, new_lamda - 5 * hwhm, side='left')
+    window_stop = np.searchsorted(old_lamda, new_lamda + 5 * hwhm, side='right')
+    window = max(int(np.max(window_stop - window_start, initial=0)), 1)
 
-            percent_counter(i, len(int_lambda))
+    num_columns = int(np.prod(old_flux.shape[1:]))
+    batch_size = max(max_batch_size // (window * num_columns), 1)
 
-            if int_lambda[i] < old_lambda[0]:
-                continue
+    flux_conv = np.zeros((len(new_lamda),) + old_flux.shape[1:])
 
-            elif int_lambda[i] > old_lambda[len(old_lambda) - 1]:
-                break
+    for start in range(0, len(new_lamda), batch_size):
 
-            else:
-                p_bot = len(np.where(old_lambda < int_lambda[i])[0]) - 1
+        batch = slice(start, start + batch_size)
 
-                interpol = old_flux[p_bot] * (old_lambda[p_bot + 1] - int_lambda[i]) + old_flux[p_bot + 1] * (int_lambda[i] - old_lambda[p_bot])
-                interpol /= (old_lambda[p_bot + 1] - old_lambda[p_bot])
-                int_flux[i] = interpol
+        indices = window_start[batch, np.newaxis] + np.arange(window)
+        in_window = indices < window_stop[batch, np.newaxis]
+        indices = np.minimum(indices, len(old_lamda) - 1)
 
-        #print("\n  Pre-conversion done!")
+        pdf = gauss_pdf(new_lamda[batch, np.newaxis], old_lamda[indices], hwhm[batch, np.newaxis])
+        pdf[~in_window] = 0
 
-        #print("\nStarting main conversion...\n")
+        flux_conv[batch] = np.einsum('nw,nw...->n...', pdf, weighted_flux[indices])
 
-        for i in range(len(new_lambda)):
+    return flux_conv
 
-            percent_counter(i, len(new_lambda))
 
-            if int_flux[i] == 0 or int_flux[i+1] == 0:
-                new_flux.append(extrapol_values[i])
+def _convolve_fft(old_lamda, old_flux, resolution, new_lamda):
+    """ convolves with a Gaussian on a uniform grid in log-lamda, where its HWHM is 1/(2R) everywhere, using an FFT.
+        the flux is taken to be zero outside old_lamda """
 
-            else:
-                p_bot = len(np.where(old_lambda < int_lambda[i])[0]) - 1
+    hwhm = 1 / (2 * resolution)
 
-                p_start = p_bot + 1
+    # the uniform grid resolves both the old grid and the profile, and reaches past both grids by 5 HWHM
+    log_old = np.log(old_lamda)
+    log_new = np.log(new_lamda)
+    step = min(np.median(np.diff(log_old)), hwhm / 4)
 
-                for p in range(p_start, len(old_lambda)):
+    log_bot = min(log_old[0], log_new[0]) - 5 * hwhm
+    log_top = max(log_old[-1], log_new[-1]) + 5 * hwhm
+    log_grid = log_bot + step * np.arange(int(np.ceil((log_top - log_bot) / step)) + 1)
 
-                    if p == p_start:
-                        if old_lambda[p_start] < int_lambda[i + 1]:
-                            interpol = (int_flux[i] + old_flux[p]) / 2.0 * (old_lambda[p] - int_lambda[i])
+    col = (slice(None),) + (np.newaxis,) * (old_flux.ndim - 1)
 
-                        else:
-                            interpol = (int_flux[i] + int_flux[i + 1]) / 2.0
-                            break
-                    else:
-                        if old_lambda[p] < int_lambda[i + 1]:
-                            interpol += (old_flux[p - 1] + old_flux[p]) / 2.0 * (old_lambda[p] - old_lambda[p - 1])
+    # linear interpolation onto the uniform grid, as weights on the old points
+    position = np.interp(log_grid, log_old, np.arange(len(log_old)))
+    bot = np.minimum(position.astype(int), len(log_old) - 2)
+    weight = (position - bot)[col]
+    inside = ((log_grid >= log_old[0]) & (log_grid <= log_old[-1]))[col]
+    uniform_flux = np.where(inside, old_flux[bot] * (1 - weight) + old_flux[bot + 1] * weight, 0.0)
 
-                        else:
-                            interpol += (old_flux[p - 1] + int_flux[i + 1]) / 2.0 * (int_lambda[i + 1] - old_lambda[p - 1])
-                            interpol /= (int_lambda[i + 1] - int_lambda[i])
-                            break
+    # d lamda = lamda d(log lamda), and the profile in log-lamda is a Gaussian of HWHM 1/(2R)
+    uniform_flux *= np.exp(log_grid)[col]
+    offsets = step * np.arange(-int(5 * hwhm / step), int(5 * hwhm / step) + 1)
+    kernel = gauss_pdf(offsets, 0, hwhm) * step
 
-                new_flux.append(interpol)
+    size = len(log_grid) + len(kernel) - 1
+    size = 2 ** int(np.ceil(np.log2(size)))
+    convolved = np.fft.irfft(np.fft.rfft(uniform_flux, size, axis=0) * np.fft.rfft(kernel, size)[col], size, axis=0)
+    convolved = convolved[len(kernel) // 2:len(kernel) // 2 + len(log_grid)]
 
-    elif type == 'log':
+    # back onto the new grid, with the 1 / lamda of the profile in lamda
+    position = np.interp(log_new, log_grid, np.arange(len(log_grid)))
+    bot = np.minimum(position.astype(int), len(log_grid) - 2)
+    weight = (position - bot)[col]
 
-        for i in range(len(int_lambda)):
+    return (convolved[bot] * (1 - weight) + convolved[bot + 1] * weight) / new_lamda[col]
 
-            percent_counter(i, len(int_lambda))
 
-            if int_lambda[i] < old_lambda[0]:
-                continue
+def convert_spectrum(old_lambda, old_flux, new_lambda, int_lambda=None, type='log', extrapolate_with_BB_T=0):
+    """ converts a spectrum from one to another resolution. This method conserves energy. It is the real deal.
 
-            elif int_lambda[i] > old_lambda[len(old_lambda) - 1]:
-                break
+        :param old_lambda: list of float or numpy array
+                           wavelength values of the old grid to be discarded. must be in ascending order!
 
-            else:
-                p_bot = len(np.where(old_lambda < int_lambda[i])[0]) - 1
+        :param old_flux: list of float or numpy array
+                         flux values of the old grid to be discarded. a 2-D array (wavelength x columns) rebins
+                         every column at once, sharing the bin geometry.
 
-                interpol = old_flux[p_bot] ** (old_lambda[p_bot + 1] - int_lambda[i]) * old_flux[p_bot + 1] ** (int_lambda[i] - old_lambda[p_bot])
-                interpol = interpol**(1/(old_lambda[p_bot + 1] - old_lambda[p_bot]))
-                int_flux[i] = interpol
+        :param new_lambda: list of float or numpy array
+                           wavelength values of the new output grid. must be in ascending order!
 
-        #print("\n  Pre-conversion done!")
+        :param int_lambda: (optional) list of float or numpy array
+                           wavelength values of the interfaces of the new grid bins. must be in ascending order!
+                           if not provided they are calculated by taking the middle points between the new_lambda values.
 
-        #print("\nStarting main conversion...\n")
+        :param type: (optional) 'linear' or 'log'
+                     either linear interpolation or logarithmtic interpolation possible
 
-        for i in range(len(new_lambda)):
+        :param extrapolate_with_BB_T: (optional) float
+                                      the out-of-boundary flux values will be extrapolated with a blackbody spectrum.
+                                      set here the temperature. if not provided the out-of-boundary flux values are set to zero.
 
-            percent_counter(i, len(new_lambda))
+        :return: numpy array
+                 flux values at the new wavelength grid points (wavelength x columns for a 2-D old_flux)
 
-            if int_flux[i] == 0 or int_flux[i + 1] == 0:
-                new_flux.append(extrapol_values[i])
+        """
 
-            else:
-                p_bot = len(np.where(old_lambda < int_lambda[i])[0]) - 1
+    if int_lambda is None:
 
-                p_start = p_bot + 1
+        int_lambda = get_interfaces(new_lambda)
 
-                for p in range(p_start, len(old_lambda)):
+    if extrapolate_with_BB_T > 0:
 
-                    if p == p_start:
-                        if old_lambda[p_start] < int_lambda[i + 1]:
-                            interpol = (int_flux[i] * old_flux[p]) ** (0.5 * (old_lambda[p] - int_lambda[i]))
+        extrapol_values = tabulate_BB_extrapolation(extrapolate_with_BB_T, int_lambda)
 
-                        else:
-                            interpol = (int_flux[i] * int_flux[i + 1]) ** 0.5
-                            break
-                    else:
-                        if old_lambda[p] < int_lambda[i + 1]:
-                            interpol *= (old_flux[p - 1] * old_flux[p]) ** (0.5 * (old_lambda[p] - old_lambda[p - 1]))
+    elif extrapolate_with_BB_T == 0:
 
-                        else:
-                            interpol *= (old_flux[p - 1] * int_flux[i + 1]) ** (0.5 * (int_lambda[i + 1] - old_lambda[p - 1]))
-                            interpol = interpol ** (1/(int_lambda[i + 1] - int_lambda[i]))
-                            break
+        extrapol_values = np.zeros(len(new_lambda))
 
-                new_flux.append(interpol)
+    else:
+        raise ValueError("Error: extrapolation blackbody temperature cannot be negative.")
 
-    #print("\n  Main conversion done!")
+    # the conversion is a sparse linear map (of the flux, or of its log), which only depends on the grids
+    operator = build_rebinning_operator(old_lambda, int_lambda, type=type, new_lambda=new_lambda)
 
-    return new_flux
+    return operator.apply(old_flux, extrapol_values)
 
 
 def rebin_spectrum_to_resolution(old_lamda, old_flux, resolution, w_unit='cm', type='log'):
@@ -293,7 +318,8 @@ def rebin_spectrum_to_resolution(old_lamda, old_flux, resolution, w_unit='cm', t
                            must be in ascending order!
 
     :param old_flux:    list of float or numpy array
-                        flux values of the old grid to be discarded.
+                        flux values of the old grid to be discarded. a 2-D array (wavelength x columns)
+                        rebins every column at once.
 
     :param resolution:  float
                         resolution (R=lamda/delta_lamda) of the new, rebinned wavelength grid
@@ -307,7 +333,7 @@ def rebin_spectrum_to_resolution(old_lamda, old_flux, resolution, w_unit='cm', t
                         - alternatively, the spectrum can be convolved with a Gaussian distribution, where FWHM = R
 
     :return 1:          wavelength values of the rebinned grid
-    :return 2:          flux values of the rebinned grid
+    :return 2:          flux values of the rebinned grid (wavelength x columns for a 2-D old_flux)
     """
 
     if w_unit == 'micron':
@@ -317,13 +343,8 @@ def rebin_spectrum_to_resolution(old_lamda, old_flux, resolution, w_unit='cm', t
 
     top_limit = old_lamda[-1]
 
-    rebin_lamda = []
-    l_point = bot_limit
-
-    while l_point < top_limit:
-        rebin_lamda.append(l_point)
-
-        l_point *= (resolution + 1) / resolution
+    # each wavelength is the previous one times (R + 1) / R
+    rebin_lamda = get_resolution_grid(bot_limit, top_limit, resolution)
 
     if type == "gaussian":
         _, rebin_flux = convolve_with_gaussian(old_lamda, old_flux, resolution, rebin_lamda)
@@ -1,148 +1,77 @@
 #!/usr/bin/env python
 # coding: utf-8
+"""
+Rebins an opacity file to a lower resolution, e.g. from 200k down to 125k.
 
+>>> python opacity-rebinning.py Hayley-Opacity-Data-Files/opacCO.dat Hayley-Opacity-Data-Files/125k-opacCO.dat --resolution 125000
 
-# Import a lot of stuff
-import numpy as np
-import pandas as pd
-import sys
-import astropy.constants as ac
-from tqdm import tqdm
-import fileinput
-from matej_resolution_functions import * # Import Matej's code
+With no arguments, it rebins the default file below. The work is done by
+rebinning_utils.rebin_opacity_file, which can be called directly from python too.
 
-# Specify the file that you want read in and the location
-# This code will take it down from 200k to 125k
-opacity_file_base = 'Hayley-Opacity-Data-Files/'
-opacity_old_file  = 'opacCO.dat'
-opacity_new_file  = '125k-opacCO.dat'
-
-
-# This specifies important stuff for the file\
-# The resolution can be pretty picky with Matej's code for reasons that I don't know yet
-# For each wavelength there will be a matrix that has N presssures and M temperatures
-# These are the hardcoded values that I think are necessary for all the files that I have
-new_resolution = 125000
-n_wavelengths = 176842 # this is the total number
-n_pressure_points = 28
-n_temperature_points = 46
-
-# Read in the opacity file
-# Make it pandas
-df = pd.read_csv(opacity_file_base + opacity_old_file,
-                 delim_whitespace= True, dtype=np.float64,
-                 names=['P',
-                        '500', '600', '700', '800', '900',
-                        '1000','1100', '1200', '1300', '1400', '1500', '1600','1700', '1800', '1900',
-                        '2000', '2100', '2200', '2300', '2400','2500', '2600', '2700', '2800', '2900',
-                        '3000', '3100', '3200', '3300', '3400', '3500', '3600', '3700', '3800', '3900',
-                        '4000', '4100', '4200', '4300', '4400', '4500', '4600', '4700', '4800', '4900',
-                        '5000'],
-                         skiprows=2, nrows=n_wavelengths * (n_pressure_points + 1))
-
-# Get all the wavelengths by parsing every Nth + 1 line
-wavelengths = list(df[df.index % (n_pressure_points + 1) == 0].P)
-
-# Take out all the rows that only have the wavelength info
-data = df[df.index % (n_pressure_points + 1) != 0]
-
-# Get all the pressures from the dataframe
-pressures    = list(data.P[0:n_pressure_points])
-
-# Hardcoded in temperatures that are from reading in the file
-temperatures = ['500', '600', '700', '800', '900',
-                '1000','1100', '1200', '1300', '1400', '1500', '1600','1700', '1800', '1900',
-                '2000', '2100', '2200', '2300', '2400','2500', '2600', '2700', '2800', '2900',
-                '3000', '3100', '3200', '3300', '3400', '3500', '3600', '3700', '3800', '3900',
-                '4000', '4100', '4200', '4300', '4400', '4500', '4600', '4700', '4800', '4900',
-                '5000']
+Several resolutions can be made in one pass through the file with --pyramid, in which case
+new_file is the base name of the levels (e.g. 125k-opacCO_R25000.dat) and of their manifest:
 
-# Drop all the pressure values from the matrixes
-data = data.drop(['P'], axis=1)
+>>> python opacity-rebinning.py Hayley-Opacity-Data-Files/opacCO.dat Hayley-Opacity-Data-Files/opacCO --pyramid 125000 25000 5000
 
-# Reset the index of the pandas dataframe
-data = data.reset_index(drop=True)
+On a cluster node, --processes spreads the (pressure, temperature) columns over that many cores.
+This holds the whole file in (shared) memory, unless it is a binary store:
 
-# Turn the datframe into a numpy array
-# SPEEEEEEEEEEEEEEEEEEEEEEEEEEEEEEEEEEEEEEEEEEEEEEEEEEEEEEED
-np_data = data.to_numpy()
+>>> python opacity-rebinning.py Hayley-Opacity-Data-Files/opacCO.store Hayley-Opacity-Data-Files/125k-opacCO.dat --processes 16
+"""
 
-# Make a dictionary to hold all the different lists
-# There should be N x M lists where each list is # of wavelength points long
-data_dictionary = {}
 
+import argparse
 
-# Fill the dictionary where each key corresponds to the opacities for a pressure-temperature pair
-# They corresponding lists are all the wavelengths
-# So the dictionary key for a pressure of 10 and a temperature of 500 will be a list, and the order 
-# of that list corresponds to all the wavelengths needed
-for w in range(n_wavelengths):
-    for p in range(len(pressures)):
-        for t in range(len(temperatures)):
-            key_str = str(pressures[p]) + '_' + str(temperatures[t])
-            data_dictionary.setdefault(key_str, []).append(np_data[p + (w * 28)][t])
+from rebinning_utils import build_opacity_pyramid, rebin_opacity_file, rebin_opacity_parallel
 
-# Create a new numpy array that will be filled with the new opacities
-# The array will only be a series of the NxM matrixes because that is how
-# Numpy wants it
-# Numpy arrays with varying size rows are not easy to save to text files
-data_new = np.zeros((n_wavelengths * (n_pressure_points), n_temperature_points + 1))
-
-
-# Fill the np array
-w = 0
-for p in tqdm(range(len(pressures))):
-    pressure = pressures[p]
-
-    for t in range(len(temperatures)):
-        temperature = temperatures[t]
-        
-        # Lookup the dictionary list by key
-        # The key is just the pressure and temperature
-        key_string = str(pressure)+ '_' + str(temperature)
-        old_opac  = data_dictionary[key_string]
-        old_lambda = wavelengths
-
-        # Take the old wavelengths and the old opacities and calculate them at the lower resolution
-        # This takes a really long time
-        # I think that this is where all the code gets held up
-        new_lambda, new_opac = rebin_spectrum_to_resolution(old_lambda, old_opac, new_resolution, w_unit='cm', type='log')
-
-        # Sometimes Matej's code has the first element be 0
-        # I put this in to shame myself
-        if new_opac[0] == 0.0:
-            new_opac[0] = new_opac[1]
-        else:
-            pass
-        
-        # Put the new opacity value in the correct place in the dictionary
-        # This might break?
-        for w in range(len(new_opac)):
-            data_new[p + w*28][t + 1] = new_opac[w]
-
-# Add back in the pressure points for the NxM matrix y axis
-for w in range(len(new_opac)):
-    for p in range(n_pressure_points):
-        data_new[p + w*28][0] = pressures[p]
-
-# Drop the extra rows from the numpy array
-# This is necessary because the numpy array was made with a lenght of the
-# Old number of wavelengths
-data_new = data_new[~np.all(data_new == 0, axis=1)]
+# Specify the file that you want read in and the location
+# This code will take it down from 200k to 125k
+opacity_file_base = 'Hayley-Opacity-Data-Files/'
+opacity_old_file  = 'opacCO.dat'
+opacity_new_file  = '125k-opacCO.dat'
 
-# Save the data
-np.savetxt(opacity_file_base + opacity_new_file, data_new, fmt='%1.6E')
+# The resolution can be pretty picky with Matej's code for reasons that I don't know yet
+new_resolution = 125000
 
-# Add the initial header from the initial file
-i = 0
-for linenum,line in enumerate(fileinput.FileInput(opacity_file_base + opacity_new_file, inplace=1)):
-    if linenum == 0:
-        print ("500.000 600.000 700.000 800.000 900.000 1000.000 1100.000 1200.000 1300.000 1400.000 1500.000 1600.000 1700.000 1800.000 1900.000 2000.000 2100.000 2200.000 2300.000 2400.000 2500.000 2600.000 2700.000 2800.000 2900.000 3000.000 3100.000 3200.000 3300.000 3400.000 3500.000 3600.000 3700.000 3800.000 3900.000 4000.000 4100.000 4200.000 4300.000 4400.000 4500.000 4600.000 4700.000 4800.000 4900.000 5000.000 ")
-        print ("1.000000E-01 2.154435E-01 4.641589E-01 1.000000E+00 2.154435E+00 4.641589E+00 1.000000E+01 2.154435E+01 4.641589E+01 1.000000E+02 2.154435E+02 4.641589E+02 1.000000E+03 2.154435E+03 4.641589E+03 1.000000E+04 2.154435E+04 4.641589E+04 1.000000E+05 2.154435E+05 4.641589E+05 1.000000E+06 2.154435E+06 4.641589E+06 1.000000E+07 2.154435E+07 4.641589E+07 1.000000E+08")
-        
-    if linenum%28 == 0:
-        print ("{0:.9E}".format(new_lambda[i]))
-        print (line.rstrip())
-        i = i + 1
+# The rebinning weights only depend on the wavelength grids, so they are worked out once
+# and kept here for every other species on the same grid
+rebinning_cache = opacity_file_base + 'rebinning_cache'
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Rebins an opacity file to a lower resolution.')
+    parser.add_argument('old_file', nargs='?', default=opacity_file_base + opacity_old_file,
+                        help='opacity file (or binary store) to rebin')
+    parser.add_argument('new_file', nargs='?', default=opacity_file_base + opacity_new_file,
+                        help='where to write the rebinned file')
+    parser.add_argument('--resolution', type=float, default=new_resolution,
+                        help='resolution (R=lamda/delta_lamda) of the new wavelength grid')
+    parser.add_argument('--type', choices=['log', 'linear'], default='log',
+                        help='interpolate the log of the opacities (default) or the opacities themselves')
+    parser.add_argument('--cache-dir', default=rebinning_cache,
+                        help='directory to keep rebinning operators in')
+    parser.add_argument('--window', type=int, default=4096,
+                        help='number of wavelengths to read at once; sets the memory footprint')
+    parser.add_argument('--pyramid', type=float, nargs='+', metavar='RESOLUTION',
+                        help='make every one of these resolutions in one pass, with new_file as their base name')
+    parser.add_argument('--store', action='store_true',
+                        help='write the levels of a pyramid as binary stores')
+    parser.add_argument('--derive', action='store_true',
+                        help='rebin coarse levels of a pyramid from finer ones: faster, but only approximate')
+    parser.add_argument('--processes', type=int,
+                        help='rebin on this many cores, with the whole file shared between them in memory')
+    args = parser.parse_args()
+
+    if args.pyramid:
+        build_opacity_pyramid(args.old_file, args.pyramid, base=args.new_file, type=args.type, store=args.store,
+                              derive=args.derive, cache_dir=args.cache_dir, blocks_per_window=args.window)
+    elif args.processes:
+        rebin_opacity_parallel(args.old_file, args.new_file, args.resolution, type=args.type,
+                               cache_dir=args.cache_dir, processes=args.processes)
     else:
-        print (line.rstrip())
\ No newline at end of file
+        # The opacities are read a window of wavelengths at a time, as (wavelength, pressure,
+        # temperature) cubes, and rebinned along the wavelength axis. Each new wavelength is
+        # written out as soon as it's done, so the whole file is never in memory. This can also
+        # be a binary store made with opacity_io.text_to_store
+        rebin_opacity_file(args.old_file, args.new_file, args.resolution, type=args.type,
+                           cache_dir=args.cache_dir, blocks_per_window=args.window)
@@ -0,0 +1,1437 @@
+"""
+Shared readers for opacity files in the RT code format.
+
+An RT-format opacity file has a two-line header (the temperature grid, then the
+pressure grid), followed by one block per wavelength: a line holding only the
+wavelength, then one line per pressure holding that pressure and the opacity at
+every temperature. Lines are classified by how many tokens they hold (one token
+means a wavelength line), so nothing has to be eval'd.
+
+Example instructions / workflow:
+
+>>> wavelengths, pressures, temperatures, opacities = read_opacity_file('opacFe.dat')
+>>> opacities.shape  # (wavelength, pressure, temperature)
+(176842, 28, 46)
+>>> wavelengths = read_wavelengths('opacFe.dat')  # much cheaper if that's all you need
+
+The first time the wavelengths of a file are asked for, an index is saved next to it
+(e.g. opacFe.dat.idx) holding its header, its wavelengths and the byte offset of each
+wavelength block. After that, counting or listing the wavelengths is a lookup, and
+read_blocks can seek straight to any range of blocks. The index is rebuilt whenever
+the file's size or modification time changes.
+
+>>> wavelengths, opacities = read_blocks('opacFe.dat', 1000, 2000)
+
+Opacity files that get re-read a lot can be converted once into a binary store: a
+directory holding the grids and a contiguous float64 opacity cube that opens as a
+numpy memmap, so that only the slices a step touches are read from disk. Every
+reader in this module (and so every function in chunking_utils) accepts a store
+wherever it accepts an opacity file.
+
+>>> text_to_store('opacTiO.dat')  # creates opacTiO.store/
+>>> wavelengths, pressures, temperatures, opacities = load_opacities('opacTiO.store')
+>>> store_to_text('opacTiO.store', 'opacTiO_copy.dat')
+
+Stores can also be quantized, holding log10 of each opacity as a 16 bit code with an
+offset and scale per chunk of wavelengths (see QuantizedOpacities for the error bound).
+They are read exactly like ordinary stores, at an eighth of the size:
+
+>>> quantize_store('opacTiO.dat')  # creates opacTiO.qstore/
+>>> verify_quantized_store('opacTiO.qstore', 'opacTiO.dat')['max_relative_error']
+
+Opacity cubes are written out with write_opacity_file (or an RTWriter, a batch of
+blocks at a time), which formats whole batches of wavelength blocks in one go and
+writes them through a large buffer. Any file whose name ends in .gz is written
+gzip-compressed, and every reader here decompresses it transparently.
+
+>>> write_opacity_file('opacCO.dat.gz', wavelengths, pressures, temperatures, opacities)
+
+"""
+import gzip
+import hashlib
+import json
+import os
+
+import numpy as np
+
+
+# the other modules import tqdm from here, so that the notice is only printed once
+try:
+    from tqdm import tqdm
+except ImportError:
+    print(
+        """The current progress bar implementation uses the tqdm package.
+        If you would like to use this progress bar, please see
+        the tqdm installation instruction:
+        https://github.com/tqdm/tqdm#installation"""
+    )
+
+    def tqdm(iterator, **kwargs):
+        return iterator
+
+
+# opacity and chunk files are written through large buffers, since they live on Lustre
+WRITE_BUFFER_SIZE = 16 * 1024 * 1024
+
+
+def open_text(file, mode="r", buffering=-1, compresslevel=6):
+    """
+    Opens an opacity (or CIA) file, transparently (de)compressing it if its name ends in .gz.
+
+    Inputs
+    -------
+        :file: (str) path to file. e.g., 'opacFe.dat' or 'opacFe.dat.gz'
+        :mode: (str) 'r', 'w' or 'a' for text, 'rb' for bytes.
+        :buffering: (int) size of the buffer of an uncompressed file [bytes]. -1 for the default.
+        :compresslevel: (int) gzip compression level of a compressed file written, 1 (fastest) to 9.
+
+    Outputs
+    -------
+        :f: the open file.
+    """
+    if file.endswith(".gz"):
+        if "b" not in mode:
+            mode += "t"
+        return gzip.open(file, mode, compresslevel=compresslevel)
+    return open(file, mode, buffering=buffering)
+
+
+def read_header(file):
+    """
+    Reads the temperature and pressure grids from the header of an opacity file.
+
+    Inputs
+    -------
+        :file: (str) path to opacity file. e.g., 'opacFe.dat'
+
+    Outputs
+    -------
+        :temperatures: (np.array) temperature grid of the file [K]
+        :pressures: (np.array) pressure grid of the file
+    """
+    if is_store(file):
+        store = open_store(file)
+        return store.temperatures, store.pressures
+
+    with open_text(file) as f:
+        temperatures = np.array(f.readline().split(), dtype=np.float64)
+        pressures = np.array(f.readline().split(), dtype=np.float64)
+    return temperatures, pressures
+
+
+def read_header_text(file):
+    """
+    Returns the two header lines of an opacity file (or store), unaltered.
+    """
+    if is_store(file):
+        return open_store(file).header
+
+    with open_text(file) as f:
+        return f.readline() + f.readline()
+
+
+def is_wavelength_line(line):
+    """
+    Checks whether a (non-blank) line of an opacity file is a wavelength line,
+    i.e. whether it holds a single token.
+    """
+    stripped = line.strip()
+    return bool(stripped) and " " not in stripped and "\t" not in stripped
+
+
+def iter_raw_blocks(file, progress=False):
+    """
+    Streams through an opacity file one wavelength block at a time, without
+    parsing any of the opacities.
+
+    Inputs
+    -------
+        :file: (str) path to opacity file. e.g., 'opacFe.dat'
+        :progress: (bool) whether or not to include a progress bar (if tqdm is installed).
+
+    Outputs
+    -------
+        Yields (wavelength, lines) for each wavelength block, where lines is a list
+        holding the unaltered text of the block, wavelength line included. For a
+        binary store, the text is formatted as it was in the original file.
+    """
+    if is_store(file):
+        yield from _iter_store_text_blocks(file, progress=progress)
+        return
+
+    with open_text(file) as f:
+        f.readline()  # first two lines are header info
+        f.readline()
+
+        iterator = tqdm(f, desc=f"Reading {file}") if progress else f
+
+        wavelength = None
+        lines = []
+        for line in iterator:
+            if not line.strip():
+                continue
+            if is_wavelength_line(line):
+                if wavelength is not None:
+                    yield wavelength, lines
+                wavelength = float(line)
+                lines = [line]
+            elif wavelength is None:
+                raise ValueError(f"{file} has opacities before its first wavelength line.")
+            else:
+                lines.append(line)
+
+        if wavelength is not None:
+            yield wavelength, lines
+
+
+def iter_opacity_blocks(file, blocks_per_batch=4096, progress=False):
+    """
+    Streams through an opacity file, parsing a batch of wavelength blocks at a time.
+
+    Inputs
+    -------
+        :file: (str) path to opacity file. e.g., 'opacFe.dat'
+        :blocks_per_batch: (int) number of wavelengths to parse at once. Sets the memory
+                    footprint of the stream.
+        :progress: (bool) whether or not to include a progress bar (if tqdm is installed).
+
+    Outputs
+    -------
+        Yields (wavelengths, opacities) for each batch, with opacities shaped
+        (wavelength, pressure, temperature).
+    """
+    if is_store(file):
+        store = open_store(file)
+        starts = range(0, len(store.wavelengths), blocks_per_batch)
+        for start in tqdm(starts, desc=f"Reading {file}") if progress else starts:
+            stop = start + blocks_per_batch
+            yield store.wavelengths[start:stop], store.opacities[start:stop]
+        return
+
+    temperatures, pressures = read_header(file)
+    shape = (len(pressures), len(temperatures) + 1)  # first column is pressure
+
+    wavelengths = []
+    data_lines = []
+    for wavelength, lines in iter_raw_blocks(file, progress=progress):
+        wavelengths.append(wavelength)
+        data_lines.extend(lines[1:])
+        if len(wavelengths) == blocks_per_batch:
+            yield np.array(wavelengths), _parse_lines(data_lines, shape, file)
+            wavelengths = []
+            data_lines = []
+
+    if wavelengths:
+        yield np.array(wavelengths), _parse_lines(data_lines, shape, file)
+
+
+def _parse_lines(lines, shape, file):
+    """
+    Parses the pressure lines of a batch of wavelength blocks in one go, dropping the
+    pressure column.
+    """
+    values = np.fromstring("".join(lines), dtype=np.float64, sep=" ")
+    block_size = shape[0] * shape[1]
+    if values.size % block_size:
+        raise ValueError(
+            f"{file} does not hold {shape[0]} pressures x {shape[1] - 1} temperatures per wavelength."
+        )
+    return values.reshape((-1,) + shape)[:, :, 1:]
+
+
+def read_opacity_file(file, progress=False):
+    """
+    Reads a whole opacity file in a single pass.
+
+    Inputs
+    -------
+        :file: (str) path to opacity file. e.g., 'opacFe.dat'
+        :progress: (bool) whether or not to include a progress bar (if tqdm is installed).
+
+    Outputs
+    -------
+        :wavelengths: (np.array) wavelength grid of the file
+        :pressures: (np.array) pressure grid of the file
+        :temperatures: (np.array) temperature grid of the file [K]
+        :opacities: (np.array) opacities, shaped (wavelength, pressure, temperature)
+    """
+    temperatures, pressures = read_header(file)
+    n_wavelengths = len(read_wavelengths(file))
+
+    wavelengths = np.empty(n_wavelengths)
+    opacities = np.empty((n_wavelengths, len(pressures), len(temperatures)))
+
+    start = 0
+    for batch_wavelengths, batch_opacities in iter_opacity_blocks(file, progress=progress):
+        stop = start + len(batch_wavelengths)
+        wavelengths[start:stop] = batch_wavelengths
+        opacities[start:stop] = batch_opacities
+        start = stop
+
+    return wavelengths, pressures, temperatures, opacities
+
+
+def read_wavelengths(file, progress=False):
+    """
+    Returns the wavelength grid of an opacity file, without parsing its opacities.
+
+    Inputs
+    -------
+        :file: (str) path to opacity file. e.g., 'opacFe.dat'
+        :progress: (bool) whether or not to include a progress bar (if tqdm is installed).
+
+    Outputs
+    -------
+        :wavelengths: (np.array) wavelength grid of the file
+    """
+    if is_store(file):
+        return open_store(file).wavelengths
+
+    return load_index(file, progress=progress).wavelengths
+
+
+######################## Byte-offset index ########################
+
+
+class OpacityIndex:
+    """
+    The index of an opacity file.
+
+    Attributes
+    ----------
+        :header: (str) the two header lines of the file
+        :wavelengths: (np.array) wavelength grid of the file
+        :offsets: (np.array) byte offset of each wavelength line, followed by the byte
+                    offset of the end of the file
+    """
+
+    def __init__(self, header, wavelengths, offsets):
+        self.header = header
+        self.wavelengths = wavelengths
+        self.offsets = offsets
+
+
+def index_path(file):
+    """
+    Returns the path of the index of an opacity file. e.g., 'opacFe.dat' -> 'opacFe.dat.idx'
+    """
+    return file + ".idx"
+
+
+def build_index(file, progress=False):
+    """
+    Scans an opacity file once, recording its header, its wavelengths and where each
+    wavelength block starts.
+
+    Inputs
+    -------
+        :file: (str) path to opacity file. e.g., 'opacFe.dat'
+        :progress: (bool) whether or not to include a progress bar (if tqdm is installed).
+
+    Outputs
+    -------
+        :index: (OpacityIndex) the index of the file.
+    """
+    wavelengths = []
+    offsets = []
+    with open_text(file, "rb") as f:
+        header = f.readline() + f.readline()
+        offset = len(header)
+
+        iterator = tqdm(f, desc=f"Indexing {file}") if progress else f
+
+        for line in iterator:
+            stripped = line.strip()
+            if stripped and b" " not in stripped and b"\t" not in stripped:
+                wavelengths.append(float(stripped))
+                offsets.append(offset)
+            offset += len(line)
+    offsets.append(offset)
+
+    return OpacityIndex(header.decode(), np.array(wavelengths), np.array(offsets, dtype=np.int64))
+
+
+def load_index(file, progress=False):
+    """
+    Loads the index of an opacity file, building it (and saving it next to the file)
+    if it is missing or out of date.
+
+    Inputs
+    -------
+        :file: (str) path to opacity file. e.g., 'opacFe.dat'
+        :progress: (bool) whether or not to include a progress bar (if tqdm is installed)
+                    while building the index.
+
+    Outputs
+    -------
+        :index: (OpacityIndex) the index of the file.
+    """
+    stat = os.stat(file)
+    path = index_path(file)
+
+    if os.path.exists(path):
+        with np.load(path) as saved:
+            if saved["size"] == stat.st_size and saved["mtime"] == stat.st_mtime_ns:
+                return OpacityIndex(str(saved["header"]), saved["wavelengths"], saved["offsets"])
+
+    index = build_index(file, progress=progress)
+
+    try:
+        with open(path, "wb") as f:
+            np.savez(
+                f,
+                header=index.header,
+                wavelengths=index.wavelengths,
+                offsets=index.offsets,
+                size=stat.st_size,
+                mtime=stat.st_mtime_ns,
+            )
+    except OSError:
+        pass  # e.g. a read-only directory; the index just won't be reused
+
+    return index
+
+
+def read_blocks(file, start, stop=None):
+    """
+    Reads a range of wavelength blocks from an opacity file (or store), seeking straight
+    to them rather than reading through the file.
+
+    Inputs
+    -------
+        :file: (str) path to opacity file or store. e.g., 'opacFe.dat'
+        :start: (int) index of the first wavelength block to read.
+        :stop: (int or None) index one past the last wavelength block to read. If None,
+                    reads only block start.
+
+    Outputs
+    -------
+        :wavelengths: (np.array) wavelengths of the blocks
+        :opacities: (np.array) opacities of the blocks, shaped (wavelength, pressure, temperature)
+    """
+    if stop is None:
+        stop = start + 1
+
+    if is_store(file):
+        store = open_store(file)
+        return store.wavelengths[start:stop], store.opacities[start:stop]
+
+    index = load_index(file)
+    temperatures, pressures = read_header(file)
+    start, stop, _ = slice(start, stop).indices(len(index.wavelengths))
+    if start >= stop:
+        return np.array([]), np.empty((0, len(pressures), len(temperatures)))
+
+    with open_text(file, "rb") as f:
+        f.seek(index.offsets[start])
+        text = f.read(index.offsets[stop] - index.offsets[start]).decode()
+
+    lines = [line for line in text.splitlines(keepends=True) if not is_wavelength_line(line)]
+    opacities = _parse_lines(lines, (len(pressures), len(temperatures) + 1), file)
+    return index.wavelengths[start:stop], opacities
+
+
+def load_opacities(file, progress=False):
+    """
+    Loads the grids and opacities of an opacity file or binary store. A store is
+    memory-mapped rather than read, so slicing the opacities only pages in that slice.
+
+    Inputs
+    -------
+        :file: (str) path to opacity file or store. e.g., 'opacFe.dat' or 'opacFe.store'
+        :progress: (bool) whether or not to include a progress bar (if tqdm is installed).
+
+    Outputs
+    -------
+        :wavelengths: (np.array) wavelength grid of the file
+        :pressures: (np.array) pressure grid of the file
+        :temperatures: (np.array) temperature grid of the file [K]
+        :opacities: (np.array or np.memmap) opacities, shaped (wavelength, pressure, temperature)
+    """
+    if is_store(file):
+        store = open_store(file)
+        return store.wavelengths, store.pressures, store.temperatures, store.opacities
+
+    return read_opacity_file(file, progress=progress)
+
+
+######################## Binary opacity stores ########################
+
+
+class OpacityStore:
+    """
+    The contents of a binary opacity store.
+
+    Attributes
+    ----------
+        :wavelengths: (np.array) wavelength grid
+        :pressures: (np.array) pressure grid
+        :temperatures: (np.array) temperature grid [K]
+        :opacities: (np.memmap or QuantizedOpacities) opacities, shaped (wavelength, pressure,
+                    temperature)
+        :header: (str) the two header lines of the original text file
+        :text_format: (dict) printf-style formats used to write the store back out as text
+    """
+
+    def __init__(self, wavelengths, pressures, temperatures, opacities, header, text_format):
+        self.wavelengths = wavelengths
+        self.pressures = pressures
+        self.temperatures = temperatures
+        self.opacities = opacities
+        self.header = header
+        self.text_format = text_format
+
+
+# formats written by opacity-rebinning.py, used when nothing better is known
+DEFAULT_TEXT_FORMAT = {
+    "wavelength": "%.9E",
+    "pressure": "%.6E",
+    "opacity": "%.6E",
+    "line_end": "\n",
+}
+
+
+def is_store(path):
+    """
+    Checks whether a path points to a binary opacity store (quantized or not).
+    """
+    return os.path.isdir(path) and (
+        os.path.exists(os.path.join(path, "opacities.npy")) or is_quantized(path)
+    )
+
+
+def store_path(file):
+    """
+    Returns the default store path for an opacity file. e.g., 'opacTiO.dat' -> 'opacTiO.store'
+    """
+    return os.path.splitext(file)[0] + ".store"
+
+
+def open_store(store, mode="r"):
+    """
+    Opens a binary opacity store.
+
+    Inputs
+    -------
+        :store: (str) path to store. e.g., 'opacTiO.store'
+        :mode: (str) memmap mode of the opacities. 'r' for read-only, 'r+' to modify in place
+                    (not for a quantized store, whose opacities are always read-only).
+
+    Outputs
+    -------
+        :store: (OpacityStore) the grids, memory-mapped opacities and text header of the store.
+    """
+    if not is_store(store):
+        raise FileNotFoundError(f"{store} is not an opacity store.")
+
+    with open(os.path.join(store, "header.txt")) as f:
+        header = f.read()
+    with open(os.path.join(store, "format.json")) as f:
+        text_format = json.load(f)
+
+    if is_quantized(store):
+        if mode != "r":
+            raise ValueError(f"{store} is quantized, so it can only be opened read-only.")
+        opacities = QuantizedOpacities.open(store)
+    else:
+        opacities = np.load(os.path.join(store, "opacities.npy"), mmap_mode=mode)
+
+    return OpacityStore(
+        np.load(os.path.join(store, "wavelengths.npy")),
+        np.load(os.path.join(store, "pressures.npy")),
+        np.load(os.path.join(store, "temperatures.npy")),
+        opacities,
+        header,
+        text_format,
+    )
+
+
+def create_store(store, wavelengths, pressures, temperatures, header, text_format=None):
+    """
+    Creates an empty binary store, to be filled in a slice at a time.
+
+    Inputs
+    -------
+        :store: (str) path to store to create. e.g., 'opacTiO.store'
+        :wavelengths: (np.array) wavelength grid
+        :pressures: (np.array) pressure grid
+        :temperatures: (np.array) temperature grid [K]
+        :header: (str) the two header lines to write the store back out as text with
+        :text_format: (dict or None) number formats, as returned by detect_text_format.
+
+    Outputs
+    -------
+        :opacities: (np.memmap) writable opacities of the store, shaped (wavelength, pressure, temperature)
+    """
+    _save_store_grids(store, wavelengths, pressures, temperatures, header, text_format)
+
+    return np.lib.format.open_memmap(
+        os.path.join(store, "opacities.npy"),
+        mode="w+",
+        dtype=np.float64,
+        shape=(len(wavelengths), len(pressures), len(temperatures)),
+    )
+
+
+def _save_store_grids(store, wavelengths, pressures, temperatures, header, text_format=None):
+    """
+    Saves everything but the opacities of a store (creating its directory if need be).
+    """
+    os.makedirs(store, exist_ok=True)
+    np.save(os.path.join(store, "wavelengths.npy"), wavelengths)
+    np.save(os.path.join(store, "pressures.npy"), pressures)
+    np.save(os.path.join(store, "temperatures.npy"), temperatures)
+    with open(os.path.join(store, "header.txt"), "w") as f:
+        f.write(header)
+    with open(os.path.join(store, "format.json"), "w") as f:
+        json.dump(DEFAULT_TEXT_FORMAT if text_format is None else text_format, f)
+
+
+def text_to_store(file, store=None, progress=True):
+    """
+    Converts an opacity file into a binary store. Only needs to be done once per file.
+
+    Inputs
+    -------
+        :file: (str) path to opacity file. e.g., 'opacTiO.dat'
+        :store: (str or None) path to store to create. Defaults to file with a .store
+                    extension, e.g. 'opacTiO.store'.
+        :progress: (bool) whether or not to include a progress bar (if tqdm is installed).
+
+    Outputs
+    -------
+        :store: (str) path to the created store.
+
+    Side effects
+    -------------
+        Creates a directory holding wavelengths.npy, pressures.npy, temperatures.npy,
+        opacities.npy, header.txt and format.json.
+    """
+    if store is None:
+        store = store_path(file)
+
+    temperatures, pressures = read_header(file)
+    opacities = create_store(
+        store,
+        read_wavelengths(file, progress=progress),
+        pressures,
+        temperatures,
+        read_header_text(file),
+        detect_text_format(file),
+    )
+
+    start = 0
+    for batch_wavelengths, batch_opacities in iter_opacity_blocks(file, progress=progress):
+        stop = start + len(batch_wavelengths)
+        opacities[start:stop] = batch_opacities
+        start = stop
+    opacities.flush()
+    del opacities
+
+    return store
+
+
+def rescale_store(store, scale, blocks_per_batch=4096, progress=True):
+    """
+    Multiplies every opacity in a binary store by scale, in place.
+
+    Inputs
+    -------
+        :store: (str) path to store. e.g., 'opacTiO.store'
+        :scale: (float) value by which to multiply all the opacities.
+        :blocks_per_batch: (int) number of wavelengths to rescale at once.
+        :progress: (bool) whether or not to include a progress bar (if tqdm is installed).
+
+    Outputs
+    -------
+        None
+
+    Side effects
+    -------------
+        Modifies the opacities of the store. A quantized store only has its offsets shifted.
+    """
+    if is_quantized(store):
+        if scale <= 0:
+            raise ValueError("A quantized store can only be rescaled by a positive number.")
+        with open(os.path.join(store, "quantization.json")) as f:
+            quantization = json.load(f)
+        quantization["offsets"] = [offset + np.log10(scale) for offset in quantization["offsets"]]
+        with open(os.path.join(store, "quantization.json"), "w") as f:
+            json.dump(quantization, f, indent=1)
+        return
+
+    opacities = open_store(store, mode="r+").opacities
+    starts = range(0, len(opacities), blocks_per_batch)
+    for start in tqdm(starts, desc=f"Rescaling {store}") if progress else starts:
+        opacities[start : start + blocks_per_batch] *= scale
+    opacities.flush()
+
+
+def store_to_text(store, file, progress=True):
+    """
+    Writes a binary store back out as an RT-format opacity file, using the header and
+    number formatting of the file it was converted from.
+
+    Inputs
+    -------
+        :store: (str) path to store. e.g., 'opacTiO.store'
+        :file: (str) path to opacity file to write. e.g., 'opacTiO.dat'
+        :progress: (bool) whether or not to include a progress bar (if tqdm is installed).
+
+    Outputs
+    -------
+        None
+
+    Side effects
+    -------------
+        Writes file.
+    """
+    opened = open_store(store)
+    write_opacity_file(
+        file,
+        opened.wavelengths,
+        opened.pressures,
+        opened.temperatures,
+        opened.opacities,
+        opened.header,
+        opened.text_format,
+        progress=progress,
+    )
+
+
+def detect_text_format(file):
+    """
+    Works out the printf-style number formats of an opacity file from its first
+    wavelength block, so that a store can be written back out unchanged.
+
+    Inputs
+    -------
+        :file: (str) path to opacity file. e.g., 'opacTiO.dat'
+
+    Outputs
+    -------
+        :text_format: (dict) formats of the wavelengths, pressures and opacities, and
+                    the line ending of the pressure lines.
+    """
+    if is_store(file):
+        return open_store(file).text_format
+
+    for wavelength, lines in iter_raw_blocks(file):
+        if len(lines) < 2:
+            break
+        tokens = lines[1].split()
+        return {
+            "wavelength": number_format(lines[0].strip()),
+            "pressure": number_format(tokens[0]),
+            "opacity": number_format(tokens[1]),
+            "line_end": " \n" if lines[1].endswith(" \n") else "\n",
+        }
+    return dict(DEFAULT_TEXT_FORMAT)
+
+
+def number_format(token):
+    """
+    Returns a printf-style format that reproduces a number token. e.g., '1.000000E-01' -> '%.6E'
+    """
+    for exponent in ("E", "e"):
+        if exponent in token:
+            mantissa = token.split(exponent)[0]
+            break
+    else:
+        exponent = "f"
+        mantissa = token
+    decimals = len(mantissa.split(".")[1]) if "." in mantissa else 0
+    return f"%.{decimals}{exponent}"
+
+
+def format_blocks(wavelengths, pressures, opacities, text_format=None):
+    """
+    Formats wavelength blocks as RT-format text.
+
+    Inputs
+    -------
+        :wavelengths: (np.array) wavelengths of the blocks
+        :pressures: (np.array) pressure grid
+        :opacities: (np.array) opacities, shaped (wavelength, pressure, temperature)
+        :text_format: (dict or None) number formats, as returned by detect_text_format.
+
+    Outputs
+    -------
+        Yields (wavelength, lines) for each block, as iter_raw_blocks does.
+    """
+    if text_format is None:
+        text_format = DEFAULT_TEXT_FORMAT
+    wavelength_format = text_format["wavelength"] + "\n"
+    row_format = (
+        text_format["pressure"]
+        + (" " + text_format["opacity"]) * opacities.shape[2]
+        + text_format["line_end"]
+    )
+
+    rows = np.empty((len(pressures), opacities.shape[2] + 1))
+    rows[:, 0] = pressures
+    for wavelength, block in zip(wavelengths, opacities):
+        rows[:, 1:] = block
+        lines = [wavelength_format % wavelength]
+        lines += [row_format % tuple(row) for row in rows]
+        yield wavelength, lines
+
+
+def format_rows(values, row_format, rows_per_batch=4096):
+    """
+    Formats every row of a 2-D array with the same printf-style format, a batch of rows per
+    format call rather than a call per number or per line.
+
+    Inputs
+    -------
+        :values: (np.array) numbers, shaped (row, value)
+        :row_format: (str) format of one row, with one conversion per value
+        :rows_per_batch: (int) number of rows to format at once.
+
+    Outputs
+    -------
+        Yields the text of each batch of rows.
+    """
+    values = np.asarray(values, dtype=np.float64)
+    values = values.reshape(len(values), -1)
+    for start in range(0, len(values), rows_per_batch):
+        batch = values[start : start + rows_per_batch]
+        yield (row_format * len(batch)) % tuple(batch.ravel().tolist())
+
+
+def format_block_text(wavelengths, pressures, opacities, text_format=None, blocks_per_batch=256):
+    """
+    Formats wavelength blocks as RT-format text, as format_blocks does, but a batch of whole
+    blocks at a time.
+
+    Inputs
+    -------
+        :wavelengths: (np.array) wavelengths of the blocks
+        :pressures: (np.array) pressure grid
+        :opacities: (np.array) opacities, shaped (wavelength, pressure, temperature)
+        :text_format: (dict or None) number formats, as returned by detect_text_format.
+        :blocks_per_batch: (int) number of wavelength blocks to format at once.
+
+    Outputs
+    -------
+        Yields the text of each batch of blocks.
+    """
+    if text_format is None:
+        text_format = DEFAULT_TEXT_FORMAT
+    num_wavelengths, num_pressures, num_temperatures = np.shape(opacities)
+    row_format = (
+        text_format["pressure"]
+        + (" " + text_format["opacity"]) * num_temperatures
+        + text_format["line_end"]
+    )
+    block_format = text_format["wavelength"] + "\n" + row_format * num_pressures
+
+    # each block is laid out as one row: its wavelength, then each pressure and its opacities
+    for start in range(0, num_wavelengths, blocks_per_batch):
+        batch = opacities[start : start + blocks_per_batch]
+        rows = np.empty((len(batch), 1 + num_pressures * (num_temperatures + 1)))
+        rows[:, 0] = wavelengths[start : start + blocks_per_batch]
+        table = rows[:, 1:].reshape(len(batch), num_pressures, num_temperatures + 1)
+        table[:, :, 0] = pressures
+        table[:, :, 1:] = batch
+        yield from format_rows(rows, block_format, rows_per_batch=blocks_per_batch)
+
+
+def format_header(temperatures, pressures, text_format=None):
+    """
+    Formats the two header lines of an opacity file, for when there is no original header to copy.
+    """
+    if text_format is None:
+        text_format = DEFAULT_TEXT_FORMAT
+    return (
+        " ".join("%.3f" % temperature for temperature in temperatures)
+        + "\n"
+        + " ".join(text_format["pressure"] % pressure for pressure in pressures)
+        + "\n"
+    )
+
+
+class RTWriter:
+    """
+    Writes an RT-format file (opacities, or CIA) through a large buffer, gzip-compressed if
+    its name ends in .gz.
+
+    The file is written to a temporary file that is only renamed into place once it is
+    closed, so a killed job never leaves a half-written file behind. Leaving a `with` block
+    on an exception removes the temporary file instead.
+
+    Example:
+
+    >>> with RTWriter('125k-opacCO.dat', header) as writer:
+    ...     writer.write_blocks(wavelengths, pressures, opacities)  # any number of times
+    """
+
+    def __init__(self, file, header, text_format=None, buffer_size=WRITE_BUFFER_SIZE, compresslevel=6):
+        """
+        Inputs
+        -------
+            :file: (str) path to the file to write. e.g., '125k-opacCO.dat' or '125k-opacCO.dat.gz'
+            :header: (str) text written at the top of the file.
+            :text_format: (dict or None) number formats of the opacities, as returned by
+                        detect_text_format.
+            :buffer_size: (int) size of the write buffer [bytes].
+            :compresslevel: (int) gzip compression level, 1 (fastest) to 9, if compressing.
+        """
+        self.file = file
+        self.text_format = DEFAULT_TEXT_FORMAT if text_format is None else text_format
+        tmp_file = file[:-3] + ".tmp.gz" if file.endswith(".gz") else file + ".tmp"
+        self.handle = open_text(tmp_file, "w", buffering=buffer_size, compresslevel=compresslevel)
+        self.tmp_file = tmp_file
+        self.handle.write(header)
+
+    def write(self, text):
+        """
+        Writes text (a string or an iterable of strings) as it is.
+        """
+        if isinstance(text, str):
+            self.handle.write(text)
+        else:
+            self.handle.writelines(text)
+
+    def write_blocks(self, wavelengths, pressures, opacities):
+        """
+        Writes wavelength blocks, with opacities shaped (wavelength, pressure, temperature).
+        """
+        self.write(format_block_text(wavelengths, pressures, opacities, self.text_format))
+
+    def close(self):
+        """
+        Finishes the file, moving it into place.
+        """
+        if self.handle is None:
+            return
+        self.handle.close()
+        self.handle = None
+        os.replace(self.tmp_file, self.file)
+
+    def abort(self):
+        """
+        Closes and removes the unfinished file.
+        """
+        if self.handle is None:
+            return
+        self.handle.close()
+        self.handle = None
+        os.remove(self.tmp_file)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+
+def write_opacity_file(
+    file, wavelengths, pressures, temperatures, opacities, header=None, text_format=None, progress=False
+):
+    """
+    Writes an opacity cube out as an RT-format opacity file in one pass.
+
+    Inputs
+    -------
+        :file: (str) path to the file to write, gzip-compressed if it ends in .gz. e.g., 'opacCO.dat'
+        :wavelengths: (np.array) wavelength grid
+        :pressures: (np.array) pressure grid
+        :temperatures: (np.array) temperature grid [K]
+        :opacities: (np.array) opacities, shaped (wavelength, pressure, temperature). May be a memmap.
+        :header: (str or None) the two header lines. Default to the formatted grids.
+        :text_format: (dict or None) number formats, as returned by detect_text_format.
+        :progress: (bool) whether or not to include a progress bar (if tqdm is installed).
+
+    Outputs
+    -------
+        None
+
+    Side effects
+    -------------
+        Writes file.
+    """
+    if header is None:
+        header = format_header(temperatures, pressures, text_format)
+
+    blocks_per_batch = 4096
+    starts = range(0, len(wavelengths), blocks_per_batch)
+    with RTWriter(file, header, text_format) as writer:
+        for start in tqdm(starts, desc=f"Writing {file}") if progress else starts:
+            stop = start + blocks_per_batch
+            writer.write_blocks(wavelengths[start:stop], pressures, opacities[start:stop])
+
+
+def _iter_store_text_blocks(store, blocks_per_batch=4096, progress=False):
+    """
+    Streams through a binary store one wavelength block at a time, formatted as text.
+    """
+    opened = open_store(store)
+    for wavelengths, opacities in iter_opacity_blocks(
+        store, blocks_per_batch=blocks_per_batch, progress=progress
+    ):
+        yield from format_blocks(wavelengths, opened.pressures, opacities, opened.text_format)
+
+
+######################## Quantized opacity stores ########################
+
+
+# code 0 stands for an opacity of exactly zero, and codes 1 to QUANTIZATION_LEVELS for log10 values
+QUANTIZATION_LEVELS = 2**16 - 1
+
+
+class QuantizedOpacities:
+    """
+    The opacities of a quantized store, decoded as they are sliced.
+
+    Every opacity is stored as a 16 bit code, 0 for an opacity of exactly zero and otherwise
+    code = 1 + round((log10(opacity) - offset) / scale), where each chunk of wavelengths has its
+    own offset (its smallest log10 opacity) and scale (its range of log10 opacities over
+    QUANTIZATION_LEVELS - 1). Decoding is then off by at most scale / 2 in log10, i.e. by a
+    relative error of at most 10**(scale / 2) - 1: about 2.6e-4 for a chunk spanning 15 decades.
+
+    Slicing along the wavelength axis (and with integers or slices along the others) returns
+    float64 opacities, as slicing the memmap of an ordinary store does.
+    """
+
+    def __init__(self, codes, offsets, scales, wavelengths_per_chunk):
+        """
+        Inputs
+        -------
+            :codes: (np.memmap) 16 bit codes, shaped (wavelength, pressure, temperature)
+            :offsets: (np.array) log10 opacity of code 1 in each chunk of wavelengths
+            :scales: (np.array) log10 step between codes in each chunk of wavelengths
+            :wavelengths_per_chunk: (int) number of wavelengths in each chunk
+        """
+        self.codes = codes
+        self.offsets = np.asarray(offsets, dtype=np.float64)
+        self.scales = np.asarray(scales, dtype=np.float64)
+        self.wavelengths_per_chunk = wavelengths_per_chunk
+
+    @classmethod
+    def open(cls, store):
+        """
+        Memory-maps the codes of a quantized store.
+        """
+        with open(os.path.join(store, "quantization.json")) as f:
+            quantization = json.load(f)
+        return cls(
+            np.load(os.path.join(store, "log_opacities.npy"), mmap_mode="r"),
+            quantization["offsets"],
+            quantization["scales"],
+            quantization["wavelengths_per_chunk"],
+        )
+
+    @property
+    def shape(self):
+        return self.codes.shape
+
+    @property
+    def ndim(self):
+        return self.codes.ndim
+
+    @property
+    def dtype(self):
+        return np.dtype(np.float64)
+
+    def __len__(self):
+        return len(self.codes)
+
+    def __getitem__(self, key):
+        if not isinstance(key, tuple):
+            key = (key,)
+        rows = np.arange(len(self.codes))[key[0]]
+        codes = np.asarray(self.codes[key])
+
+        chunks = rows // self.wavelengths_per_chunk
+        col = (Ellipsis,) if np.ndim(rows) == 0 else (slice(None),) + (np.newaxis,) * (codes.ndim - 1)
+        offsets = np.asarray(self.offsets[chunks])[col]
+        scales = np.asarray(self.scales[chunks])[col]
+
+        opacities = 10.0 ** (offsets + (codes.astype(np.float64) - 1) * scales)
+        return np.where(codes == 0, 0.0, opacities)
+
+    def __array__(self, dtype=None, copy=None):
+        opacities = self[:]
+        return opacities if dtype is None else opacities.astype(dtype)
+
+
+def is_quantized(path):
+    """
+    Checks whether a path points to a quantized opacity store.
+    """
+    return os.path.isdir(path) and os.path.exists(os.path.join(path, "log_opacities.npy"))
+
+
+def quantized_store_path(file):
+    """
+    Returns the default quantized store path for an opacity file. e.g., 'opacTiO.dat' -> 'opacTiO.qstore'
+    """
+    return os.path.splitext(file.rstrip("/"))[0] + ".qstore"
+
+
+def quantize_store(file, store=None, wavelengths_per_chunk=4096, progress=True):
+    """
+    Converts an opacity file (or binary store) into a quantized store, which holds log10 of every
+    opacity as a 16 bit code (see QuantizedOpacities), an eighth of the size of an ordinary store
+    and about a sixth of the text. Every reader in this module reads it like any other store.
+
+    Inputs
+    -------
+        :file: (str) path to opacity file or binary store. e.g., 'opacTiO.dat'
+        :store: (str or None) path to quantized store to create. Defaults to file with a .qstore
+                    extension, e.g. 'opacTiO.qstore'.
+        :wavelengths_per_chunk: (int) number of wavelengths sharing an offset and scale. Smaller
+                    chunks span fewer decades, so are decoded more accurately.
+        :progress: (bool) whether or not to include a progress bar (if tqdm is installed).
+
+    Outputs
+    -------
+        :store: (str) path to the created store.
+
+    Side effects
+    -------------
+        Creates a directory holding wavelengths.npy, pressures.npy, temperatures.npy,
+        log_opacities.npy, quantization.json, header.txt and format.json. quantization.json
+        holds each chunk's offset and scale, and the largest relative error they allow.
+    """
+    if store is None:
+        store = quantized_store_path(file)
+
+    temperatures, pressures = read_header(file)
+    wavelengths = read_wavelengths(file, progress=progress)
+    _save_store_grids(
+        store, wavelengths, pressures, temperatures, read_header_text(file), detect_text_format(file)
+    )
+    codes = np.lib.format.open_memmap(
+        os.path.join(store, "log_opacities.npy"),
+        mode="w+",
+        dtype=np.uint16,
+        shape=(len(wavelengths), len(pressures), len(temperatures)),
+    )
+
+    offsets = []
+    scales = []
+    start = 0
+    for batch_wavelengths, opacities in iter_opacity_blocks(
+        file, blocks_per_batch=wavelengths_per_chunk, progress=progress
+    ):
+        opacities = np.asarray(opacities)
+        if not np.all(np.isfinite(opacities)) or np.any(opacities < 0):
+            raise ValueError(f"{file} has negative or non-finite opacities, which can't be quantized.")
+
+        nonzero = opacities > 0
+        with np.errstate(divide="ignore"):
+            log_opacities = np.log10(opacities)
+        if np.any(nonzero):
+            offset = log_opacities[nonzero].min()
+            span = log_opacities[nonzero].max() - offset
+        else:
+            offset, span = 0.0, 0.0
+        scale = span / (QUANTIZATION_LEVELS - 1)
+
+        batch_codes = np.zeros(opacities.shape, dtype=np.uint16)
+        batch_codes[nonzero] = 1 + np.rint((log_opacities[nonzero] - offset) / (scale or 1.0))
+        codes[start : start + len(opacities)] = batch_codes
+        start += len(opacities)
+
+        offsets.append(float(offset))
+        scales.append(float(scale))
+    codes.flush()
+    del codes
+
+    bounds = [10 ** (scale / 2) - 1 for scale in scales]
+    with open(os.path.join(store, "quantization.json"), "w") as f:
+        json.dump(
+            {
+                "bits": 16,
+                "wavelengths_per_chunk": wavelengths_per_chunk,
+                "offsets": offsets,
+                "scales": scales,
+                "max_relative_error": max(bounds, default=0.0),
+            },
+            f,
+            indent=1,
+        )
+
+    return store
+
+
+def verify_quantized_store(store, reference, blocks_per_batch=4096, progress=False):
+    """
+    Measures how far the opacities of a quantized store are from those of the file (or store)
+    it was made from.
+
+    Inputs
+    -------
+        :store: (str) path to quantized store. e.g., 'opacTiO.qstore'
+        :reference: (str) path to the original opacity file or store. e.g., 'opacTiO.dat'
+        :blocks_per_batch: (int) number of wavelengths to compare at once.
+        :progress: (bool) whether or not to include a progress bar (if tqdm is installed).
+
+    Outputs
+    -------
+        :report: (dict) the largest and mean relative error of the non-zero opacities, the bound
+                    promised by quantization.json, whether every zero stayed exactly zero, and the
+                    sizes of both on disk [bytes].
+    """
+    with open(os.path.join(store, "quantization.json")) as f:
+        bound = json.load(f)["max_relative_error"]
+
+    max_error = 0.0
+    total_error = 0.0
+    count = 0
+    zeros_kept = True
+    for (wavelengths, opacities), (ref_wavelengths, ref_opacities) in zip(
+        iter_opacity_blocks(store, blocks_per_batch, progress=progress),
+        iter_opacity_blocks(reference, blocks_per_batch),
+    ):
+        if not np.array_equal(wavelengths, ref_wavelengths):
+            raise ValueError(f"{store} and {reference} don't have the same wavelength grid.")
+        ref_opacities = np.asarray(ref_opacities)
+        nonzero = ref_opacities != 0
+        zeros_kept &= bool(np.all(opacities[~nonzero] == 0))
+        errors = np.abs(opacities[nonzero] / ref_opacities[nonzero] - 1)
+        if errors.size:
+            max_error = max(max_error, float(errors.max()))
+            total_error += float(errors.sum())
+            count += errors.size
+
+    return {
+        "store": store,
+        "reference": reference,
+        "max_relative_error": max_error,
+        "mean_relative_error": total_error / count if count else 0.0,
+        "bound": bound,
+        "zeros_kept": zeros_kept,
+        "size": get_size(store),
+        "reference_size": get_size(reference),
+    }
+
+
+def get_size(path):
+    """
+    Size of an opacity file, or of every file in a binary store [bytes].
+    """
+    if os.path.isdir(path):
+        return sum(os.path.getsize(os.path.join(path, name)) for name in os.listdir(path))
+    return os.path.getsize(path)
+
+
+######################## Writing chunk files ########################
+
+
+class ChunkWriter:
+    """
+    Writes a set of chunk files, e.g. opacFe0.dat, opacFe1.dat, ..., keeping a buffered
+    handle open per chunk rather than reopening a file for every line.
+
+    Like RTWriter, each chunk is written to a temporary file that is only renamed into
+    place once the chunk is closed, and leaving a `with` block on an exception removes
+    the temporary files instead. The MD5 checksum of each finished chunk is kept in
+    `checksums`, for the chunk manifest.
+
+    Example:
+
+    >>> with ChunkWriter('opacFe.dat', header) as writer:
+    ...     writer.write(0, lines)
+    ...     writer.close(0)  # opacFe0.dat now exists
+    ...     writer.write(1, more_lines)
+    """
+
+    def __init__(self, file, header, buffer_size=WRITE_BUFFER_SIZE):
+        """
+        Inputs
+        -------
+            :file: (str) path to the file being chunked. e.g., 'opacFe.dat'
+            :header: (str) text written at the top of every chunk file.
+            :buffer_size: (int) size of the write buffer of each chunk file [bytes].
+        """
+        self.base = os.path.splitext(file)[0]
+        self.header = header
+        self.buffer_size = buffer_size
+        self.handles = {}
+        self.hashes = {}
+        self.checksums = {}
+
+    def path(self, index):
+        """
+        Returns the path of a chunk file. e.g., 'opacFe5.dat'
+        """
+        return f"{self.base}{index}.dat"
+
+    def write(self, index, text):
+        """
+        Writes text (a string or a list of lines) to a chunk, opening the chunk and
+        writing its header first if need be.
+        """
+        if index not in self.handles:
+            f = open(self.path(index) + ".tmp", "w", buffering=self.buffer_size)
+            f.write(self.header)
+            self.handles[index] = f
+            self.hashes[index] = hashlib.md5(self.header.encode())
+        if not isinstance(text, str):
+            text = "".join(text)
+        self.handles[index].write(text)
+        self.hashes[index].update(text.encode())
+
+    def close(self, index):
+        """
+        Finishes a chunk, moving it into place.
+        """
+        if index not in self.handles:
+            return
+        f = self.handles.pop(index)
+        f.close()
+        os.replace(f.name, self.path(index))
+        self.checksums[index] = self.hashes.pop(index).hexdigest()
+
+    def close_all(self):
+        """
+        Finishes every chunk that is still open.
+        """
+        for index in sorted(self.handles):
+            self.close(index)
+
+    def abort(self):
+        """
+        Closes and removes every chunk that has not been finished.
+        """
+        for f in self.handles.values():
+            f.close()
+            os.remove(f.name)
+        self.handles = {}
+        self.hashes = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close_all()
+        else:
+            self.abort()
+
+
+def manifest_path(file, virtual=False):
+    """
+    Returns the path of the chunk manifest of a chunked file. e.g., 'opacFe.dat' or
+    'opacFe' -> 'opacFe_manifest.json'. Virtual chunks (chunking_utils.plan_chunk_views)
+    get their own manifest, e.g. 'opacFe_views_manifest.json', so that planning views of
+    a file never overwrites the manifest of chunk files made from it, or vice versa.
+    """
+    suffix = "_views_manifest.json" if virtual else "_manifest.json"
+    return os.path.splitext(file)[0] + suffix
+
+
+def write_chunk_manifest(file, wavelengths, starts, stops, edges, checksums, virtual=False):
+    """
+    Records how a file was chunked, so that anything downstream can get the chunks'
+    number and boundaries without reading any opacity file.
+
+    Inputs
+    -------
+        :file: (str) path to the file that was chunked. e.g., 'opacFe.dat'
+        :wavelengths: (np.array) wavelength grid that was chunked.
+        :starts: (np.array) index of the first wavelength written to each chunk, overlap included.
+        :stops: (np.array) index one past the last wavelength written to each chunk,
+                    overlap included.
+        :edges: (np.array) chunk edges without overlap: chunk i holds wavelengths
+                    edges[i]:edges[i + 1], plus its overlap.
+        :checksums: (dict) MD5 checksum of each chunk file, as kept by ChunkWriter.
+        :virtual: (bool) whether the chunks are only views of file, with no chunk files
+                    written (see chunking_utils.ChunkViews).
+
+    Outputs
+    -------
+        :manifest_file: (str) path to the manifest. e.g., 'opacFe_manifest.json', or
+                    'opacFe_views_manifest.json' for virtual chunks.
+
+    Side effects
+    -------------
+        Writes the manifest, a JSON file listing every chunk's index, file, first and last
+        wavelength, number of wavelengths, overlap with its neighbours and checksum.
+    """
+    base = os.path.splitext(file)[0]
+    chunks = []
+    for i in range(len(edges) - 1):
+        chunks.append(
+            {
+                "index": i,
+                "file": os.path.basename(f"{base}{i}.dat"),
+                "start": int(edges[i]),
+                "stop": int(edges[i + 1]),
+                "first_wavelength": float(wavelengths[edges[i]]),
+                "last_wavelength": float(wavelengths[edges[i + 1] - 1]),
+                "num_wavelengths": int(edges[i + 1] - edges[i]),
+                "overlap_previous": int(edges[i] - starts[i]),
+                "overlap_next": int(stops[i] - edges[i + 1]),
+                "checksum": checksums.get(i),
+            }
+        )
+
+    manifest = {
+        "source": os.path.basename(file),
+        "num_wavelengths": len(wavelengths),
+        "nchunks": len(chunks),
+        "virtual": virtual,
+        "edges": [int(edge) for edge in edges],
+        "chunks": chunks,
+    }
+
+    return save_chunk_manifest(manifest, file)
+
+
+def save_chunk_manifest(manifest, file):
+    """
+    Saves a (possibly updated) chunk manifest next to the chunks of file.
+
+    Inputs
+    -------
+        :manifest: (dict) the manifest, as written by write_chunk_manifest.
+        :file: (str) path to the file that was chunked (or its base name). e.g., 'opacFe.dat'
+
+    Outputs
+    -------
+        :manifest_file: (str) path to the manifest. e.g., 'opacFe_manifest.json'
+    """
+    manifest_file = manifest_path(file, manifest.get("virtual", False))
+    with open(manifest_file + ".tmp", "w") as f:
+        json.dump(manifest, f, indent=1)
+    os.replace(manifest_file + ".tmp", manifest_file)
+    return manifest_file
+
+
+def file_checksum(file):
+    """
+    Returns the MD5 checksum of a file, as recorded in chunk manifests.
+    """
+    checksum = hashlib.md5()
+    with open(file, "rb") as f:
+        for block in iter(lambda: f.read(WRITE_BUFFER_SIZE), b""):
+            checksum.update(block)
+    return checksum.hexdigest()
+
+
+def load_chunk_manifest(file, virtual=False):
+    """
+    Loads a chunk manifest.
+
+    Inputs
+    -------
+        :file: (str) path to the manifest, or to the file that was chunked (or its base
+                    name). e.g., 'opacFe_manifest.json', 'opacFe.dat' or '../opacFe/opacFe'
+        :virtual: (bool) whether to load the manifest of virtual chunks, if file isn't
+                    the path to a manifest.
+
+    Outputs
+    -------
+        :manifest: (dict) the manifest, as written by write_chunk_manifest.
+    """
+    if not file.endswith(".json"):
+        file = manifest_path(file, virtual)
+    with open(file) as f:
+        return json.load(f)
@@ -0,0 +1,38 @@
+#!/usr/bin/env python
+# coding: utf-8
+"""
+Converts opacity files into quantized stores, which hold log10 of every opacity as a 16 bit
+code and are read like any other opacity file, and reports the error this makes per species.
+
+>>> python quantize-opacities.py opacFe/opacFe.dat opacTiO/opacTiO.dat
+
+With --verify-only, the stores (e.g. opacFe/opacFe.qstore) are only checked against the files.
+"""
+
+
+import argparse
+import os
+
+from opacity_io import quantize_store, quantized_store_path, verify_quantized_store
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Quantizes opacity files and reports the error per species.')
+    parser.add_argument('files', nargs='+', help='opacity files (or binary stores) to quantize')
+    parser.add_argument('--wavelengths-per-chunk', type=int, default=4096,
+                        help='number of wavelengths sharing an offset and scale')
+    parser.add_argument('--verify-only', action='store_true',
+                        help="don't quantize, only compare existing quantized stores to the files")
+    args = parser.parse_args()
+
+    print(f"{'species':<24} {'max error':>10} {'mean error':>10} {'bound':>10} {'zeros':>6} {'size ratio':>10}")
+    for file in args.files:
+        store = quantized_store_path(file)
+        if not args.verify_only:
+            quantize_store(file, store, wavelengths_per_chunk=args.wavelengths_per_chunk)
+
+        report = verify_quantized_store(store, file)
+        species = os.path.basename(os.path.splitext(file.rstrip('/'))[0])
+        print(f"{species:<24} {report['max_relative_error']:>10.3e} {report['mean_relative_error']:>10.3e} "
+              f"{report['bound']:>10.3e} {'kept' if report['zeros_kept'] else 'LOST':>6} "
+              f"{report['reference_size'] / report['size']:>10.2f}")
@@ -0,0 +1,999 @@
+"""
+Rebinning operators for spectra and opacity files.
+
+Rebinning from one wavelength grid to another (as in matej_resolution_functions.convert_spectrum)
+is linear in the flux (mode 'linear') or in the log of the flux (mode 'log'): every new bin is the
+trapezoid integral of the interpolated old spectrum over the bin, divided by its width. So the whole
+mapping is a sparse matrix that only depends on the two grids and the mode. A RebinningOperator holds
+that matrix, and can be applied to any number of spectra or opacity columns on the same old grid.
+
+Example instructions / workflow:
+
+>>> operator = get_rebinning_operator(wavelengths, resolution=125000, cache_dir='rebinning_cache')
+>>> new_opacities = operator.apply(opacities[:, 0, :])  # (new wavelength, temperature)
+>>> operator.new_lambda  # the new grid
+
+Operators are saved in cache_dir under a hash of the old grid, the bin interfaces and the mode, so
+rebinning every species on a given grid builds the operator once.
+
+Whole opacity files are rebinned along their wavelength axis while streaming through them, so memory
+is set by the window of wavelengths read at once rather than by the size of the file:
+
+>>> rebin_opacity_file('opacCO.dat', '125k-opacCO.dat', resolution=125000, cache_dir='rebinning_cache')
+
+Several resolutions can be made in the same pass through a file, as a pyramid of levels listed in a
+manifest (opacCO_pyramid.json), each identical to what rebin_opacity_file would make:
+
+>>> build_opacity_pyramid('opacCO.dat', [250000, 125000, 25000], cache_dir='rebinning_cache')
+>>> load_pyramid_manifest('opacCO')['resolutions']
+[250000, 125000, 25000]
+
+rebin_opacity_parallel does the same as rebin_opacity_file on every core of a node, with the (pressure,
+temperature) columns split between processes that share the opacities rather than copying them.
+
+"""
+import hashlib
+import json
+import os
+import shutil
+from multiprocessing import Pool, shared_memory
+
+import numpy as np
+
+from opacity_io import (
+    DEFAULT_TEXT_FORMAT,
+    RTWriter,
+    create_store,
+    format_block_text,
+    is_quantized,
+    is_store,
+    iter_opacity_blocks,
+    read_header,
+    read_header_text,
+    read_wavelengths,
+    tqdm,
+    write_opacity_file,
+)
+
+
+class RebinningOperator:
+    """
+    The sparse matrix that rebins spectra from one wavelength grid to another.
+
+    Each new bin whose interfaces are both inside the old grid is a weighted sum of the old values
+    (fluxes, or log-fluxes in mode 'log'); bin_indptr, bin_indices and bin_weights hold those sums in
+    compressed sparse row form. The value at each interface is held the same way, since a bin is only
+    converted if the flux at both of its interfaces is non-zero.
+
+    Attributes
+    ----------
+        :new_lambda: (np.array) wavelength grid of the new bins (None if only interfaces were given)
+        :int_lambda: (np.array) wavelengths of the interfaces of the new bins
+        :type: (str) 'linear' or 'log'
+        :num_old: (int) number of points on the old grid
+        :bins: (np.array) index of each bin that is inside the old grid
+        :bin_indptr, bin_indices, bin_weights: (np.array) weights of each of those bins
+        :edges: (np.array) index of each interface that is inside the old grid
+        :edge_indptr, edge_indices, edge_weights: (np.array) weights of each of those interfaces
+    """
+
+    def __init__(
+        self,
+        new_lambda,
+        int_lambda,
+        type,
+        num_old,
+        bins,
+        bin_indptr,
+        bin_indices,
+        bin_weights,
+        edges,
+        edge_indptr,
+        edge_indices,
+        edge_weights,
+    ):
+        self.new_lambda = new_lambda
+        self.int_lambda = int_lambda
+        self.type = type
+        self.num_old = num_old
+        self.bins = bins
+        self.bin_indptr = bin_indptr
+        self.bin_indices = bin_indices
+        self.bin_weights = bin_weights
+        self.edges = edges
+        self.edge_indptr = edge_indptr
+        self.edge_indices = edge_indices
+        self.edge_weights = edge_weights
+
+    def apply(self, old_flux, extrapol_values=0.0):
+        """
+        Rebins spectra.
+
+        Inputs
+        -------
+            :old_flux: (np.array) flux on the old grid, either 1-D or shaped (wavelength, columns)
+                        to rebin every column at once.
+            :extrapol_values: (float or np.array) value of each new bin that can't be converted
+                        (outside the old grid, or with a flux of zero at one of its interfaces).
+
+        Outputs
+        -------
+            :new_flux: (np.array) flux on the new grid, shaped like old_flux along its columns.
+        """
+        old_flux = np.asarray(old_flux, dtype=np.float64)
+        if len(old_flux) != self.num_old:
+            raise ValueError(f"Expected {self.num_old} wavelengths, got {len(old_flux)}.")
+
+        col = (slice(None),) + (np.newaxis,) * (old_flux.ndim - 1)
+        num_bins = len(self.int_lambda) - 1
+
+        if self.type == "log":
+            with np.errstate(divide="ignore"):
+                values = np.log(old_flux)
+        else:
+            values = old_flux
+
+        # a bin is only converted if the flux is non-zero at both of its interfaces
+        edge_values = _csr_apply(self.edge_indptr, self.edge_indices, self.edge_weights, values)
+        edge_flux = np.exp(edge_values) if self.type == "log" else edge_values
+        edge_ok = np.zeros((num_bins + 1,) + old_flux.shape[1:], dtype=bool)
+        edge_ok[self.edges] = edge_flux != 0
+        converted = edge_ok[:-1] & edge_ok[1:]
+
+        new_values = np.zeros((num_bins,) + old_flux.shape[1:])
+        with np.errstate(invalid="ignore"):
+            new_values[self.bins] = _csr_apply(
+                self.bin_indptr, self.bin_indices, self.bin_weights, values
+            )
+        new_flux = np.exp(new_values) if self.type == "log" else new_values
+
+        extrapol_values = np.asarray(extrapol_values, dtype=np.float64)
+        if extrapol_values.ndim:
+            extrapol_values = extrapol_values[col]
+
+        return np.where(converted, new_flux, extrapol_values)
+
+    def old_ranges(self):
+        """
+        Returns the range of old points that each new bin depends on (through its own weights or those of
+        its interfaces), as (starts, stops). Bins that depend on no old point get an empty range.
+        """
+        num_bins = len(self.int_lambda) - 1
+        starts = np.full(num_bins, self.num_old)
+        stops = np.zeros(num_bins, dtype=int)
+
+        for rows, indptr, indices in [
+            (self.bins, self.bin_indptr, self.bin_indices),
+            (self.edges, self.edge_indptr, self.edge_indices),
+            (self.edges - 1, self.edge_indptr, self.edge_indices),
+        ]:
+            if not len(rows):
+                continue
+            row_min = np.minimum.reduceat(indices, indptr[:-1])
+            row_max = np.maximum.reduceat(indices, indptr[:-1])
+            keep = (rows >= 0) & (rows < num_bins)
+            np.minimum.at(starts, rows[keep], row_min[keep])
+            np.maximum.at(stops, rows[keep], row_max[keep] + 1)
+
+        return starts, stops
+
+    def window(self, bin_start, bin_stop, old_start, old_stop):
+        """
+        Returns the operator restricted to new bins bin_start:bin_stop, acting on old points old_start:old_stop
+        only (which must hold every old point those bins depend on).
+        """
+        j0, j1 = np.searchsorted(self.bins, [bin_start, bin_stop])
+        e0, e1 = np.searchsorted(self.edges, [bin_start, bin_stop + 1])
+
+        return RebinningOperator(
+            None if self.new_lambda is None else self.new_lambda[bin_start:bin_stop],
+            self.int_lambda[bin_start : bin_stop + 1],
+            self.type,
+            old_stop - old_start,
+            self.bins[j0:j1] - bin_start,
+            self.bin_indptr[j0 : j1 + 1] - self.bin_indptr[j0],
+            self.bin_indices[self.bin_indptr[j0] : self.bin_indptr[j1]] - old_start,
+            self.bin_weights[self.bin_indptr[j0] : self.bin_indptr[j1]],
+            self.edges[e0:e1] - bin_start,
+            self.edge_indptr[e0 : e1 + 1] - self.edge_indptr[e0],
+            self.edge_indices[self.edge_indptr[e0] : self.edge_indptr[e1]] - old_start,
+            self.edge_weights[self.edge_indptr[e0] : self.edge_indptr[e1]],
+        )
+
+    def save(self, file):
+        """
+        Saves the operator to an .npz file.
+        """
+        arrays = {
+            name: getattr(self, name)
+            for name in [
+                "int_lambda",
+                "bins",
+                "bin_indptr",
+                "bin_indices",
+                "bin_weights",
+                "edges",
+                "edge_indptr",
+                "edge_indices",
+                "edge_weights",
+            ]
+        }
+        if self.new_lambda is not None:
+            arrays["new_lambda"] = self.new_lambda
+
+        tmp_file = file + ".tmp.npz"
+        np.savez(tmp_file, type=self.type, num_old=self.num_old, **arrays)
+        os.replace(tmp_file, file)
+
+    @classmethod
+    def load(cls, file):
+        """
+        Loads an operator saved with save.
+        """
+        with np.load(file) as saved:
+            return cls(
+                saved["new_lambda"] if "new_lambda" in saved else None,
+                saved["int_lambda"],
+                str(saved["type"]),
+                int(saved["num_old"]),
+                saved["bins"],
+                saved["bin_indptr"],
+                saved["bin_indices"],
+                saved["bin_weights"],
+                saved["edges"],
+                saved["edge_indptr"],
+                saved["edge_indices"],
+                saved["edge_weights"],
+            )
+
+
+def _csr_apply(indptr, indices, weights, values):
+    """
+    Multiplies a compressed sparse row matrix (with no empty rows) by values, along their first axis.
+    """
+    if len(indptr) == 1:
+        return np.zeros((0,) + values.shape[1:])
+    col = (slice(None),) + (np.newaxis,) * (values.ndim - 1)
+    return np.add.reduceat(weights[col] * values[indices], indptr[:-1], axis=0)
+
+
+def _to_csr(rows, indices, weights, num_rows):
+    """
+    Sorts a list of matrix entries into compressed sparse row form, dropping entries of exactly zero
+    weight (they would turn the log of a zero flux into NaN rather than ignoring it). Entries in a row
+    keep the order they were given in. Returns the non-empty rows and their indptr, indices and weights.
+    """
+    keep = weights != 0
+    rows, indices, weights = rows[keep], indices[keep], weights[keep]
+    order = np.argsort(rows, kind="stable")
+    rows, indices, weights = rows[order], indices[order], weights[order]
+
+    counts = np.bincount(rows, minlength=num_rows)
+    nonempty = np.flatnonzero(counts)
+    indptr = np.concatenate([[0], np.cumsum(counts[nonempty])])
+    return nonempty, indptr, indices, weights
+
+
+def get_interfaces(new_lambda):
+    """
+    Returns the interfaces of the bins around a wavelength grid: the middle points between its
+    wavelengths, plus half a bin past either end (as in convert_spectrum).
+    """
+    new_lambda = np.asarray(new_lambda, dtype=np.float64)
+    return np.concatenate(
+        (
+            [new_lambda[0] - (new_lambda[1] - new_lambda[0]) / 2],
+            (new_lambda[1:] + new_lambda[:-1]) / 2,
+            [new_lambda[-1] + (new_lambda[-1] - new_lambda[-2]) / 2],
+        )
+    )
+
+
+def get_resolution_grid(bot_limit, top_limit, resolution):
+    """
+    Returns a wavelength grid of constant resolution: each wavelength is the previous one times
+    (R + 1) / R, starting at bot_limit and stopping before top_limit. This is the same sequence of
+    multiplications as the loop in rebin_spectrum_to_resolution, so the grid is identical.
+    """
+    ratio = (resolution + 1) / resolution
+    num = int(np.ceil(np.log(top_limit / bot_limit) / np.log(ratio))) + 2
+    grid = np.cumprod(np.concatenate([[bot_limit], np.full(num, ratio)]))
+    return grid[grid < top_limit]
+
+
+def build_rebinning_operator(old_lambda, int_lambda, type="log", new_lambda=None):
+    """
+    Builds the operator that rebins spectra from one wavelength grid onto bins with given interfaces.
+
+    Inputs
+    -------
+        :old_lambda: (np.array) wavelength grid of the spectra to be rebinned. must be ascending!
+        :int_lambda: (np.array) wavelengths of the interfaces of the new bins. must be ascending!
+        :type: (str) 'linear' to interpolate and integrate the flux, or 'log' the log of the flux.
+        :new_lambda: (np.array or None) wavelength grid of the new bins, kept for reference.
+
+    Outputs
+    -------
+        :operator: (RebinningOperator) the operator.
+    """
+    if type not in ["linear", "log"]:
+        raise ValueError("Error: type must be 'linear' or 'log'.")
+
+    x = np.asarray(old_lambda, dtype=np.float64)
+    int_lambda = np.asarray(int_lambda, dtype=np.float64)
+    num_old = len(x)
+    num_bins = len(int_lambda) - 1
+
+    # each interface is interpolated between the old points around it. p_start is the first old point
+    # at or above each interface
+    p_start = np.searchsorted(x, int_lambda, side="left")
+    p_top = np.clip(p_start, 1, num_old - 1)
+    p_bot = p_top - 1
+    w = (int_lambda - x[p_bot]) / (x[p_top] - x[p_bot])
+    w = np.where(int_lambda == x[p_top], 1.0, np.where(int_lambda == x[p_bot], 0.0, w))
+
+    edge_valid = (int_lambda >= x[0]) & (int_lambda <= x[-1])
+    edge_rows = np.flatnonzero(edge_valid)
+    edges, edge_indptr, edge_indices, edge_weights = _to_csr(
+        np.concatenate([edge_rows, edge_rows]),
+        np.concatenate([p_bot[edge_rows], p_top[edge_rows]]),
+        np.concatenate([1 - w[edge_rows], w[edge_rows]]),
+        num_bins + 1,
+    )
+
+    # each bin is the trapezoid integral from its bottom interface up to the first old point in the bin,
+    # through every old point in the bin, and on up to its top interface, divided by the bin's width.
+    # With no old points in the bin, it's the mean of the interface values.
+    bins = np.flatnonzero(edge_valid[:-1] & edge_valid[1:])
+    bottom, top = int_lambda[bins], int_lambda[bins + 1]
+    first, stop = p_start[bins], p_start[bins + 1]
+    width = top - bottom
+    has_points = stop > first
+
+    last = np.maximum(stop - 1, 0)
+    bottom_weight = np.where(has_points, (x[np.minimum(first, num_old - 1)] - bottom) / 2 / width, 0.5)
+    top_weight = np.where(has_points, (top - x[last]) / 2 / width, 0.5)
+
+    # every old point in a bin is weighted by half the width between its neighbours (or the interfaces)
+    counts = stop - first
+    inner_rows = np.repeat(bins, counts)
+    inner_width = np.repeat(width, counts)
+    offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    inner = np.repeat(first, counts) + offsets
+    left = np.where(offsets == 0, np.repeat(bottom, counts), x[np.maximum(inner - 1, 0)])
+    right = np.where(
+        offsets == np.repeat(counts, counts) - 1,
+        np.repeat(top, counts),
+        x[np.minimum(inner + 1, num_old - 1)],
+    )
+
+    bins, bin_indptr, bin_indices, bin_weights = _to_csr(
+        np.concatenate([bins, bins, inner_rows, bins, bins]),
+        np.concatenate([p_bot[bins], p_top[bins], inner, p_bot[bins + 1], p_top[bins + 1]]),
+        np.concatenate(
+            [
+                bottom_weight * (1 - w[bins]),
+                bottom_weight * w[bins],
+                (right - left) / 2 / inner_width,
+                top_weight * (1 - w[bins + 1]),
+                top_weight * w[bins + 1],
+            ]
+        ),
+        num_bins,
+    )
+
+    return RebinningOperator(
+        None if new_lambda is None else np.asarray(new_lambda, dtype=np.float64),
+        int_lambda,
+        type,
+        num_old,
+        bins,
+        bin_indptr,
+        bin_indices,
+        bin_weights,
+        edges,
+        edge_indptr,
+        edge_indices,
+        edge_weights,
+    )
+
+
+def operator_key(old_lambda, int_lambda, type):
+    """
+    Returns the hash that an operator is cached under: an MD5 checksum of the old grid, the new bin
+    interfaces and the mode.
+    """
+    key = hashlib.md5()
+    key.update(np.ascontiguousarray(old_lambda, dtype=np.float64).tobytes())
+    key.update(np.ascontiguousarray(int_lambda, dtype=np.float64).tobytes())
+    key.update(type.encode())
+    return key.hexdigest()
+
+
+def get_rebinning_operator(
+    old_lambda, new_lambda=None, resolution=None, type="log", int_lambda=None, cache_dir=None
+):
+    """
+    Returns the operator that rebins spectra from old_lambda onto a new grid, loading it from
+    cache_dir if it has been built before, and saving it there otherwise.
+
+    Inputs
+    -------
+        :old_lambda: (np.array) wavelength grid of the spectra to be rebinned. must be ascending!
+        :new_lambda: (np.array or None) the new wavelength grid.
+        :resolution: (float or None) resolution (R=lamda/delta_lamda) of the new grid, used if new_lambda
+                        isn't given. The grid spans old_lambda, as in rebin_spectrum_to_resolution.
+        :type: (str) 'linear' or 'log', as in convert_spectrum.
+        :int_lambda: (np.array or None) interfaces of the new bins. Default to the middle points between
+                        the new wavelengths.
+        :cache_dir: (str or None) directory to keep operators in. None to not cache.
+
+    Outputs
+    -------
+        :operator: (RebinningOperator) the operator.
+    """
+    old_lambda = np.asarray(old_lambda, dtype=np.float64)
+    if new_lambda is None and int_lambda is None:
+        if resolution is None:
+            raise ValueError("Cannot set new_lambda, resolution and int_lambda to None! One must be specified.")
+        new_lambda = get_resolution_grid(old_lambda[0], old_lambda[-1], resolution)
+    if int_lambda is None:
+        int_lambda = get_interfaces(new_lambda)
+
+    if cache_dir is None:
+        return build_rebinning_operator(old_lambda, int_lambda, type, new_lambda)
+
+    file = os.path.join(cache_dir, operator_key(old_lambda, int_lambda, type) + ".npz")
+    if os.path.exists(file):
+        return RebinningOperator.load(file)
+
+    operator = build_rebinning_operator(old_lambda, int_lambda, type, new_lambda)
+    os.makedirs(cache_dir, exist_ok=True)
+    operator.save(file)
+    return operator
+
+
+class StreamingRebinner:
+    """
+    Rebins opacities that arrive a window of wavelength blocks at a time. Each new bin is computed as
+    soon as every old wavelength it depends on has arrived, and old wavelengths are dropped as soon as no
+    bin still to come depends on them, so only a window (plus the overlap of one bin) is ever held.
+
+    Example:
+
+    >>> rebinner = StreamingRebinner(operator)
+    >>> for wavelengths, opacities in iter_opacity_blocks('opacCO.dat'):
+    ...     done = rebinner.push(opacities)  # None, or (bin_start, new_opacities)
+    """
+
+    def __init__(self, operator):
+        """
+        Inputs
+        -------
+            :operator: (RebinningOperator) operator from the wavelength grid of the blocks.
+        """
+        self.operator = operator
+        self.num_bins = len(operator.int_lambda) - 1
+        starts, stops = operator.old_ranges()
+
+        # a bin can be computed once the last old point of every bin up to it has arrived, and the
+        # old points before the first one needed by any later bin can be dropped
+        self.ready = np.maximum.accumulate(stops)
+        self.keep = np.minimum.accumulate(starts[::-1])[::-1]
+
+        self.buffer = None
+        self.buffer_start = 0
+        self.buffer_stop = 0
+        self.next_bin = 0
+
+    @property
+    def done(self):
+        return self.next_bin >= self.num_bins
+
+    def push(self, opacities):
+        """
+        Adds the next old wavelength blocks, shaped (wavelength, pressure, temperature).
+
+        Outputs
+        -------
+            :rebinned: (tuple or None) (bin_start, new_opacities) for the run of new bins that can now be
+                        computed, with new_opacities shaped (new wavelength, pressure, temperature).
+                        None if no new bin can be computed yet.
+        """
+        self.buffer = opacities if self.buffer is None else np.concatenate([self.buffer, opacities])
+        self.buffer_stop += len(opacities)
+
+        bin_stop = np.searchsorted(self.ready, self.buffer_stop, side="right")
+        if self.buffer_stop == self.operator.num_old:
+            bin_stop = self.num_bins
+
+        rebinned = None
+        if bin_stop > self.next_bin:
+            window = self.operator.window(self.next_bin, bin_stop, self.buffer_start, self.buffer_stop)
+            new_opacities = window.apply(self.buffer.reshape(len(self.buffer), -1))
+            rebinned = (
+                self.next_bin,
+                new_opacities.reshape((bin_stop - self.next_bin,) + self.buffer.shape[1:]),
+            )
+            self.next_bin = bin_stop
+
+        if self.done:
+            drop = len(self.buffer)
+        else:
+            drop = min(self.keep[self.next_bin], self.buffer_stop) - self.buffer_start
+        if drop > 0:
+            self.buffer = self.buffer[drop:]
+            self.buffer_start += drop
+
+        return rebinned
+
+
+def _fill_first_bin(new_opacities):
+    """
+    The first bin of a constant-resolution grid starts half a bin below the old grid, so it can't be
+    converted and comes out as zero. Wherever it does, this gives it the values of the next bin instead
+    (in place, if there is a next bin).
+    """
+    if len(new_opacities) > 1:
+        first_is_zero = new_opacities[0] == 0.0
+        new_opacities[0][first_is_zero] = new_opacities[1][first_is_zero]
+    return new_opacities
+
+
+class _FirstBinFiller:
+    """
+    Fills in the first bin (see _fill_first_bin) of new bins that arrive a run at a time, holding the
+    first bin back until the second one is known.
+    """
+
+    def __init__(self, num_bins):
+        self.fill = num_bins > 1
+        self.held = None
+
+    def push(self, bin_start, new_opacities):
+        """
+        Takes a run of new bins and returns it with the first bin filled in (None while it's held back).
+        """
+        if self.held is not None:
+            new_opacities = _fill_first_bin(np.concatenate([self.held[np.newaxis], new_opacities]))
+            bin_start -= 1
+            self.held = None
+        elif bin_start == 0 and self.fill:
+            if len(new_opacities) == 1:
+                self.held = new_opacities[0]
+                return None
+            _fill_first_bin(new_opacities)
+        return bin_start, new_opacities
+
+
+def stream_rebinned_blocks(file, operator, blocks_per_window=4096, progress=False):
+    """
+    Rebins an opacity file (or binary store) while streaming through it, a window of wavelength blocks at a
+    time (see StreamingRebinner), so memory is set by the window rather than by the size of the file.
+
+    Inputs
+    -------
+        :file: (str) path to opacity file or binary store. e.g., 'opacCO.dat'
+        :operator: (RebinningOperator) operator from the wavelength grid of the file.
+        :blocks_per_window: (int) number of old wavelengths to read at once. Sets the memory footprint.
+        :progress: (bool) whether or not to include a progress bar (if tqdm is installed).
+
+    Outputs
+    -------
+        Yields (bin_start, new_opacities) for consecutive runs of new bins, with new_opacities shaped
+        (new wavelength, pressure, temperature).
+    """
+    rebinner = StreamingRebinner(operator)
+    for wavelengths, opacities in iter_opacity_blocks(file, blocks_per_window, progress=progress):
+        rebinned = rebinner.push(opacities)
+        if rebinned is not None:
+            yield rebinned
+
+    if not rebinner.done:
+        raise ValueError(f"{file} has fewer wavelengths than the rebinning operator expects.")
+
+
+def rebin_opacity_file(
+    file, new_file, resolution, type="log", cache_dir=None, blocks_per_window=4096, progress=True
+):
+    """
+    Rebins an opacity file (or binary store) to a new resolution and writes it out in the RT format,
+    streaming through both files so that memory is set by blocks_per_window rather than the file size.
+
+    The first bin of a constant-resolution grid starts half a bin below the old grid, so it can't be
+    converted and comes out as zero. Wherever it does, it takes the values of the next bin instead.
+
+    Inputs
+    -------
+        :file: (str) path to opacity file or binary store. e.g., 'opacCO.dat'
+        :new_file: (str) path to write the rebinned file to, gzip-compressed if it ends in .gz.
+                    e.g., '125k-opacCO.dat'
+        :resolution: (float) resolution (R=lamda/delta_lamda) of the new grid.
+        :type: (str) 'linear' or 'log', as in convert_spectrum.
+        :cache_dir: (str or None) directory to keep rebinning operators in.
+        :blocks_per_window: (int) number of old wavelengths to read at once.
+        :progress: (bool) whether or not to include a progress bar (if tqdm is installed).
+
+    Outputs
+    -------
+        None
+
+    Side effects
+    -------------
+        Writes new_file, with the header of file.
+    """
+    temperatures, pressures = read_header(file)
+    operator = get_rebinning_operator(
+        read_wavelengths(file, progress=progress), resolution=resolution, type=type, cache_dir=cache_dir
+    )
+    new_lambda = operator.new_lambda
+    filler = _FirstBinFiller(len(new_lambda))
+
+    with RTWriter(new_file, read_header_text(file)) as writer:
+        for rebinned in stream_rebinned_blocks(file, operator, blocks_per_window, progress=progress):
+            filled = filler.push(*rebinned)
+            if filled is None:
+                continue
+            bin_start, new_opacities = filled
+            writer.write_blocks(
+                new_lambda[bin_start : bin_start + len(new_opacities)], pressures, new_opacities
+            )
+
+
+######################## Multi-resolution pyramids ########################
+
+
+def pyramid_path(base):
+    """
+    Returns the path of the manifest of a pyramid. e.g., 'opacCO' -> 'opacCO_pyramid.json'
+    """
+    return base + "_pyramid.json"
+
+
+def level_path(base, resolution, store=False):
+    """
+    Returns the path of one level of a pyramid. e.g., ('opacCO', 125000) -> 'opacCO_R125000.dat'
+    """
+    name = f"{base}_R{int(resolution)}" if resolution == int(resolution) else f"{base}_R{resolution}"
+    return name + (".store" if store else ".dat")
+
+
+def build_opacity_pyramid(
+    file,
+    resolutions,
+    base=None,
+    type="log",
+    store=False,
+    derive=False,
+    min_ratio=4,
+    cache_dir=None,
+    blocks_per_window=4096,
+    progress=True,
+):
+    """
+    Rebins an opacity file (or binary store) to several resolutions at once, reading it only once.
+
+    Every window of wavelength blocks read from file is handed to each level in turn, from the finest to
+    the coarsest. Every level has the constant-resolution grid that rebin_opacity_file would give it,
+    and by default is rebinned from file, so it is identical to rebin_opacity_file's output.
+
+    With derive, a level with at most 1/min_ratio the resolution of a finer one is rebinned from that
+    finer level instead, which is much cheaper but only approximate: the finer level's bin averages
+    are interpolated as if they were point values. Rebinning 200k-resolution opacities to 10k through
+    a 50k level, relative differences from rebin_opacity_file were ~1e-4 (log) and ~1e-3 (linear) for
+    opacities varying over ~2000 old wavelengths, but ~1e-2 (log) and up to ~1e-1 (linear) over ~200.
+    In log mode a bin that isn't converted (a zero at one of its interfaces) comes out as zero, so
+    zeros in a finer level spread to the bins around them in the levels derived from it.
+
+    Inputs
+    -------
+        :file: (str) path to opacity file or binary store. e.g., 'opacCO.dat'
+        :resolutions: (list) resolutions (R=lamda/delta_lamda) of the levels. e.g., [250000, 125000, 25000]
+        :base: (str or None) base path of the levels and manifest. Defaults to file without its
+                    extension, e.g. 'opacCO' gives 'opacCO_R125000.dat' and 'opacCO_pyramid.json'.
+        :type: (str) 'linear' or 'log', as in convert_spectrum.
+        :store: (bool) write each level as a binary store rather than an RT-format opacity file.
+        :derive: (bool) whether or not coarse levels may be rebinned from finer ones (approximate;
+                    see above).
+        :min_ratio: (float) how much finer a level must be for coarser ones to be rebinned from it.
+        :cache_dir: (str or None) directory to keep rebinning operators in.
+        :blocks_per_window: (int) number of old wavelengths to read at once.
+        :progress: (bool) whether or not to include a progress bar (if tqdm is installed).
+
+    Outputs
+    -------
+        :manifest_file: (str) path to the manifest. e.g., 'opacCO_pyramid.json'
+
+    Side effects
+    -------------
+        Writes one file (or store) per level and the manifest, a JSON file listing each level's
+        resolution, file, number of wavelengths, first and last wavelength, the level it was rebinned
+        from (None for file itself) and, for text levels, its checksum.
+    """
+    if base is None:
+        base = os.path.splitext(file.rstrip("/"))[0]
+
+    temperatures, pressures = read_header(file)
+    header = read_header_text(file)
+    wavelengths = read_wavelengths(file, progress=progress)
+
+    levels = []
+    for resolution in sorted(set(resolutions), reverse=True):
+        new_lambda = get_resolution_grid(wavelengths[0], wavelengths[-1], resolution)
+        parent = None
+        if derive:
+            # the finest level that is coarse enough to rebin from. levels are sorted finest first
+            parents = [level for level in levels if level["resolution"] >= min_ratio * resolution]
+            parent = parents[-1] if parents else None
+
+        old_lambda = wavelengths if parent is None else parent["operator"].new_lambda
+        operator = get_rebinning_operator(old_lambda, new_lambda, type=type, cache_dir=cache_dir)
+        levels.append(
+            {
+                "resolution": resolution,
+                "parent": parent,
+                "children": [],
+                "operator": operator,
+                "rebinner": StreamingRebinner(operator),
+                "filler": _FirstBinFiller(len(new_lambda)),
+                "path": level_path(base, resolution, store),
+            }
+        )
+        if parent is not None:
+            parent["children"].append(levels[-1])
+
+    def push(level, opacities):
+        # rebins the next blocks of the level above (or file), and passes the new bins on down
+        rebinned = level["rebinner"].push(opacities)
+        filled = None if rebinned is None else level["filler"].push(*rebinned)
+        if filled is None:
+            return
+        bin_start, new_opacities = filled
+        stop = bin_start + len(new_opacities)
+
+        if store:
+            level["output"][bin_start:stop] = new_opacities
+        else:
+            for text in format_block_text(
+                level["operator"].new_lambda[bin_start:stop], pressures, new_opacities
+            ):
+                level["output"].write(text)
+                level["hash"].update(text.encode())
+
+        for child in level["children"]:
+            push(child, new_opacities)
+
+    for level in levels:
+        new_lambda = level["operator"].new_lambda
+        if store:
+            level["output"] = create_store(
+                level["path"] + ".tmp", new_lambda, pressures, temperatures, header, DEFAULT_TEXT_FORMAT
+            )
+        else:
+            level["output"] = RTWriter(level["path"], header)
+            level["hash"] = hashlib.md5(header.encode())
+
+    for block_wavelengths, opacities in iter_opacity_blocks(file, blocks_per_window, progress=progress):
+        for level in levels:
+            if level["parent"] is None:
+                push(level, opacities)
+
+    manifest_levels = []
+    for level in levels:
+        if not level["rebinner"].done:
+            raise ValueError(f"{file} has fewer wavelengths than its index says.")
+
+        if store:
+            level["output"].flush()
+            del level["output"]
+            if os.path.isdir(level["path"]):
+                shutil.rmtree(level["path"])
+            os.replace(level["path"] + ".tmp", level["path"])
+        else:
+            level["output"].close()
+
+        new_lambda = level["operator"].new_lambda
+        manifest_levels.append(
+            {
+                "resolution": level["resolution"],
+                "file": os.path.basename(level["path"]),
+                "num_wavelengths": len(new_lambda),
+                "first_wavelength": float(new_lambda[0]),
+                "last_wavelength": float(new_lambda[-1]),
+                "rebinned_from": None if level["parent"] is None else level["parent"]["resolution"],
+                "checksum": None if store else level["hash"].hexdigest(),
+            }
+        )
+
+    manifest = {
+        "source": os.path.basename(file.rstrip("/")),
+        "type": type,
+        "num_levels": len(manifest_levels),
+        "resolutions": [level["resolution"] for level in manifest_levels],
+        "levels": manifest_levels,
+    }
+
+    manifest_file = pyramid_path(base)
+    with open(manifest_file + ".tmp", "w") as f:
+        json.dump(manifest, f, indent=1)
+    os.replace(manifest_file + ".tmp", manifest_file)
+    return manifest_file
+
+
+def load_pyramid_manifest(file):
+    """
+    Loads the manifest of a pyramid.
+
+    Inputs
+    -------
+        :file: (str) path to the manifest, or the base path of the pyramid. e.g., 'opacCO_pyramid.json'
+                    or 'opacCO'
+
+    Outputs
+    -------
+        :manifest: (dict) the manifest, as written by build_opacity_pyramid.
+    """
+    if not file.endswith(".json"):
+        file = pyramid_path(file)
+    with open(file) as f:
+        return json.load(f)
+
+
+######################## Parallel rebinning ########################
+
+
+def _share_array(shape):
+    """
+    Creates a float64 array in shared memory, that worker processes can attach to by name.
+    Returns the shared memory block (which must be kept, then closed and unlinked) and the array.
+    """
+    size = max(int(np.prod(shape)) * 8, 1)
+    block = shared_memory.SharedMemory(create=True, size=size)
+    return block, np.ndarray(shape, dtype=np.float64, buffer=block.buf)
+
+
+def _attach_array(spec):
+    """
+    Opens an array described by spec without copying it: ('memmap', path, mode) for an .npy file, or
+    ('shared', name, shape) for a block of shared memory. Returns the array and whatever must be kept
+    alive alongside it.
+    """
+    if spec[0] == "memmap":
+        return np.load(spec[1], mmap_mode=spec[2]), None
+    block = shared_memory.SharedMemory(name=spec[1])
+    return np.ndarray(spec[2], dtype=np.float64, buffer=block.buf), block
+
+
+def rebin_opacity_parallel(
+    file,
+    new_file,
+    resolution,
+    type="log",
+    cache_dir=None,
+    processes=None,
+    columns_per_task=None,
+    progress=True,
+):
+    """
+    Rebins an opacity file (or binary store) to a new resolution on several cores, splitting its
+    (pressure, temperature) columns between worker processes. Every column is rebinned on its own, so
+    the output is identical to that of rebin_opacity_file.
+
+    No worker gets a copy of the opacities: a binary store is memory-mapped by each of them, and a text
+    file (or quantized store) is read once into shared memory that they all attach to. The new opacities
+    are written straight into a shared array as well, so nothing but column ranges is sent between processes.
+
+    Inputs
+    -------
+        :file: (str) path to opacity file or binary store. e.g., 'opacCO.dat'
+        :new_file: (str) path to write the rebinned file to: a binary store if it ends in .store, an RT-format
+                    opacity file otherwise (gzip-compressed if it ends in .gz). e.g., '125k-opacCO.dat'
+        :resolution: (float) resolution (R=lamda/delta_lamda) of the new grid.
+        :type: (str) 'linear' or 'log', as in convert_spectrum.
+        :cache_dir: (str or None) directory to keep rebinning operators in.
+        :processes: (int or None) number of worker processes. Defaults to the number of cores.
+        :columns_per_task: (int or None) number of (pressure, temperature) columns rebinned per task.
+                    Defaults to a quarter of an even share per process.
+        :progress: (bool) whether or not to include a progress bar (if tqdm is installed).
+
+    Outputs
+    -------
+        None
+
+    Side effects
+    -------------
+        Writes new_file, with the header of file.
+    """
+    temperatures, pressures = read_header(file)
+    header = read_header_text(file)
+    wavelengths = read_wavelengths(file, progress=progress)
+    operator = get_rebinning_operator(wavelengths, resolution=resolution, type=type, cache_dir=cache_dir)
+    new_lambda = operator.new_lambda
+    shape = (len(wavelengths), len(pressures), len(temperatures))
+    new_shape = (len(new_lambda),) + shape[1:]
+
+    blocks = []
+    try:
+        if is_store(file) and not is_quantized(file):
+            input_spec = ("memmap", os.path.join(file, "opacities.npy"), "r")
+        else:
+            block, opacities = _share_array(shape)
+            blocks.append(block)
+            start = 0
+            for batch_wavelengths, batch_opacities in iter_opacity_blocks(file, progress=progress):
+                opacities[start : start + len(batch_opacities)] = batch_opacities
+                start += len(batch_opacities)
+            del opacities
+            input_spec = ("shared", block.name, shape)
+
+        to_store = new_file.rstrip("/").endswith(".store")
+        if to_store:
+            tmp_store = new_file.rstrip("/") + ".tmp"
+            new_opacities = create_store(
+                tmp_store, new_lambda, pressures, temperatures, header, DEFAULT_TEXT_FORMAT
+            )
+            del new_opacities
+            output_spec = ("memmap", os.path.join(tmp_store, "opacities.npy"), "r+")
+        else:
+            block, new_opacities = _share_array(new_shape)
+            blocks.append(block)
+            output_spec = ("shared", block.name, new_shape)
+
+        num_columns = shape[1] * shape[2]
+        if processes is None:
+            processes = os.cpu_count()
+        if columns_per_task is None:
+            columns_per_task = max(1, num_columns // (4 * processes))
+        tasks = [
+            (start, min(start + columns_per_task, num_columns))
+            for start in range(0, num_columns, columns_per_task)
+        ]
+        processes = max(1, min(processes, len(tasks)))
+
+        with Pool(
+            processes, initializer=_init_rebin_worker, initargs=(operator, input_spec, output_spec)
+        ) as pool:
+            results = pool.imap_unordered(_rebin_columns, tasks)
+            if progress:
+                results = tqdm(results, total=len(tasks), desc="Rebinning columns")
+            for result in results:
+                pass
+
+        if to_store:
+            if os.path.isdir(new_file):
+                shutil.rmtree(new_file)
+            os.replace(tmp_store, new_file)
+        else:
+            write_opacity_file(new_file, new_lambda, pressures, temperatures, new_opacities, header)
+            del new_opacities
+    finally:
+        for block in blocks:
+            block.close()
+            block.unlink()
+
+
+def _init_rebin_worker(operator, input_spec, output_spec):
+    """
+    Hands the operator to a worker process once, and attaches it to the input and output opacities.
+    """
+    global _REBIN_OPERATOR, _REBIN_INPUT, _REBIN_OUTPUT, _REBIN_BLOCKS
+    _REBIN_OPERATOR = operator
+    _REBIN_INPUT, input_block = _attach_array(input_spec)
+    _REBIN_OUTPUT, output_block = _attach_array(output_spec)
+    _REBIN_BLOCKS = (input_block, output_block)
+
+
+def _rebin_columns(task):
+    """
+    Rebins the (pressure, temperature) columns start:stop, and fills in their first bin as
+    rebin_opacity_file does.
+    """
+    start, stop = task
+    opacities = _REBIN_INPUT.reshape(len(_REBIN_INPUT), -1)
+    new_opacities = _fill_first_bin(_REBIN_OPERATOR.apply(opacities[:, start:stop]))
+
+    output = _REBIN_OUTPUT.reshape(len(_REBIN_OUTPUT), -1)
+    output[:, start:stop] = new_opacities
+    if isinstance(_REBIN_OUTPUT, np.memmap):
+        _REBIN_OUTPUT.flush()
+    return task
@@ -0,0 +1,77 @@
+import os
+import sys
+
+import numpy as np
+import pytest
+
+# the modules live at the top of the repository rather than in a package
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def write_opacity_text(file, num_wavelengths=120, num_pressures=4, num_temperatures=6, seed=0, R=2e5):
+    """
+    Writes a small RT-format opacity file of random opacities spanning 15 decades, with a
+    few exact zeros, laid out like the real ones (e.g. opacFe.dat).
+
+    Outputs
+    -------
+        :wavelengths, pressures, temperatures, opacities: (np.array) what was written, with
+                    opacities shaped (wavelength, pressure, temperature).
+    """
+    rng = np.random.default_rng(seed)
+    temperatures = np.arange(500.0, 500.0 + 100 * num_temperatures, 100.0)
+    pressures = np.logspace(-1, 8, num_pressures)
+    wavelengths = 0.3e-4 * ((R + 1) / R) ** np.arange(num_wavelengths)
+    opacities = 10 ** rng.uniform(-35, -20, size=(num_wavelengths, num_pressures, num_temperatures))
+    opacities[rng.random(opacities.shape) < 0.02] = 0.0
+
+    # round to what the file holds, so the arrays compare exactly with what is read back
+    opacities = np.array([[float("%.6E" % value) for value in row] for row in opacities.reshape(-1, num_temperatures)])
+    opacities = opacities.reshape(num_wavelengths, num_pressures, num_temperatures)
+    wavelengths = np.array([float("%.9E" % value) for value in wavelengths])
+    pressures = np.array([float("%.6E" % value) for value in pressures])
+
+    with open(file, "w") as f:
+        f.write(" ".join("%.3f" % t for t in temperatures) + " \n")
+        f.write(" ".join("%.6E" % p for p in pressures) + "\n")
+        for w in range(num_wavelengths):
+            f.write("%.9E\n" % wavelengths[w])
+            for p in range(num_pressures):
+                f.write("%.6E " % pressures[p] + " ".join("%.6E" % v for v in opacities[w, p]) + " \n")
+    return wavelengths, pressures, temperatures, opacities
+
+
+def write_CIA_text(file, num_wavelengths=40, num_temperatures=5, num_pairs=8, seed=1):
+    """
+    Writes a small low-resolution CIA file laid out like opacCIA.dat: a header line, then a
+    temperature line followed by one line per wavelength for each temperature.
+
+    Outputs
+    -------
+        :temperatures, wavelengths, cia: (np.array) what was written, with cia shaped
+                    (temperature, wavelength, pair).
+    """
+    rng = np.random.default_rng(seed)
+    temperatures = np.arange(500.0, 500.0 + 100 * num_temperatures, 100.0)
+    wavelengths = np.linspace(0.29e-4, 0.31e-4, num_wavelengths)
+    cia = 10 ** rng.uniform(-50, -40, size=(num_temperatures, num_wavelengths, num_pairs))
+    cia = np.array([float("%.6e" % value) for value in cia.ravel()]).reshape(cia.shape)
+    wavelengths = np.array([float("%.6e" % value) for value in wavelengths])
+
+    with open(file, "w") as f:
+        f.write(" ".join("%.3f" % t for t in temperatures) + " \n")
+        for i, temperature in enumerate(temperatures):
+            f.write("%.3f\n" % temperature)
+            for j in range(num_wavelengths):
+                f.write("   ".join("%.6e" % v for v in [wavelengths[j]] + list(cia[i, j])) + "   \n")
+    return temperatures, wavelengths, cia
+
+
+@pytest.fixture
+def opacity_file(tmp_path):
+    """
+    Path to a small RT-format opacity file, opacFe.dat, in a fresh directory.
+    """
+    file = str(tmp_path / "opacFe.dat")
+    write_opacity_text(file)
+    return file
@@ -0,0 +1,330 @@
+import gzip
+import os
+
+import numpy as np
+import pytest
+
+from chunking_utils import (
+    ChunkViews,
+    add_overlap,
+    chunk_species,
+    chunk_wavelengths,
+    load_chunk_plan,
+    plan_chunk_views,
+    plan_chunks,
+    rescale_opacity_file,
+    save_chunk_plan,
+    stitch_chunks,
+)
+from conftest import write_CIA_text, write_opacity_text
+from interpolate_CIA import chunk_wavelengths_CIA, get_CIA_wavelengths, interpolate_CIA
+from opacity_io import (
+    ChunkWriter,
+    file_checksum,
+    load_chunk_manifest,
+    load_opacities,
+    manifest_path,
+    read_opacity_file,
+    text_to_store,
+)
+
+
+def read_bytes(file):
+    with open(file, "rb") as f:
+        return f.read()
+
+
+def base_path(file):
+    return os.path.splitext(file)[0]
+
+
+def chunk_files(base):
+    """
+    The chunk files of a chunked file, as listed by its manifest.
+    """
+    chunks = load_chunk_manifest(base)["chunks"]
+    return [os.path.join(os.path.dirname(base), chunk["file"]) for chunk in chunks]
+
+
+def test_chunks_hold_the_whole_file(opacity_file):
+    chunk_wavelengths(opacity_file, wav_per_chunk=50, progress=False)
+
+    wavelengths, pressures, temperatures, opacities = read_opacity_file(opacity_file)
+    chunks = [read_opacity_file(file) for file in chunk_files(base_path(opacity_file))]
+    assert [len(chunk[0]) for chunk in chunks] == [49, 50, 21]
+    for chunk in chunks:
+        np.testing.assert_array_equal(chunk[1], pressures)
+        np.testing.assert_array_equal(chunk[2], temperatures)
+    np.testing.assert_array_equal(np.concatenate([chunk[0] for chunk in chunks]), wavelengths)
+    np.testing.assert_array_equal(np.concatenate([chunk[3] for chunk in chunks]), opacities)
+    assert not [name for name in os.listdir(os.path.dirname(opacity_file)) if name.endswith(".tmp")]
+
+
+def test_store_chunks_match_text_chunks(opacity_file, tmp_path):
+    chunk_wavelengths(opacity_file, nchunks=3, progress=False)
+    store = text_to_store(opacity_file, store=str(tmp_path / "store" / "opacFe.store"), progress=False)
+    chunk_wavelengths(store, nchunks=3, progress=False)
+
+    text_chunks = chunk_files(base_path(opacity_file))
+    store_chunks = chunk_files(base_path(store))
+    assert len(text_chunks) == len(store_chunks) > 1
+    for text_chunk, store_chunk in zip(text_chunks, store_chunks):
+        assert read_bytes(text_chunk) == read_bytes(store_chunk)
+
+
+def test_chunk_writer_abort_leaves_nothing(tmp_path):
+    file = str(tmp_path / "opacFe.dat")
+    with pytest.raises(RuntimeError):
+        with ChunkWriter(file, "header\n") as writer:
+            writer.write(0, "line\n")
+            writer.write(1, ["line\n", "line\n"])
+            raise RuntimeError
+    assert os.listdir(tmp_path) == []
+
+
+def test_overlap_matches_add_overlap(opacity_file):
+    v_max = 11463.5
+    chunk_wavelengths(opacity_file, nchunks=3, v_max=v_max, progress=False)
+    base = base_path(opacity_file)
+    with_overlap = [read_bytes(file) for file in chunk_files(base)]
+
+    chunk_wavelengths(opacity_file, nchunks=3, progress=False)
+    add_overlap(base, v_max=v_max)
+
+    assert [read_bytes(file) for file in chunk_files(base)] == with_overlap
+    assert load_chunk_manifest(base)["chunks"][0]["overlap_next"] > 0
+
+
+def test_overlap_previous(opacity_file):
+    chunk_wavelengths(opacity_file, nchunks=3, v_max=11463.5, overlap_previous=True, progress=False)
+    wavelengths = read_opacity_file(opacity_file)[0]
+
+    base = base_path(opacity_file)
+    for chunk, file in zip(load_chunk_manifest(base)["chunks"], chunk_files(base)):
+        start = chunk["start"] - chunk["overlap_previous"]
+        stop = chunk["stop"] + chunk["overlap_next"]
+        np.testing.assert_array_equal(read_opacity_file(file)[0], wavelengths[start:stop])
+        assert chunk["overlap_previous"] > 0 or chunk["index"] == 0
+
+
+def test_chunk_CIA(tmp_path):
+    file = str(tmp_path / "opacCIA_highres.dat")
+    temperatures, wavelengths, cia = write_CIA_text(file)
+    chunk_wavelengths_CIA(file, chunk_edges=[0, 15, 40], progress=False)
+
+    for chunk, (start, stop) in zip(chunk_files(base_path(file)), [(0, 15), (15, 40)]):
+        with open(chunk) as f:
+            lines = f.readlines()
+        assert lines[0] == read_bytes(file).decode().splitlines(keepends=True)[0]
+        assert len(lines) == 1 + len(temperatures) * (1 + stop - start)
+        for i, temperature in enumerate(temperatures):
+            block = lines[1 + i * (1 + stop - start) : 1 + (i + 1) * (1 + stop - start)]
+            assert float(block[0]) == temperature
+            values = np.array([line.split() for line in block[1:]], dtype=float)
+            np.testing.assert_array_equal(values[:, 0], wavelengths[start:stop])
+            np.testing.assert_array_equal(values[:, 1:], cia[i, start:stop])
+
+
+@pytest.mark.parametrize(
+    "edit, message",
+    [
+        (lambda lines: lines[:-3], "has 37 wavelengths"),
+        (lambda lines: lines[:1] + lines[2:], "before its first temperature"),
+        (lambda lines: lines[1:], "no header line"),
+    ],
+)
+def test_chunk_CIA_checks_layout(tmp_path, edit, message):
+    file = str(tmp_path / "opacCIA_highres.dat")
+    write_CIA_text(file)
+    with open(file) as f:
+        lines = f.readlines()
+    with open(file, "w") as f:
+        f.writelines(edit(lines))
+
+    with pytest.raises(ValueError, match=message):
+        chunk_wavelengths_CIA(file, chunk_edges=[0, 20, 40], progress=False)
+
+
+def test_rescale_opacity_file(opacity_file, tmp_path):
+    new_file = str(tmp_path / "rescaled.dat")
+    rescale_opacity_file(opacity_file, 1e-4, new_file)
+
+    wavelengths, pressures, temperatures, opacities = read_opacity_file(opacity_file)
+    rescaled = read_opacity_file(new_file)
+    np.testing.assert_array_equal(rescaled[0], wavelengths)
+    np.testing.assert_array_equal(rescaled[1], pressures)
+    np.testing.assert_allclose(rescaled[3], opacities * 1e-4, rtol=5e-7)
+
+    # the same layout and number formats as the original
+    with open(opacity_file) as f, open(new_file) as g:
+        for original, line in zip(f, g):
+            assert len(line) == len(original) and line.split()[:1] == original.split()[:1]
+
+
+def test_rescale_store_in_place(opacity_file):
+    store = text_to_store(opacity_file, progress=False)
+    rescale_opacity_file(store, 1e-4)
+    np.testing.assert_allclose(load_opacities(store)[3], read_opacity_file(opacity_file)[3] * 1e-4, rtol=1e-15)
+
+    with pytest.raises(ValueError, match="in place"):
+        rescale_opacity_file(opacity_file, 1e-4)
+
+
+def test_rescale_to_gzip(opacity_file, tmp_path):
+    rescale_opacity_file(opacity_file, 1e-4, str(tmp_path / "rescaled.dat"))
+    rescale_opacity_file(opacity_file, 1e-4, str(tmp_path / "rescaled.dat.gz"))
+    with gzip.open(str(tmp_path / "rescaled.dat.gz"), "rb") as f:
+        assert f.read() == read_bytes(str(tmp_path / "rescaled.dat"))
+
+
+def test_chunk_species_with_CIA(tmp_path):
+    files = [str(tmp_path / "opacFe.dat"), str(tmp_path / "opacH2O.dat")]
+    for seed, file in enumerate(files):
+        write_opacity_text(file, seed=seed)
+    CIA_file = str(tmp_path / "opacCIA.dat")
+    write_CIA_text(CIA_file)
+    interpolate_CIA(CIA_file, files[0], progress=False)
+    highres = str(tmp_path / "opacCIA_highres.dat")
+
+    chunk_species(files, nchunks=3, v_max=11463.5, processes=2, CIA_file=highres)
+
+    def ranges(file):
+        keys = ["start", "stop", "overlap_previous", "overlap_next"]
+        return [[chunk[key] for key in keys] for chunk in load_chunk_manifest(file)["chunks"]]
+
+    assert ranges(highres) == ranges(files[0])
+    assert ranges(files[0])[0][3] > 0
+
+    species_chunks = chunk_files(base_path(files[0]))
+    for species_chunk, CIA_chunk in zip(species_chunks, chunk_files(base_path(highres))):
+        np.testing.assert_array_equal(get_CIA_wavelengths(CIA_chunk), read_opacity_file(species_chunk)[0])
+
+    chunked = [read_bytes(file) for file in species_chunks]
+    chunk_wavelengths(files[0], nchunks=3, v_max=11463.5, progress=False)
+    assert [read_bytes(file) for file in species_chunks] == chunked
+
+
+def test_chunk_species_checks_grids(tmp_path):
+    files = [str(tmp_path / "opacFe.dat"), str(tmp_path / "opacH2O.dat")]
+    write_opacity_text(files[0])
+    write_opacity_text(files[1], R=1e5)
+    with pytest.raises(ValueError, match="opacH2O.dat not on the same wavelength grid"):
+        chunk_species(files, nchunks=3, processes=2)
+
+    CIA_file = str(tmp_path / "opacCIA.dat")
+    write_CIA_text(CIA_file)
+    with pytest.raises(ValueError, match="opacCIA.dat not on the same wavelength grid"):
+        chunk_species(files[:1], nchunks=3, processes=1, CIA_file=CIA_file)
+
+
+def test_plan_chunks_even_costs():
+    wavelengths = np.arange(300)
+    edges = plan_chunks(wavelengths, target_walltime=10, seconds_per_wavelength=0.1)
+    np.testing.assert_array_equal(edges, [0, 100, 200, 300])
+    np.testing.assert_array_equal(plan_chunks(wavelengths, nchunks=3), [0, 100, 200, 300])
+
+
+def test_plan_chunks_balances_timings():
+    wavelengths = np.arange(400)
+    old_edges = [0, 100, 200, 300, 400]
+    seconds = [10.0, 30.0, 10.0, 10.0]  # the second chunk is three times as slow
+    edges = plan_chunks(wavelengths, target_walltime=15, timings=(old_edges, seconds))
+
+    costs = np.repeat(np.array(seconds) / 100, 100)
+    chunk_costs = [costs[start:stop].sum() for start, stop in zip(edges[:-1], edges[1:])]
+    assert edges[0] == 0 and edges[-1] == 400
+    assert max(chunk_costs) <= 15 * (1 + 1e-9)
+    assert len(chunk_costs) >= 4  # 60 s in all
+    assert np.diff(edges)[1] < np.diff(edges)[0]
+
+
+def test_plan_chunks_errors():
+    with pytest.raises(ValueError, match="single wavelength"):
+        plan_chunks(np.arange(10), target_walltime=1, seconds_per_wavelength=2)
+    with pytest.raises(ValueError, match="seconds_per_wavelength"):
+        plan_chunks(np.arange(10), target_walltime=1)
+    with pytest.raises(ValueError, match="same wavelength grid"):
+        plan_chunks(np.arange(10), nchunks=2, timings=([0, 5, 9], [1, 1]))
+
+
+def test_chunk_with_plan(opacity_file, tmp_path):
+    plan_file = str(tmp_path / "chunk_plan.txt")
+    save_chunk_plan(plan_chunks(np.arange(120), nchunks=4), plan_file)
+    edges = load_chunk_plan(plan_file)
+    chunk_wavelengths(opacity_file, chunk_edges=edges, progress=False)
+    assert load_chunk_manifest(base_path(opacity_file))["edges"] == list(edges)
+
+
+def test_chunk_manifest(opacity_file):
+    chunk_wavelengths(opacity_file, wav_per_chunk=50, v_max=11463.5, progress=False)
+    wavelengths = read_opacity_file(opacity_file)[0]
+    base = base_path(opacity_file)
+    assert os.path.exists(base + "_manifest.json") and manifest_path(opacity_file) == base + "_manifest.json"
+
+    manifest = load_chunk_manifest(opacity_file)
+    assert manifest["source"] == "opacFe.dat"
+    assert manifest["num_wavelengths"] == 120
+    assert manifest["nchunks"] == len(manifest["chunks"]) == 3
+    assert manifest["edges"] == [0, 49, 99, 120]
+    assert not manifest["virtual"]
+    for chunk, file in zip(manifest["chunks"], chunk_files(base)):
+        assert chunk["checksum"] == file_checksum(file)
+        assert chunk["first_wavelength"] == wavelengths[chunk["start"]]
+        assert chunk["last_wavelength"] == wavelengths[chunk["stop"] - 1]
+        assert chunk["num_wavelengths"] == chunk["stop"] - chunk["start"]
+        assert len(read_opacity_file(file)[0]) == chunk["num_wavelengths"] + chunk["overlap_next"]
+
+
+def test_stitch_chunks_drops_overlap(opacity_file):
+    chunk_wavelengths(opacity_file, nchunks=3, v_max=11463.5, progress=False)
+    wavelengths = read_opacity_file(opacity_file)[0]
+    base = base_path(opacity_file)
+
+    # a "spectrum" per chunk, computed on its wavelengths, overlap included
+    spectra = {}
+    for i, file in enumerate(chunk_files(base)):
+        grid = read_opacity_file(file)[0]
+        spectra[i] = (grid, np.full(len(grid), float(i)))
+
+    stitched_wavelengths, values = stitch_chunks(spectra, manifest_path(opacity_file))
+    np.testing.assert_array_equal(stitched_wavelengths, wavelengths)
+    edges = load_chunk_manifest(opacity_file)["edges"]
+    np.testing.assert_array_equal(values, np.repeat(np.arange(len(edges) - 1.0), np.diff(edges)))
+
+    del spectra[1]
+    stitched_wavelengths, _ = stitch_chunks(spectra, load_chunk_manifest(opacity_file))
+    assert len(stitched_wavelengths) == len(wavelengths) - (edges[2] - edges[1])
+
+
+@pytest.mark.parametrize("store", [False, True])
+def test_materialize_matches_chunks(opacity_file, tmp_path, store):
+    master = text_to_store(opacity_file, progress=False) if store else opacity_file
+    chunk_wavelengths(master, nchunks=3, v_max=11463.5, progress=False)
+    manifest = plan_chunk_views(master, nchunks=3, v_max=11463.5, progress=False)
+    assert manifest == base_path(master) + "_views_manifest.json"
+
+    views = ChunkViews(manifest)
+    base = base_path(master)
+    directory = str(tmp_path / "scratch")
+    for i, chunk in enumerate(chunk_files(base)):
+        wavelengths, _, _, opacities = read_opacity_file(chunk)
+        np.testing.assert_array_equal(views[i][0], wavelengths)
+        np.testing.assert_array_equal(views[i][1], opacities)
+        assert read_bytes(views.materialize(i, directory)) == read_bytes(chunk)
+
+
+def test_materialize_rewrites_stale_chunk(opacity_file, tmp_path):
+    chunk_wavelengths(opacity_file, nchunks=3, progress=False)
+    views = ChunkViews(plan_chunk_views(opacity_file, nchunks=3, progress=False))
+    directory = str(tmp_path / "scratch")
+    os.makedirs(directory)
+    with open(views.path(1, directory), "w") as f:
+        f.write("left over from another run\n")
+
+    file = views.materialize(1, directory)
+    chunk = base_path(opacity_file) + "1.dat"
+    assert read_bytes(file) == read_bytes(chunk)
+
+    with open(file, "a") as f:
+        f.write("damaged\n")
+    assert read_bytes(views.materialize(1, directory)) == read_bytes(chunk)
@@ -0,0 +1,154 @@
+import os
+
+import numpy as np
+import pytest
+
+from chunking_utils import chunk_wavelengths
+from conftest import write_CIA_text
+from interpolate_CIA import (
+    CIA_PAIRS,
+    CIAEvaluator,
+    chunk_wavelengths_CIA,
+    get_interpolation_weights,
+    interpolate_and_chunk_CIA,
+    interpolate_CIA,
+    read_CIA_file,
+)
+from opacity_io import load_chunk_manifest, read_opacity_file
+
+
+def test_read_CIA_file(tmp_path):
+    file = str(tmp_path / "opacCIA.dat")
+    temperatures, wavelengths, cia = write_CIA_text(file)
+
+    read = read_CIA_file(file)
+    np.testing.assert_array_equal(read[0], temperatures)
+    np.testing.assert_array_equal(read[1], wavelengths)
+    np.testing.assert_array_equal(read[2], cia)
+    assert read[2].shape == (len(temperatures), len(wavelengths), len(CIA_PAIRS))
+
+
+def test_interpolation_weights_match_np_interp():
+    wavelengths = np.array([1.0, 2.0, 4.0, 8.0])
+    new_wavelengths = np.array([0.5, 1.0, 1.5, 3.0, 4.0, 7.9, 8.0, 9.0])
+    values = np.array([3.0, -1.0, 2.0, 5.0])
+
+    lower, upper, weights = get_interpolation_weights(wavelengths, new_wavelengths)
+    interped = values[lower] + weights * (values[upper] - values[lower])
+    np.testing.assert_allclose(interped, np.interp(new_wavelengths, wavelengths, values), rtol=1e-15)
+
+
+def test_interpolate_CIA(opacity_file, tmp_path):
+    CIA_file = str(tmp_path / "opacCIA.dat")
+    temperatures, wavelengths, cia = write_CIA_text(CIA_file)
+    new_wavelengths = read_opacity_file(opacity_file)[0]
+
+    interpolate_CIA(CIA_file, opacity_file, progress=False)
+    new_temperatures, read_wavelengths, interped = read_CIA_file(str(tmp_path / "opacCIA_highres.dat"))
+    np.testing.assert_array_equal(new_temperatures, temperatures)
+    np.testing.assert_allclose(read_wavelengths, new_wavelengths, rtol=1e-9)
+
+    for t in range(len(temperatures)):
+        for pair in range(len(CIA_PAIRS)):
+            expected = np.interp(new_wavelengths, wavelengths, cia[t, :, pair])
+            np.testing.assert_allclose(interped[t, :, pair], expected, rtol=1e-9)
+
+
+@pytest.mark.parametrize("temperatures_per_batch", [1, 2, 7])
+def test_interpolate_CIA_batch_size(opacity_file, tmp_path, temperatures_per_batch):
+    CIA_file = str(tmp_path / "opacCIA.dat")
+    write_CIA_text(CIA_file)
+    expected, batched = str(tmp_path / "expected.dat"), str(tmp_path / "batched.dat")
+
+    interpolate_CIA(CIA_file, opacity_file, expected, temperatures_per_batch=4, progress=False)
+    interpolate_CIA(CIA_file, opacity_file, batched, temperatures_per_batch=temperatures_per_batch, progress=False)
+    with open(expected, "rb") as f, open(batched, "rb") as g:
+        assert f.read() == g.read()
+
+
+def test_interpolate_and_chunk_CIA(opacity_file, tmp_path):
+    """
+    Interpolating straight into chunks gives the same chunks as interpolating the whole
+    file and then chunking it, overlap included.
+    """
+    chunk_wavelengths(opacity_file, nchunks=3, v_max=11463.5, overlap_previous=True, progress=False)
+    ref_file_base = os.path.splitext(opacity_file)[0]
+
+    two_steps, fused = tmp_path / "two_steps", tmp_path / "fused"
+    two_steps.mkdir()
+    fused.mkdir()
+    for directory in (two_steps, fused):
+        write_CIA_text(str(directory / "opacCIA.dat"))
+
+    interpolate_CIA(str(two_steps / "opacCIA.dat"), opacity_file, progress=False)
+    chunk_wavelengths_CIA(str(two_steps / "opacCIA_highres.dat"), ref_file_base, progress=False)
+    interpolate_and_chunk_CIA(str(fused / "opacCIA.dat"), ref_file_base, processes=2, progress=False)
+
+    chunks = load_chunk_manifest(str(two_steps / "opacCIA_highres"))["chunks"]
+    assert load_chunk_manifest(str(fused / "opacCIA_highres"))["chunks"] == chunks
+    assert len(chunks) == len(load_chunk_manifest(ref_file_base)["chunks"])
+    for chunk in chunks:
+        with open(two_steps / chunk["file"], "rb") as f, open(fused / chunk["file"], "rb") as g:
+            assert f.read() == g.read(), chunk["file"]
+
+def test_interpolate_and_chunk_CIA_needs_reference(tmp_path):
+    CIA_file = str(tmp_path / "opacCIA.dat")
+    write_CIA_text(CIA_file)
+    with pytest.raises(ValueError, match="reference_file must be specified"):
+        interpolate_and_chunk_CIA(CIA_file, chunk_edges=[0, 20, 40], progress=False)
+
+
+@pytest.fixture
+def evaluator(tmp_path):
+    CIA_file = str(tmp_path / "opacCIA.dat")
+    write_CIA_text(CIA_file)
+    return CIAEvaluator(CIA_file)
+
+
+def test_CIA_evaluator(evaluator):
+    grid = np.linspace(0.295e-4, 0.305e-4, 25)
+    expected = np.empty((len(evaluator.temperatures), len(grid), len(CIA_PAIRS)))
+    for t, cia in enumerate(evaluator.cia):
+        for pair in range(len(CIA_PAIRS)):
+            expected[t, :, pair] = np.interp(grid, evaluator.wavelengths, cia[:, pair])
+
+    np.testing.assert_allclose(evaluator(grid), expected, rtol=1e-9)
+    assert (evaluator.hits, evaluator.misses) == (0, 1)
+    cia = evaluator(grid.copy(), pairs=["H2H2", "Hel"])
+    np.testing.assert_allclose(cia, expected[:, :, [6, 0]], rtol=1e-9)
+    assert (evaluator.hits, evaluator.misses) == (1, 1)
+
+    # temperatures between those of the table are interpolated, and those past either end held
+    cia = evaluator(grid, temperatures=[550.0, 700.0, 100.0, 5000.0])
+    np.testing.assert_allclose(cia[0], (expected[0] + expected[1]) / 2, rtol=1e-9)
+    np.testing.assert_allclose(cia[1], expected[2], rtol=1e-9)
+    np.testing.assert_allclose(cia[2], expected[0], rtol=1e-9)
+    np.testing.assert_allclose(cia[3], expected[-1], rtol=1e-9)
+
+    # what is returned is a copy, so the cache can't be changed through it
+    evaluator(grid)[:] = 0
+    np.testing.assert_allclose(evaluator(grid), expected, rtol=1e-9)
+
+
+def test_CIA_evaluator_cache_cap(evaluator):
+    grids = [np.linspace(0.295e-4, 0.305e-4, 10) * (1 + 1e-6 * i) for i in range(3)]
+    nbytes = evaluator.interpolate(grids[0]).nbytes
+    evaluator.clear_cache()
+    evaluator.max_cache_bytes = 2 * nbytes
+
+    for grid in grids:
+        evaluator(grid)
+    assert evaluator.cache_bytes == 2 * nbytes
+    assert evaluator.misses == 4
+
+    # the least recently used grid was dropped, the other two are still there
+    evaluator(grids[2])
+    evaluator(grids[1])
+    assert evaluator.misses == 4
+    evaluator(grids[0])
+    assert evaluator.misses == 5
+
+    # a grid bigger than the cap is evaluated, but not cached
+    evaluator(np.linspace(0.295e-4, 0.305e-4, 30))
+    assert evaluator.cache_bytes == 2 * nbytes
+    assert len(evaluator._cache) == 2
@@ -0,0 +1,221 @@
+import numpy as np
+import pytest
+
+from matej_resolution_functions import (
+    _BB_EXTRAPOLATION_CACHE,
+    BB_EXTRAPOLATION_CACHE_SIZE,
+    C,
+    H,
+    K_B,
+    calc_analyt_planck_in_interval,
+    convert_spectrum,
+    convolve_with_gaussian,
+    gauss_pdf,
+    tabulate_BB_extrapolation,
+)
+from rebinning_utils import get_interfaces, get_resolution_grid
+
+
+def legacy_convert_spectrum(old_lambda, old_flux, new_lambda, type="log"):
+    """
+    convert_spectrum as it was before it was built on RebinningOperator (one bin at a time, with
+    the out-of-boundary values set to zero), to check the operator against.
+    """
+    int_lambda = get_interfaces(new_lambda)
+    old_lambda = np.array(old_lambda)
+    int_flux = [0] * len(int_lambda)
+    new_flux = []
+
+    def interpolate(p_bot, x):
+        a, b = old_lambda[p_bot], old_lambda[p_bot + 1]
+        if type == "linear":
+            return (old_flux[p_bot] * (b - x) + old_flux[p_bot + 1] * (x - a)) / (b - a)
+        return (old_flux[p_bot] ** (b - x) * old_flux[p_bot + 1] ** (x - a)) ** (1 / (b - a))
+
+    def segment(f0, f1, width):
+        if type == "linear":
+            return (f0 + f1) / 2.0 * width
+        return (f0 * f1) ** (0.5 * width)
+
+    def combine(total, part):
+        return total + part if type == "linear" else total * part
+
+    def average(total, width):
+        return total / width if type == "linear" else total ** (1 / width)
+
+    for i in range(len(int_lambda)):
+        if int_lambda[i] < old_lambda[0]:
+            continue
+        elif int_lambda[i] > old_lambda[-1]:
+            break
+        int_flux[i] = interpolate(len(np.where(old_lambda < int_lambda[i])[0]) - 1, int_lambda[i])
+
+    for i in range(len(new_lambda)):
+        if int_flux[i] == 0 or int_flux[i + 1] == 0:
+            new_flux.append(0.0)
+            continue
+
+        p_start = len(np.where(old_lambda < int_lambda[i])[0])
+        for p in range(p_start, len(old_lambda)):
+            if p == p_start:
+                if old_lambda[p] < int_lambda[i + 1]:
+                    interpol = segment(int_flux[i], old_flux[p], old_lambda[p] - int_lambda[i])
+                else:
+                    # no old wavelength inside the bin
+                    interpol = average(segment(int_flux[i], int_flux[i + 1], 1.0), 1.0)
+                    break
+            elif old_lambda[p] < int_lambda[i + 1]:
+                interpol = combine(interpol, segment(old_flux[p - 1], old_flux[p], old_lambda[p] - old_lambda[p - 1]))
+            else:
+                interpol = combine(interpol, segment(old_flux[p - 1], int_flux[i + 1], int_lambda[i + 1] - old_lambda[p - 1]))
+                interpol = average(interpol, int_lambda[i + 1] - int_lambda[i])
+                break
+        new_flux.append(interpol)
+
+    return np.array(new_flux)
+
+
+@pytest.mark.parametrize("type", ["linear", "log"])
+@pytest.mark.parametrize("resolution", [2e3, 1e5])
+def test_convert_spectrum_matches_legacy(type, resolution):
+    """
+    Checked both coarser and finer than the old grid (so with bins that hold no old wavelength),
+    and past either end of it, where the flux is set to zero.
+    """
+    rng = np.random.default_rng(4)
+    old_lambda = get_resolution_grid(0.3, 0.31, 2e4)
+    old_flux = 10 ** rng.uniform(-2, 0, size=len(old_lambda))
+    old_flux[10:14] = 0.0
+    new_lambda = get_resolution_grid(0.2999, 0.3102, resolution)
+
+    new_flux = convert_spectrum(old_lambda, old_flux, new_lambda, type=type)
+    expected = legacy_convert_spectrum(old_lambda, old_flux, new_lambda, type=type)
+    np.testing.assert_allclose(new_flux, expected, rtol=1e-9)
+    assert new_flux[0] == 0 and new_flux[-1] == 0
+
+
+def test_convert_spectrum_conserves_energy():
+    old_lambda = get_resolution_grid(0.3, 0.31, 2e4)
+    old_flux = 1 + np.sin(np.linspace(0, 20, len(old_lambda))) ** 2
+    new_lambda = get_resolution_grid(0.3001, 0.3098, 3e3)
+    int_lambda = get_interfaces(new_lambda)
+
+    new_flux = convert_spectrum(old_lambda, old_flux, new_lambda, type="linear")
+    # the trapezoid rule is exact for the piecewise linear old spectrum
+    inside = (old_lambda > int_lambda[0]) & (old_lambda < int_lambda[-1])
+    nodes = np.concatenate([[int_lambda[0]], old_lambda[inside], [int_lambda[-1]]])
+    flux = np.interp(nodes, old_lambda, old_flux)
+    expected = np.sum((flux[1:] + flux[:-1]) / 2 * np.diff(nodes))
+    np.testing.assert_allclose(np.sum(new_flux * np.diff(int_lambda)), expected, rtol=1e-12)
+
+
+@pytest.mark.parametrize("type", ["linear", "log"])
+def test_convert_spectrum_2d(type):
+    rng = np.random.default_rng(5)
+    old_lambda = get_resolution_grid(0.3, 0.31, 2e4)
+    old_flux = 10 ** rng.uniform(-2, 0, size=(len(old_lambda), 6))
+    old_flux[10:14, 1] = 0.0
+    new_lambda = get_resolution_grid(0.2999, 0.3102, 5e3)
+
+    kwargs = dict(type=type, extrapolate_with_BB_T=2000)
+    new_flux = convert_spectrum(old_lambda, old_flux, new_lambda, **kwargs)
+    assert new_flux.shape == (len(new_lambda), old_flux.shape[1])
+    assert np.all(new_flux[[0, -1]] > 0)  # extrapolated past the old grid
+    for column in range(old_flux.shape[1]):
+        expected = convert_spectrum(old_lambda, old_flux[:, column], new_lambda, **kwargs)
+        np.testing.assert_array_equal(new_flux[:, column], expected)
+
+
+def legacy_convolve_with_gaussian(old_lamda, old_flux, resolution, new_lamda):
+    """
+    The point-by-point loop convolve_with_gaussian used to be, to check the exact method against.
+    """
+    delta_lamda = np.gradient(old_lamda)  # half the distance between neighbours, one-sided at either end
+
+    flux_conv = np.zeros(len(new_lamda))
+    for l in range(len(new_lamda)):
+        hwhm = new_lamda[l] / (2 * resolution)
+        for ll in range(len(old_lamda)):
+            if old_lamda[ll] - new_lamda[l] < -5 * hwhm:
+                continue
+            elif old_lamda[ll] - new_lamda[l] > 5 * hwhm:
+                break
+            flux_conv[l] += old_flux[ll] * gauss_pdf(new_lamda[l], old_lamda[ll], hwhm) * delta_lamda[ll]
+    return flux_conv
+
+
+def synthetic_spectrum(old_lamda, seed=7):
+    """
+    A continuum with a couple of hundred absorption lines, a few old points wide, in two columns.
+    """
+    rng = np.random.default_rng(seed)
+    flux = 1 + 0.1 * np.sin(old_lamda * 2e3)
+    for center, depth in zip(rng.uniform(old_lamda[0], old_lamda[-1], 200), rng.uniform(0, 0.5, 200)):
+        flux -= depth * np.exp(-(((old_lamda - center) / (center / 3e4)) ** 2))
+    return np.column_stack([flux, flux**2])
+
+
+def test_convolve_exact_matches_legacy():
+    old_lamda = get_resolution_grid(0.3, 0.302, 2e4)
+    old_flux = synthetic_spectrum(old_lamda)
+
+    new_lamda, flux_conv = convolve_with_gaussian(old_lamda, old_flux, 5e3, max_batch_size=1000)
+    assert flux_conv.shape == (len(new_lamda), 2)
+    for column in range(2):
+        expected = legacy_convolve_with_gaussian(old_lamda, old_flux[:, column], 5e3, new_lamda)
+        np.testing.assert_allclose(flux_conv[:, column], expected, rtol=1e-12)
+
+
+def test_convolve_fft_matches_exact():
+    resolution = 1e3
+    old_lamda = get_resolution_grid(0.3, 0.32, 1.25e5)
+    old_flux = synthetic_spectrum(old_lamda)
+
+    new_lamda, exact = convolve_with_gaussian(old_lamda, old_flux, resolution)
+    _, fft = convolve_with_gaussian(old_lamda, old_flux, resolution, method="fft")
+    np.testing.assert_allclose(fft, exact, rtol=2e-4)
+
+    # where the profile reaches past either end of the grid, the exact sum is used
+    new_lamda = np.array(new_lamda)
+    edge = (new_lamda * (1 - 5 / (2 * resolution)) <= old_lamda[0]) | (
+        new_lamda * (1 + 5 / (2 * resolution)) >= old_lamda[-1]
+    )
+    assert edge[0] and edge[-1]
+    np.testing.assert_array_equal(fft[edge], exact[edge])
+
+    with pytest.raises(ValueError, match="method"):
+        convolve_with_gaussian(old_lamda, old_flux, resolution, method="direct")
+
+
+def test_planck_in_interval():
+    int_lambda = get_interfaces(get_resolution_grid(0.3e-4, 3e-4, 50))
+    temperatures = np.array([300.0, 2500.0, 6000.0])
+
+    averaged = calc_analyt_planck_in_interval(temperatures[:, np.newaxis], int_lambda[:-1], int_lambda[1:])
+    assert averaged.shape == (3, len(int_lambda) - 1)
+    assert isinstance(calc_analyt_planck_in_interval(2500.0, int_lambda[0], int_lambda[1]), float)
+
+    # against the planck function averaged over each bin numerically
+    for i, temp in enumerate(temperatures):
+        for j in [0, 37, len(int_lambda) - 2]:
+            width = int_lambda[j + 1] - int_lambda[j]
+            lamda = int_lambda[j] + width * (np.arange(2000) + 0.5) / 2000  # midpoints
+            planck = 2 * H * C**2 / lamda**5 / np.expm1(H * C / (lamda * K_B * temp))
+            np.testing.assert_allclose(averaged[i, j], np.mean(planck), rtol=1e-6)
+
+
+def test_BB_extrapolation_cache():
+    int_lambda = get_interfaces(get_resolution_grid(0.3e-4, 3e-4, 50))
+    _BB_EXTRAPOLATION_CACHE.clear()
+
+    values = tabulate_BB_extrapolation(2500, int_lambda)
+    expected = np.pi * calc_analyt_planck_in_interval(2500, int_lambda[:-1], int_lambda[1:])
+    np.testing.assert_array_equal(values, expected)
+    assert not values.flags.writeable
+    assert tabulate_BB_extrapolation(2500.0, int_lambda.copy()) is values
+    assert tabulate_BB_extrapolation(2600, int_lambda) is not values
+
+    for temp in range(3000, 3000 + 2 * BB_EXTRAPOLATION_CACHE_SIZE):
+        tabulate_BB_extrapolation(temp, int_lambda)
+    assert len(_BB_EXTRAPOLATION_CACHE) == BB_EXTRAPOLATION_CACHE_SIZE
+    assert tabulate_BB_extrapolation(2500, int_lambda) is not values
@@ -0,0 +1,152 @@
+import gzip
+import json
+import os
+
+import numpy as np
+import pytest
+
+from conftest import write_opacity_text
+from opacity_io import (
+    RTWriter,
+    detect_text_format,
+    index_path,
+    load_index,
+    load_opacities,
+    open_store,
+    quantize_store,
+    read_blocks,
+    read_header,
+    read_header_text,
+    read_opacity_file,
+    read_wavelengths,
+    store_path,
+    store_to_text,
+    text_to_store,
+    verify_quantized_store,
+    write_opacity_file,
+)
+
+
+def test_read_opacity_file(tmp_path):
+    file = str(tmp_path / "opacFe.dat")
+    written = write_opacity_text(file)
+
+    for expected, read in zip(written, read_opacity_file(file)):
+        np.testing.assert_array_equal(read, expected)
+    np.testing.assert_array_equal(read_wavelengths(file), written[0])
+
+    temperatures, pressures = read_header(file)
+    np.testing.assert_array_equal(temperatures, written[2])
+    np.testing.assert_array_equal(pressures, written[1])
+
+
+def test_read_opacity_file_without_trailing_spaces(opacity_file, tmp_path):
+    """
+    Lines are told apart by how many tokens they hold, not by their spacing.
+    """
+    stripped = str(tmp_path / "stripped.dat")
+    with open(opacity_file) as f, open(stripped, "w") as g:
+        g.writelines(line.rstrip() + "\n" for line in f)
+
+    for expected, read in zip(read_opacity_file(opacity_file), read_opacity_file(stripped)):
+        np.testing.assert_array_equal(read, expected)
+
+
+def test_read_opacity_file_with_missing_value(opacity_file):
+    with open(opacity_file) as f:
+        lines = f.readlines()
+    lines[3] = lines[3].rsplit(" ", 2)[0] + "\n"  # drop the last opacity of the first line
+    with open(opacity_file, "w") as f:
+        f.writelines(lines)
+
+    with pytest.raises(ValueError, match="pressures x"):
+        read_opacity_file(opacity_file)
+
+
+def test_store_round_trip(opacity_file, tmp_path):
+    store = text_to_store(opacity_file, progress=False)
+    assert store == store_path(opacity_file)
+    assert isinstance(open_store(store).opacities, np.memmap)
+
+    for expected, stored in zip(read_opacity_file(opacity_file), load_opacities(store)):
+        np.testing.assert_array_equal(stored, expected)
+
+    copy = str(tmp_path / "copy.dat")
+    store_to_text(store, copy, progress=False)
+    with open(opacity_file, "rb") as f, open(copy, "rb") as g:
+        assert f.read() == g.read()
+
+
+def test_read_blocks_seeks_through_index(opacity_file):
+    wavelengths, _, _, opacities = read_opacity_file(opacity_file)
+    assert os.path.exists(index_path(opacity_file))
+
+    for start, stop in [(0, 1), (17, 18), (30, 77), (100, 120), (119, None)]:
+        block_wavelengths, block_opacities = read_blocks(opacity_file, start, stop)
+        stop = start + 1 if stop is None else stop
+        np.testing.assert_array_equal(block_wavelengths, wavelengths[start:stop])
+        np.testing.assert_array_equal(block_opacities, opacities[start:stop])
+
+
+def test_index_is_rebuilt_when_file_changes(opacity_file):
+    assert len(load_index(opacity_file).wavelengths) == 120
+
+    write_opacity_text(opacity_file, num_wavelengths=80, seed=5)
+    index = load_index(opacity_file)
+    np.testing.assert_array_equal(index.wavelengths, read_opacity_file(opacity_file)[0])
+    assert len(index.offsets) == 81 and index.offsets[-1] == os.path.getsize(opacity_file)
+
+
+def test_write_opacity_file(opacity_file, tmp_path):
+    """
+    The writer reproduces a file byte for byte, and the same bytes come out compressed with .gz.
+    """
+    wavelengths, pressures, temperatures, opacities = read_opacity_file(opacity_file)
+    header, text_format = read_header_text(opacity_file), detect_text_format(opacity_file)
+
+    copy = str(tmp_path / "copy.dat")
+    write_opacity_file(copy, wavelengths, pressures, temperatures, opacities, header, text_format)
+    with open(opacity_file, "rb") as f, open(copy, "rb") as g:
+        assert f.read() == g.read()
+
+    compressed = str(tmp_path / "copy.dat.gz")
+    write_opacity_file(compressed, wavelengths, pressures, temperatures, opacities, header, text_format)
+    with open(opacity_file, "rb") as f, gzip.open(compressed, "rb") as g:
+        assert f.read() == g.read()
+    for expected, read in zip((wavelengths, pressures, temperatures, opacities), read_opacity_file(compressed)):
+        np.testing.assert_array_equal(read, expected)
+    assert not [file for file in os.listdir(tmp_path) if ".tmp" in file]
+
+
+@pytest.mark.parametrize("name", ["aborted.dat", "aborted.dat.gz"])
+def test_RT_writer_abort(opacity_file, tmp_path, name):
+    wavelengths, pressures, _, opacities = read_opacity_file(opacity_file)
+    with pytest.raises(RuntimeError):
+        with RTWriter(str(tmp_path / name), read_header_text(opacity_file)) as writer:
+            writer.write_blocks(wavelengths[:10], pressures, opacities[:10])
+            raise RuntimeError("interrupted")
+    assert not [file for file in os.listdir(tmp_path) if file.startswith("aborted")]
+
+
+def test_quantization_error_bound(tmp_path):
+    file = str(tmp_path / "opacTiO.dat")
+    _, _, _, opacities = write_opacity_text(file, num_wavelengths=300, seed=3)
+    store = quantize_store(file, wavelengths_per_chunk=64, progress=False)
+
+    with open(os.path.join(store, "quantization.json")) as f:
+        quantization = json.load(f)
+    bound = 10 ** (max(quantization["scales"]) / 2) - 1
+    assert np.isclose(quantization["max_relative_error"], bound)
+
+    report = verify_quantized_store(store, file)
+    assert report["zeros_kept"]
+    assert 0 < report["max_relative_error"] <= report["bound"]
+
+    decoded = load_opacities(store)[3][:]
+    nonzero = opacities != 0
+    assert np.all(decoded[~nonzero] == 0)
+    assert np.all(np.abs(decoded[nonzero] / opacities[nonzero] - 1) <= bound)
+
+    # slices decode only the chunks they need, to the same values
+    np.testing.assert_array_equal(load_opacities(store)[3][60:130], decoded[60:130])
+    np.testing.assert_array_equal(read_blocks(store, 100, 200)[1], decoded[100:200])
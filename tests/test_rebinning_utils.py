@@ -0,0 +1,202 @@
+import os
+import subprocess
+import sys
+
+import numpy as np
+import pytest
+
+from matej_resolution_functions import convert_spectrum
+from opacity_io import (
+    file_checksum,
+    load_opacities,
+    read_opacity_file,
+    store_to_text,
+    text_to_store,
+    write_opacity_file,
+)
+from rebinning_utils import (
+    RebinningOperator,
+    StreamingRebinner,
+    build_opacity_pyramid,
+    get_rebinning_operator,
+    get_resolution_grid,
+    level_path,
+    load_pyramid_manifest,
+    operator_key,
+    rebin_opacity_file,
+    rebin_opacity_parallel,
+)
+
+
+@pytest.mark.parametrize("type", ["linear", "log"])
+@pytest.mark.parametrize("resolution", [2e3, 1e5])
+def test_operator_matches_convert_spectrum(type, resolution):
+    rng = np.random.default_rng(4)
+    old_lambda = get_resolution_grid(0.3, 0.31, 2e4)
+    old_flux = 10 ** rng.uniform(-2, 0, size=(len(old_lambda), 3))
+    old_flux[10:14, 1] = 0.0
+    new_lambda = get_resolution_grid(0.2999, 0.3102, resolution)
+
+    operator = get_rebinning_operator(old_lambda, new_lambda=new_lambda, type=type)
+    expected = convert_spectrum(old_lambda, old_flux, new_lambda, type=type)
+    np.testing.assert_array_equal(operator.apply(old_flux), expected)
+
+    # the resolution alone gives the grid rebin_spectrum_to_resolution would use
+    by_resolution = get_rebinning_operator(old_lambda, resolution=resolution, type=type)
+    expected = get_resolution_grid(old_lambda[0], old_lambda[-1], resolution)
+    np.testing.assert_array_equal(by_resolution.new_lambda, expected)
+
+
+def test_operator_cache(tmp_path):
+    cache_dir = str(tmp_path / "operators")
+    old_lambda = get_resolution_grid(0.3, 0.31, 2e4)
+    old_flux = np.random.default_rng(4).uniform(1, 2, size=(len(old_lambda), 3))
+
+    operator = get_rebinning_operator(old_lambda, resolution=3e3, cache_dir=cache_dir)
+    (file,) = os.listdir(cache_dir)
+    assert file == operator_key(old_lambda, operator.int_lambda, "log") + ".npz"
+
+    loaded = get_rebinning_operator(old_lambda, resolution=3e3, cache_dir=cache_dir)
+    assert os.listdir(cache_dir) == [file]
+    np.testing.assert_array_equal(loaded.new_lambda, operator.new_lambda)
+    np.testing.assert_array_equal(loaded.apply(old_flux), operator.apply(old_flux))
+
+    # a different grid or mode is another operator
+    get_rebinning_operator(old_lambda, resolution=3e3, type="linear", cache_dir=cache_dir)
+    get_rebinning_operator(old_lambda, resolution=4e3, cache_dir=cache_dir)
+    assert len(os.listdir(cache_dir)) == 3
+
+    # operators built from interfaces alone have no new_lambda to save
+    interfaces_only = RebinningOperator.load(os.path.join(cache_dir, file))
+    interfaces_only.new_lambda = None
+    interfaces_only.save(str(tmp_path / "interfaces.npz"))
+    assert RebinningOperator.load(str(tmp_path / "interfaces.npz")).new_lambda is None
+
+
+def read_bytes(file):
+    with open(file, "rb") as f:
+        return f.read()
+
+
+def test_rebinning_script(opacity_file, tmp_path):
+    expected, new_file = str(tmp_path / "expected.dat"), str(tmp_path / "50k-opacFe.dat")
+    rebin_opacity_file(opacity_file, expected, 5e4, progress=False)
+
+    script = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "opacity-rebinning.py")
+    cache_dir = str(tmp_path / "operators")
+    arguments = [opacity_file, new_file, "--resolution", "5e4", "--cache-dir", cache_dir, "--window", "7"]
+    subprocess.run([sys.executable, script] + arguments, check=True, capture_output=True)
+    with open(expected, "rb") as f, open(new_file, "rb") as g:
+        assert f.read() == g.read()
+    assert len(os.listdir(cache_dir)) == 1
+
+
+@pytest.mark.parametrize("type", ["linear", "log"])
+def test_rebin_opacity_file(opacity_file, tmp_path, type):
+    wavelengths, pressures, temperatures, opacities = read_opacity_file(opacity_file)
+    new_lambda = get_resolution_grid(wavelengths[0], wavelengths[-1], 5e4)
+
+    expected = convert_spectrum(wavelengths, opacities.reshape(len(wavelengths), -1), new_lambda, type=type)
+    expected = expected.reshape((len(new_lambda),) + opacities.shape[1:])
+    expected[0][expected[0] == 0] = expected[1][expected[0] == 0]
+
+    new_file = str(tmp_path / "50k-opacFe.dat")
+    rebin_opacity_file(opacity_file, new_file, 5e4, type=type, progress=False)
+    rebinned = read_opacity_file(new_file)
+    np.testing.assert_allclose(rebinned[0], new_lambda, rtol=1e-9)
+    np.testing.assert_array_equal(rebinned[1], pressures)
+    np.testing.assert_array_equal(rebinned[2], temperatures)
+    np.testing.assert_allclose(rebinned[3], expected, rtol=5e-7)
+
+    # the window of wavelengths read at once, and whether the input is a store, change nothing
+    store = text_to_store(opacity_file, progress=False)
+    for source, blocks_per_window in [(opacity_file, 1), (opacity_file, 7), (store, 4096), (store, 3)]:
+        windowed = str(tmp_path / "windowed.dat")
+        rebin_opacity_file(source, windowed, 5e4, type=type, blocks_per_window=blocks_per_window, progress=False)
+        with open(new_file, "rb") as f, open(windowed, "rb") as g:
+            assert f.read() == g.read(), (source, blocks_per_window)
+
+
+def test_streaming_rebinner_holds_a_window(opacity_file):
+    wavelengths, _, _, opacities = read_opacity_file(opacity_file)
+    operator = get_rebinning_operator(wavelengths, resolution=5e4)
+    rebinner = StreamingRebinner(operator)
+
+    runs, held = [], 0
+    for block in opacities:
+        rebinned = rebinner.push(block[np.newaxis])
+        held = max(held, len(rebinner.buffer))
+        if rebinned is not None:
+            runs.append(rebinned)
+    assert rebinner.done
+
+    # the bins come out in order, and no more old wavelengths are held than the widest bin needs
+    assert [run[0] for run in runs] == list(np.cumsum([0] + [len(run[1]) for run in runs[:-1]]))
+    starts, stops = operator.old_ranges()
+    assert held <= np.max(stops - starts) + 1
+    expected = operator.apply(opacities.reshape(len(opacities), -1)).reshape((-1,) + opacities.shape[1:])
+    np.testing.assert_array_equal(np.concatenate([run[1] for run in runs]), expected)
+
+
+def test_pyramid_matches_rebin_opacity_file(opacity_file, tmp_path):
+    base = str(tmp_path / "pyramid" / "opacFe")
+    os.makedirs(os.path.dirname(base))
+    manifest = load_pyramid_manifest(
+        build_opacity_pyramid(opacity_file, [2e4, 1e5, 5e4], base=base, blocks_per_window=7, progress=False)
+    )
+    assert manifest["resolutions"] == [1e5, 5e4, 2e4]
+
+    for level in manifest["levels"]:
+        assert level["rebinned_from"] is None
+        expected = str(tmp_path / "expected.dat")
+        rebin_opacity_file(opacity_file, expected, level["resolution"], progress=False)
+        assert read_bytes(level_path(base, level["resolution"])) == read_bytes(expected)
+        assert level["checksum"] == file_checksum(expected)
+
+    build_opacity_pyramid(opacity_file, [1e5, 2e4], base=base, store=True, progress=False)
+    for resolution in [1e5, 2e4]:
+        stored = load_opacities(level_path(base, resolution, store=True))
+        # the text levels hold the same numbers, rounded
+        for stored_array, expected in zip(stored, read_opacity_file(level_path(base, resolution))):
+            np.testing.assert_allclose(stored_array, expected, rtol=5e-7)
+
+
+@pytest.mark.parametrize("type, rtol", [("log", 2e-4), ("linear", 2e-3)])
+def test_derived_pyramid_levels(tmp_path, type, rtol):
+    """
+    Derived levels are within the tolerance build_opacity_pyramid documents for opacities that vary
+    over ~2000 old wavelengths.
+    """
+    file = str(tmp_path / "opacSmooth.dat")
+    wavelengths = 0.3e-4 * ((2e5 + 1) / 2e5) ** np.arange(6000)
+    variation = 2 * np.sin(2 * np.pi * np.arange(6000) / 2000)
+    opacities = 10 ** (-25 + variation[:, np.newaxis, np.newaxis] + np.array([[0, 0.5, 1], [1, 1.5, 2]]))
+    write_opacity_file(file, wavelengths, np.array([1.0, 10.0]), np.array([500.0, 1000.0, 1500.0]), opacities)
+
+    base = str(tmp_path / "opacSmooth")
+    manifest = load_pyramid_manifest(
+        build_opacity_pyramid(file, [5e4, 1e4], type=type, derive=True, progress=False)
+    )
+    assert [level["rebinned_from"] for level in manifest["levels"]] == [None, 5e4]
+
+    expected = str(tmp_path / "expected.dat")
+    rebin_opacity_file(file, expected, 1e4, type=type, progress=False)
+    derived = read_opacity_file(level_path(base, 1e4))
+    np.testing.assert_array_equal(derived[0], read_opacity_file(expected)[0])
+    np.testing.assert_allclose(derived[3], read_opacity_file(expected)[3], rtol=rtol)
+
+
+def test_rebin_opacity_parallel(opacity_file, tmp_path):
+    expected = str(tmp_path / "expected.dat")
+    rebin_opacity_file(opacity_file, expected, 5e4, progress=False)
+
+    store = text_to_store(opacity_file, progress=False)
+    for source in [opacity_file, store]:
+        new_file = str(tmp_path / "parallel.dat")
+        rebin_opacity_parallel(source, new_file, 5e4, processes=2, columns_per_task=5, progress=False)
+        assert read_bytes(new_file) == read_bytes(expected), source
+
+    new_store = str(tmp_path / "parallel.store")
+    rebin_opacity_parallel(store, new_store, 5e4, processes=2, progress=False)
+    store_to_text(new_store, new_file, progress=False)
+    assert read_bytes(new_file) == read_bytes(expected)